@@ -1,10 +1,58 @@
+import importlib
+import threading
 from pathlib import Path
 from collections import namedtuple
 
-from blessed import Terminal
+
+class Lazy:
+    """Proxy for an object (or module) that is only created on first use, so that
+    slow imports (blessed, pixcat, PIL, requests...) don't slow down startup,
+    or commands that never use them (eg `koneko -v`, the lscat assistants).
+    Setting an attribute (eg monkeypatching) sets it on the proxy itself.
+    """
+
+    def __init__(self, factory: 'func[T]'):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._obj = None
+
+    def _get(self) -> 'T':
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj = self._factory()
+        return self._obj
+
+    def __getattr__(self, name: str):
+        return getattr(self._get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._get()(*args, **kwargs)
+
+
+def lazy_import(module: str, attr: 'Optional[str]' = None) -> Lazy:
+    """The module (or an attribute of it), imported on first use"""
+    def load():
+        imported = importlib.import_module(module)
+        return getattr(imported, attr) if attr else imported
+    return Lazy(load)
+
+
+def _new_terminal() -> 'blessed.Terminal':
+    from blessed import Terminal
+    return Terminal()
+
+
+def __getattr__(name: str):
+    # The Terminal class is imported only when it is asked for
+    if name == 'Terminal':
+        from blessed import Terminal
+        return Terminal
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 __version__ = '0.11.0'
 KONEKODIR = Path('~/.local/share/koneko/cache').expanduser()
 WELCOME_IMAGE = KONEKODIR.parent / 'pics' / '71471144_p0.png'
-TERM = Terminal()
+TERM = Lazy(_new_terminal)
 FakeData = namedtuple('data', ('download_path',))
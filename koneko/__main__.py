@@ -1,7 +1,11 @@
-import os
 import sys
 
-from koneko import api, cli, main, utils, config
+from koneko import cli, utils, config, printer, lazy_import
+
+
+# Not needed for --help and --version
+api = lazy_import('koneko.api')
+main = lazy_import('koneko.main')
 
 
 def _main() -> 'IO':
@@ -10,12 +14,18 @@ def _main() -> 'IO':
         sys.exit(0)
 
     credentials, your_id = config.begin_config()
+    config.watch_terminal_size()
 
-    utils.handle_missing_pics()
+    if args.get('--offline'):
+        api.myapi.go_offline()
+    else:
+        utils.handle_missing_pics()
+        api.myapi.start(credentials)
 
-    api.myapi.start(credentials)
+    if args.get('mirror'):
+        return cli.launch_mirror(args)
 
-    if len(sys.argv) != 1:
+    if cli.mode_given(args):
         func = cli.launch_mode
     else:
         func = main.main_loop
@@ -25,9 +35,12 @@ def _main() -> 'IO':
             func(args, your_id)
         except KeyboardInterrupt:
             pass
+        except api.Offline as e:
+            print(f'\nOffline, and {e}')
+            input('Press enter to go back to the main menu\n')
 
-        os.system('clear')
-        main.main_loop(None, your_id)
+        printer.clear_screen()
+        func, args = main.main_loop, None
 
 
 if __name__ == '__main__':
@@ -1,15 +1,169 @@
 """Handles all Pixiv API interactions, eg async login, requests"""
 
+import os
+import time
 import threading
+from contextlib import suppress, contextmanager
+from concurrent.futures import Future
 
 import funcy
+import requests
+from requests.adapters import HTTPAdapter
 from pixivpy3 import PixivError, AppPixivAPI
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
 
-from koneko import files, utils, KONEKODIR
+from koneko import pure, files, utils, config, engine, catalog, blobstore, jsoncache, ratelimit, KONEKODIR
+
+
+IMAGE_HOSTS = ('https://i.pximg.net', 'https://s.pximg.net')
+REFERER = engine.REFERER
+# The access token is refreshed this many seconds before it expires
+REFRESH_MARGIN = 5 * 60
+# Seconds before trying again, if refreshing failed
+REFRESH_RETRY = 60
+
+
+class ConnectionStats:
+    """Thread-safe counters for the image session.
+    Every request that did not need a new connection reused a kept-alive one
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.handshake_time = 0.0  # Seconds spent on TCP + TLS handshakes
+
+    def add_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def add_connection(self, seconds: float) -> None:
+        with self._lock:
+            self.connections += 1
+            self.handshake_time += seconds
+
+    @property
+    def reused(self) -> int:
+        return max(0, self.requests - self.connections)
+
+    def as_dict(self) -> 'dict[str, float]':
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': max(0, self.requests - self.connections),
+                'handshake_time': self.handshake_time,
+            }
+
+
+class InFlight:
+    """Identical requests made while one is still in flight share its result,
+    instead of being sent again
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: 'dict[str, Future]' = {}
+        self.coalesced = 0  # Number of calls that waited on another instead
+
+    def run(self, key: str, func: 'func[T]', *args, **kwargs) -> 'T':
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._futures[key]
+        return future.result()
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """Records the time taken to open every new connection"""
+    stats: ConnectionStats  # Set on the subclass made by ImageAdapter
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        self.stats.add_connection(time.perf_counter() - start)
+
+
+class ImageAdapter(HTTPAdapter):
+    """Keeps at most pool_maxsize connections alive per image host, blocking
+    instead of opening extra connections when all of them are in use
+    """
+
+    def __init__(self, stats: ConnectionStats, pool_maxsize: int):
+        self.stats = stats
+        super().__init__(
+            pool_connections=len(IMAGE_HOSTS), pool_maxsize=pool_maxsize, pool_block=True
+        )
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        connection_cls = type(
+            'TimedHTTPSConnection', (_TimedHTTPSConnection,), {'stats': self.stats}
+        )
+        pool_cls = type(
+            'TimedHTTPSConnectionPool', (HTTPSConnectionPool,),
+            {'ConnectionCls': connection_cls}
+        )
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme, 'https': pool_cls
+        }
+
+
+def new_image_session(stats: ConnectionStats, pool_maxsize: int) -> requests.Session:
+    session = requests.Session()
+    session.headers.update({'Referer': REFERER})
+    adapter = ImageAdapter(stats, pool_maxsize)
+    for host in IMAGE_HOSTS:
+        session.mount(host, adapter)
+    session.hooks['response'].append(_observe_image_response)
+    return session
+
+
+def _observe_image_response(response, *args, **kwargs) -> None:
+    """Response hook. Errors are raised later by raise_for_status()"""
+    ratelimit.images.observe(response.status_code, response.headers)
+
+
+def _observe_api_response(response, *args, **kwargs) -> 'Maybe[IO]':
+    """Response hook for pixivpy's session. pixivpy doesn't check the status,
+    so raise for the ones worth retrying (funcy.retry will wait for the backoff)
+    """
+    if ratelimit.app_api.observe(response.status_code, response.headers):
+        raise PixivError(f'pixiv responded with status {response.status_code}')
+
+
+def _worth_retrying(error: Exception) -> bool:
+    """Pure. Only errors without a response, and the statuses in pure.worth_retrying()"""
+    response = getattr(error, 'response', None)
+    if not isinstance(error, requests.HTTPError) or response is None:
+        return True
+    return pure.worth_retrying(response.status_code)
 
 
 class APIHandler:
-    """Singleton that handles all the API interactions in the program"""
+    """Singleton that handles all the API interactions in the program.
+
+    Logging in runs in the background, and only requests that go to pixiv wait
+    for it: responses in the json cache (and the cached pages they describe) are
+    shown while still logging in, and their revalidations wait for it instead.
+    The access token is refreshed in the background shortly before it expires,
+    so requests never wait for (or fail on) an expired token.
+    In offline mode there is no login, and anything not cached raises Offline.
+    """
 
     def __init__(self):
         self._api_thread = threading.Thread(target=self._login)
@@ -17,21 +171,42 @@ class APIHandler:
         self._token = files.read_token_file(self._token_file)
         self._login_started = False
         self._login_done = False
+        self.offline = False
+        # Time (time.time()) when the access token should be refreshed; None if unknown
+        self._refresh_at: 'Optional[float]' = None
+        self._refresh_lock = threading.Lock()
+        self._refresh_timer: 'Optional[threading.Timer]' = None
 
         self._api = AppPixivAPI()  # Object to login and request on
+        self._api.requests.hooks['response'].append(_observe_api_response)
+        # Only builds requests, for the asyncio backend
+        self._preparer: 'Optional[engine.PreparingAPI]' = None
         # Set in self.start() (because singleton is instantiated before config)
         self._credentials: 'dict[str, str]'
 
+        # Created on first download, because the pool size depends on the config
+        self._image_session: 'Optional[requests.Session]' = None
+        self._session_lock = threading.Lock()
+        self.connection_stats = ConnectionStats()
+        # Shared by the mode request functions, see self._fetch()
+        self.in_flight = InFlight()
+        # Per thread: the views forgotten inside self.refreshing(), if in one
+        self._local = threading.local()
+
     def start(self, credentials):
         """Start logging in. The only setup entry point that is public"""
-        if not self._login_started:
+        if not self._login_started and not self.offline:
             self._credentials = credentials
             self._api_thread.start()
             self._login_started = True
 
+    def go_offline(self) -> None:
+        """Serve everything from the json cache and the downloaded images only"""
+        self.offline = True
+
     def _await_login(self):
         """Wait for login to finish, then assign PixivAPI session to API"""
-        if not self._login_done:
+        if self._login_started and not self._login_done:
             self._api_thread.join()
             self._login_done = True
 
@@ -45,17 +220,43 @@ class APIHandler:
             if response:
                 self._token = response['response']['refresh_token']
                 files.write_token_file(self._token_file, self._token)
+                self._schedule_refresh(pure.token_lifetime(response))
 
     def _login_with_token(self) -> bool:
         """Tries to login with saved token to avoid pixiv emails
         Returns True on successful login with token, False otherwise
         """
         try:
-            self._api.auth(refresh_token=self._token)
+            response = self._api.auth(refresh_token=self._token)
         except PixivError:
             return False
+        self._schedule_refresh(pure.token_lifetime(response))
         return True
 
+    def _schedule_refresh(self, lifetime: float) -> 'IO':
+        delay = max(0, lifetime - REFRESH_MARGIN)
+        self._refresh_at = time.time() + delay
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        self._refresh_timer = threading.Timer(delay, self._refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh(self) -> 'IO':
+        """Get a new access token with the refresh token, if it is due"""
+        with self._refresh_lock:
+            if self._refresh_at is None or time.time() < self._refresh_at:
+                return  # Already refreshed by another thread
+            try:
+                response = self._api.auth(refresh_token=self._token)
+            except (PixivError, requests.RequestException):
+                self._schedule_refresh(REFRESH_MARGIN + REFRESH_RETRY)
+                return
+            if (token := response['response']['refresh_token']) != self._token:
+                self._token = token
+                files.write_token_file(self._token_file, self._token)
+            self._schedule_refresh(pure.token_lifetime(response))
+
     def _login_with_creds(self) -> 'Optional[dict[str, dict[str]]]':
         try:
             return self._api.login(
@@ -70,59 +271,219 @@ class APIHandler:
             print(e)
             print("Press 'q' and enter to exit")
 
+    @contextmanager
+    def refreshing(self) -> 'IO':
+        """Requests made by this thread inside the block skip the json cache.
+        The first request of each view also forgets the cached responses of its
+        other pages, so that they are fetched again too (eg by the prefetch thread)
+        """
+        self._local.forgotten = set()
+        try:
+            yield
+        finally:
+            del self._local.forgotten
+
+    def _request(self, method: str, *args, **kwargs) -> 'Json':
+        """Serve the response from the on-disk cache if there is one.
+        If it is older than its TTL, it is still served, but revalidated in the background.
+        If it is older than its max stale age, it is fetched again first
+        """
+        forgotten = getattr(self._local, 'forgotten', None)
+        if forgotten is not None and not self.offline:
+            if (group := jsoncache.group(method, args, kwargs)) not in forgotten:
+                jsoncache.forget(method, args, kwargs)
+                forgotten.add(group)
+            return self._fetch(method, *args, **kwargs)
+
+        entry = jsoncache.read(method, args, kwargs)
+        if entry is None or (entry.expired and not self.offline):
+            if self.offline:
+                raise Offline(f'{pure.describe_request(method, args, kwargs)} is not cached')
+            return self._fetch(method, *args, **kwargs)
+        if not entry.fresh and not self.offline:
+            threading.Thread(
+                target=self._revalidate, args=(method, *args), kwargs=kwargs, daemon=True
+            ).start()
+        return entry.json
+
+    def _revalidate(self, method: str, *args, **kwargs) -> 'IO':
+        try:
+            self._fetch(method, *args, **kwargs)
+        except (ConnectionError, PixivError, requests.RequestException):
+            pass  # The cached response will be revalidated next time instead
+
+    def _fetch(self, method: str, *args, **kwargs) -> 'Json':
+        key = jsoncache.key(method, args, kwargs)
+        return self.in_flight.run(key, self._send_and_cache, method, *args, **kwargs)
+
+    def _send_and_cache(self, method: str, *args, **kwargs) -> 'Json':
+        result = self._send(method, *args, **kwargs)
+        if jsoncache.cacheable(result):
+            jsoncache.write(method, args, kwargs, result)
+        return result
+
+    def _send(self, method: str, *args, **kwargs) -> 'Json':
+        """Call the pixivpy method, or if the asyncio backend is used,
+        send the request it prepared on the event loop and wait for the result
+        """
+        if self.offline:
+            raise Offline(f'{pure.describe_request(method, args, kwargs)} is not cached')
+        self._await_login()
+        if self._refresh_at is not None and time.time() >= self._refresh_at:
+            self._refresh()  # The timer is late, eg after the computer was asleep
+        ratelimit.app_api.acquire()
+        if not config.api.use_asyncio():
+            return getattr(self._api, method)(*args, **kwargs)
+
+        if self._preparer is None:
+            self._preparer = engine.PreparingAPI()
+        self._preparer.set_auth(self._api.access_token, self._api.refresh_token)
+        prepared = getattr(self._preparer, method)(*args, **kwargs)
+        return engine.engine.submit(engine.engine.request_json(prepared)).result()
+
     # Public API request functions for each mode
     @funcy.retry(tries=3, errors=(ConnectionError, PixivError))
     @utils.spinner('')
     def artist_gallery(self, artist_user_id, offset) -> 'Json':
         """Mode 1"""
-        self._await_login()
-        return self._api.user_illusts(artist_user_id, offset=offset)
+        return self._request('user_illusts', artist_user_id, offset=offset)
 
     @funcy.retry(tries=3, errors=(ConnectionError, PixivError))
     def protected_illust_detail(self, image_id) -> 'Json':
         """Mode 2"""
-        self._await_login()
-        return self._api.illust_detail(image_id)
+        return self._request('illust_detail', image_id)
 
     @funcy.retry(tries=3, errors=(ConnectionError, PixivError))
     def following_user_request(self, user_id, publicity, offset) -> 'Json':
         """Mode 3"""
-        self._await_login()
-        return self._api.user_following(user_id, restrict=publicity, offset=offset)
+        return self._request('user_following', user_id, restrict=publicity, offset=offset)
 
     @funcy.retry(tries=3, errors=(ConnectionError, PixivError))
     def search_user_request(self, searchstr, offset) -> 'Json':
         """Mode 4"""
-        self._await_login()
-        return self._api.search_user(searchstr, offset=offset)
+        return self._request('search_user', searchstr, offset=offset)
 
     @funcy.retry(tries=3, errors=(ConnectionError, PixivError))
     @utils.spinner('')
     def illust_follow_request(self, restrict, offset) -> 'Json':
         """Mode 5"""
-        self._await_login()
-        return self._api.illust_follow(restrict=restrict, offset=offset)
+        return self._request('illust_follow', restrict=restrict, offset=offset)
 
     @funcy.retry(tries=3, errors=(ConnectionError, PixivError))
     @utils.spinner('')
     def illust_related_request(self, image_id, offset) -> 'Json':
         """Mode 15 (1.5 * 10 so it's an int)"""
-        self._await_login()
-        return self._api.illust_related(illust_id=image_id, offset=offset)
+        return self._request('illust_related', illust_id=image_id, offset=offset)
 
     @funcy.retry(tries=3, errors=(ConnectionError, PixivError))
     @utils.spinner('')
     def illust_recommended_request(self, offset) -> 'Json':
         """Mode 6"""
-        self._await_login()
-        return self._api.illust_recommended(offset=offset)
+        return self._request('illust_recommended', offset=offset)
 
     # Download
-    @funcy.retry(tries=3, errors=(ConnectionError, PixivError))
-    def protected_download(self, url, path, name) -> 'IO':
-        """Protect api download function with funcy.retry so it doesn't crash"""
+    def _session(self) -> requests.Session:
+        """The image session is shared by all download threads, so that
+        connections are kept alive and reused across pages
+        """
+        with self._session_lock:
+            if self._image_session is None:
+                self._image_session = new_image_session(
+                    self.connection_stats, config.api.download_workers()
+                )
+            return self._image_session
+
+    @funcy.retry(
+        tries=3,
+        errors=(ConnectionError, PixivError, requests.RequestException),
+        filter_errors=_worth_retrying,
+    )
+    def protected_download(self, url, path, name, token=None) -> 'IO':
+        """Protect download function with funcy.retry so it doesn't crash.
+        An incomplete download is kept as a partial file and resumed by the next
+        attempt. If the token is set mid-transfer, the partial file is removed
+        and utils.Cancelled is raised
+        """
+        filepath = _filepath(url, path, name)
+        if os.path.exists(filepath):
+            return False
+        if blobstore.link(url, filepath):  # Already downloaded for another page
+            catalog.db.add_file(filepath, url)
+            return True
+        if self.offline:
+            raise Offline(f'{url} is not cached')
+        self._await_login()
+
+        # Written to a partial file first, which is renamed only once complete.
+        # If a previous attempt was interrupted, only the rest is requested
+        partpath = files.partial_path(filepath)
+        offset = files.partial_size(partpath)
+
+        ratelimit.images.acquire()
+        self.connection_stats.add_request()
+        try:
+            with self._session().get(
+                url, stream=True, headers=pure.range_headers(offset)
+            ) as response:
+                if response.status_code == 416:  # The partial file is invalid
+                    _remove_if_exists(partpath)
+                response.raise_for_status()
+
+                # The server might ignore the range and send the whole file
+                start = offset if response.status_code == 206 else 0
+                with open(partpath, 'ab' if start else 'wb') as f:
+                    _copy_chunks(response.raw, f, token)
+                expected = pure.expected_size(start, response.headers)
+        except utils.Cancelled:
+            _remove_if_exists(partpath)
+            raise
+
+        size = files.partial_size(partpath)
+        if expected is not None and size != expected:
+            raise IncompleteDownload(f'Got {size} of {expected} bytes from {url}')
+        os.replace(partpath, filepath)
+        blobstore.add(url, filepath)
+        catalog.db.add_file(filepath, url)
+        return True
+
+    def download_future(self, url, path, name, token=None) -> 'Future[bool]':
+        """For the asyncio backend: download on the event loop"""
+        filepath = _filepath(url, path, name)
+        if os.path.exists(filepath):
+            future = Future()
+            future.set_result(False)
+            return future
+        if self.offline:
+            future = Future()
+            future.set_exception(Offline(f'{url} is not cached'))
+            return future
         self._await_login()
-        self._api.download(url, path=path, name=name)
+        return engine.engine.submit(engine.engine.download(url, filepath, token=token))
+
+
+def _filepath(url, path, name) -> str:
+    return os.path.join(path, name or os.path.basename(url))
+
+
+class Offline(Exception):
+    """Raised in offline mode, for a response or an image that is not cached"""
+
+
+class IncompleteDownload(requests.RequestException):
+    """Fewer bytes than the Content-Length were received. Retrying resumes it"""
+
+
+def _copy_chunks(src: 'IO', dst: 'IO', token: 'Optional[utils.CancelToken]') -> 'IO':
+    """Like shutil.copyfileobj(), but checks the token before every chunk"""
+    while chunk := src.read(engine.CHUNK_SIZE):
+        if token is not None:
+            token.check()
+        dst.write(chunk)
+
+
+def _remove_if_exists(filepath: str) -> 'IO':
+    with suppress(FileNotFoundError):
+        os.remove(filepath)
 
 
 myapi = APIHandler()
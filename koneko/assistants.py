@@ -1,11 +1,8 @@
 """prompt.py but for lscat_app"""
 
-import os
 import time
 from abc import ABC, abstractmethod
 
-from pixcat import Image
-
 from koneko import (
     pure,
     TERM,
@@ -108,7 +105,7 @@ class _AbstractImageAdjuster(ABC):
         self.start_spaces: int
 
         # Defined in start()
-        self.image: Image
+        self.image: 'pixcat.Image'
         self.width_or_height: int
         self.spaces: int
         self.valid: bool
@@ -128,7 +125,7 @@ class _AbstractImageAdjuster(ABC):
         return True
 
     @abstractmethod
-    def show_func_args(self) -> Image:
+    def show_func_args(self) -> 'pixcat.Image':
         """Show pixcat image, where the function and its args can be customized
         Returns a reference of that Image, so it can be hidden later
         """
@@ -242,7 +239,7 @@ class _XPadding(_AbstractPadding):
         # The trailing spaces at the end ensures everything is covered after exit
         printer.write(f'x spacing = {self.spaces}    ')
 
-    def show_func_args(self) -> Image:
+    def show_func_args(self) -> 'pixcat.Image':
         """Implements abstractmethod: First argument is unique"""
         return self.show_func(
             self.default_x + self.width_or_height + self.spaces, self.thumbnail_size
@@ -280,7 +277,7 @@ class _YPadding(_AbstractPadding):
         if self.use_ueberzug:
             printer.move_cursor_up(self.spaces)
 
-    def show_func_args(self) -> Image:
+    def show_func_args(self) -> 'pixcat.Image':
         """Implements abstractmethod: first argument is unique"""
         return self.show_func(self.width_or_height + self.spaces, self.thumbnail_size)
 
@@ -304,7 +301,7 @@ class _FindImageDimension(_AbstractImageAdjuster, ABC):
         """Overrides base method: erase line"""
         printer.erase_line()
 
-    def show_func_args(self) -> Image:
+    def show_func_args(self) -> 'pixcat.Image':
         """Implements abstractmethod: first argument is unique"""
         return self.show_func(self.spaces, self.thumbnail_size)
 
@@ -341,7 +338,7 @@ class _FindImageHeight(_FindImageDimension):
 
 def check_ueberzug() -> bool:
     if config.api.use_ueberzug():
-        os.system('clear')
+        printer.clear_screen()
         print(
             'The page spacing assistant is not needed if you use ueberzug, '
             'because ueberzug does not respond to scroll events'
@@ -355,7 +352,7 @@ def page_spacing_assistant(thumbnail_size: int) -> int:
     if not check_ueberzug():
         return None
 
-    os.system('clear')
+    printer.clear_screen()
     print(
         *(
             '=== Page spacing ===',
@@ -367,7 +364,7 @@ def page_spacing_assistant(thumbnail_size: int) -> int:
     )
 
     input('\nEnter any key to continue\n')
-    os.system('clear')
+    printer.clear_screen()
 
     image = lscat.api.show(WELCOME_IMAGE, 0, 0, thumbnail_size)
 
@@ -541,7 +538,7 @@ def center_spaces_assistant():
                 valid = True
 
             elif ans.name == 'KEY_ENTER':
-                os.system('clear')
+                printer.clear_screen()
                 lscat.api.hide(placement)
                 return spacing
 
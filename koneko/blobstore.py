@@ -0,0 +1,91 @@
+"""Content-addressed store of downloaded images, so that an image shown in
+several modes (eg an artist's gallery, illustfollow and illustrelated) is
+downloaded and stored only once.
+
+Blobs are keyed by the hash of their url, so a hit is known before any request
+is made. Page dirs hold hardlinks to the blobs under their own (prefixed) names,
+so everything that reads page dirs is unaffected. A blob whose only link is the
+store itself is no longer used by any page, and is removed by prune().
+If the filesystem doesn't support hardlinks, images are copied out of the store
+instead, and nothing new is added to it.
+"""
+
+import os
+import shutil
+import hashlib
+import threading
+
+from koneko import files, KONEKODIR
+
+
+BLOBDIR = KONEKODIR.parent / 'blobs'
+
+_lock = threading.Lock()
+_thread: 'Optional[threading.Thread]' = None
+
+
+def blob_path(url: str) -> 'Path':
+    """Pure"""
+    digest = hashlib.sha1(url.encode()).hexdigest()
+    return BLOBDIR / digest[:2] / digest
+
+
+def link(url: str, filepath: str) -> 'IO[bool]':
+    """Put the stored image for url at filepath. False if it isn't stored"""
+    blob = blob_path(url)
+    try:
+        os.link(blob, filepath)
+    except FileNotFoundError:
+        return False
+    except FileExistsError:
+        return True
+    except OSError:
+        shutil.copyfile(blob, filepath)
+    return True
+
+
+def add(url: str, filepath: str) -> 'IO':
+    """Store a completed download, for the other pages that show it"""
+    blob = blob_path(url)
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    # Linked to a temporary name first, like files.atomic_write()
+    tmp = files.temporary_path(blob)
+    try:
+        os.link(filepath, tmp)
+        os.replace(tmp, blob)
+    except OSError:
+        pass
+
+
+def prune() -> 'IO[int]':
+    """Remove blobs that no page links to anymore. Returns the number removed"""
+    removed = 0
+    if not BLOBDIR.is_dir():
+        return removed
+    for bucket in os.scandir(BLOBDIR):
+        for entry in os.scandir(bucket.path):
+            # Another thread might be replacing or pruning the same blob
+            try:
+                if entry.stat().st_nlink == 1:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
+
+
+def prune_in_background() -> 'IO':
+    """Start pruning in a daemon thread (it scans the whole store), unless one is
+    already running
+    """
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=prune, name='koneko-prune', daemon=True)
+        _thread.start()
+
+
+def clear() -> 'IO':
+    if BLOBDIR.is_dir():
+        shutil.rmtree(BLOBDIR)
@@ -0,0 +1,147 @@
+"""Keeps KONEKODIR within the `cache_size_limit` budget, by evicting the least
+valuable pages and posts in the background, instead of letting it grow forever.
+
+Sizes come from catalog.db, so measuring the cache doesn't walk it (or spawn du).
+The unit of eviction is a page dir, or a post in image mode: the dir of a
+multi-image post, or the image of a single-image post. Each unit is touched
+when it is displayed; units that were never displayed count as last used when
+they were downloaded. The dir of every open view (including the pages it
+prefetched) is pinned, and never evicted until the view is gone. Policies:
+    lru: evict the least recently viewed first
+    lfu: evict the least frequently viewed first, then the least recent
+"""
+
+import os
+import time
+import weakref
+import threading
+from shutil import rmtree
+from pathlib import PurePosixPath
+from collections import Counter
+
+from koneko import config, catalog, blobstore, thumbnails
+
+
+# Never evict what was viewed this recently (seconds), eg the current page
+MIN_IDLE = 10 * 60
+
+_lock = threading.Lock()
+_thread: 'Optional[threading.Thread]' = None
+# Maps each open view to its dir; a view that is garbage collected unpins itself
+_pinned: 'weakref.WeakKeyDictionary[object, Path]' = weakref.WeakKeyDictionary()
+
+
+def unit_of(filepath: 'PurePath') -> 'PurePath':
+    """Pure. The page or post that a cached file belongs to.
+    A thumbnail belongs to the same unit as its image
+    """
+    if filepath.parent.name == thumbnails.THUMBDIR:
+        return unit_of(filepath.parent.parent / filepath.name.rsplit('.', 2)[0])
+    if filepath.parent.name == 'individual':
+        return filepath
+    return filepath.parent
+
+
+def units(cached_files, accesses) -> 'dict[str, list]':
+    """Pure. Maps each unit to [size, last used, number of views].
+    The size of a file hard linked into several units is split between them,
+    so that the sizes add up to the disk usage
+    """
+    links = Counter(inode for _, _, _, inode in cached_files if inode is not None)
+    result = {}
+    for path, size, fetched, inode in cached_files:
+        unit = str(unit_of(PurePosixPath(path)))
+        if unit == '.':
+            continue
+        entry = result.setdefault(unit, [0, 0.0, 0])
+        entry[0] += (size or 0) / links.get(inode, 1)
+        entry[1] = max(entry[1], fetched or 0.0)
+
+    for unit, (accessed, hits) in accesses.items():
+        if unit in result:
+            result[unit][1] = max(result[unit][1], accessed)
+            result[unit][2] = hits
+    return result
+
+
+def is_pinned(unit: str, pinned) -> bool:
+    """Pure. Whether the unit is, or is inside, one of the pinned dirs"""
+    return any(unit == pin or unit.startswith(f'{pin}/') for pin in pinned)
+
+
+def to_evict(all_units, policy: str, budget: int, now: float, pinned=()) -> 'list[str]':
+    """Pure. The units to remove so that the total size is within budget"""
+    total = sum(size for size, _, _ in all_units.values())
+    if policy == 'lfu':
+        key = lambda unit: (all_units[unit][2], all_units[unit][1])
+    else:
+        key = lambda unit: all_units[unit][1]
+
+    evicted = []
+    for unit in sorted(all_units, key=key):
+        if total <= budget:
+            break
+        size, last_used, _ = all_units[unit]
+        if now - last_used < MIN_IDLE or is_pinned(unit, pinned):
+            continue
+        evicted.append(unit)
+        total -= size
+    return evicted
+
+
+def touch(path: 'Path') -> 'IO':
+    catalog.db.touch(path)
+
+
+def pin(view, path: 'Path') -> 'IO':
+    """Never evict anything in path while view is alive"""
+    with _lock:
+        _pinned[view] = path
+
+
+def pinned_units() -> 'IO[list[str]]':
+    """The pinned dirs, relative to the catalog root like the units"""
+    with _lock:
+        paths = list(_pinned.values())
+    return [
+        PurePosixPath(os.path.relpath(path, catalog.db.root)).as_posix()
+        for path in paths
+    ]
+
+
+def usage() -> 'IO[int]':
+    """Bytes used by the cache"""
+    return catalog.db.total_size()
+
+
+def evict() -> 'IO[list[str]]':
+    """Remove units until the cache is within budget. Returns the removed units"""
+    budget = config.api.cache_size_limit() * 1024 ** 2
+    if not budget:
+        return []
+
+    all_units = units(catalog.db.files(), catalog.db.accesses())
+    evicted = to_evict(
+        all_units, config.api.cache_eviction_policy(), budget, time.time(), pinned_units()
+    )
+    for unit in evicted:
+        path = catalog.db.root / unit
+        if os.path.isdir(path):
+            rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+            thumbnails.remove(path)
+        catalog.db.remove(path)
+    if evicted:
+        blobstore.prune_in_background()
+    return evicted
+
+
+def evict_in_background() -> 'IO':
+    """Start evicting in a daemon thread, unless one is already running"""
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=evict, name='koneko-evict', daemon=True)
+        _thread.start()
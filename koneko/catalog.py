@@ -0,0 +1,289 @@
+"""SQLite catalog of everything downloaded into KONEKODIR, so that browsing
+the cache (picker, lscat_app) and filtering it by mode are indexed queries,
+instead of os.listdir() walks over every cached artist.
+
+Every downloaded file is added by api.APIHandler.protected_download() (and
+engine.AsyncEngine.download()); removing cached dirs through koneko removes
+them here too. The first time the catalog is opened, it is filled by walking
+KONEKODIR once, so existing caches are picked up (and again if the schema changed).
+Entries deleted outside of koneko (eg, by hand) are noticed lazily: when a dir
+is listed and its mtime changed since it was last listed, it is listed on disk
+once, and the entries that are gone are removed.
+
+Paths are stored relative to the root, with '' as the root itself.
+Hidden files (page manifests, thumbnails, .koneko) are catalogued, so that they
+count towards the cache size, but are never listed; partial downloads are not.
+Files are also keyed by inode, so that hard links (see blobstore) count once.
+The access table records when (and how often) each page or post was viewed,
+for cache.evict().
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from koneko import KONEKODIR
+
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    url TEXT,
+    size INTEGER,
+    fetched REAL,
+    inode INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent, name);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+CREATE TABLE IF NOT EXISTS access (
+    path TEXT PRIMARY KEY,
+    accessed REAL NOT NULL,
+    hits INTEGER NOT NULL
+);
+"""
+
+
+class Catalog:
+    """Program-wide singleton (`catalog.db`). The connection is opened lazily
+    and shared between the download threads, behind a lock
+    """
+
+    def __init__(self, root: 'Path', dbpath: 'Path'):
+        self.root = root
+        self.dbpath = dbpath
+        self._lock = threading.RLock()
+        self._conn: 'Optional[sqlite3.Connection]' = None
+        # mtime of each dir when it was last checked against disk, by relative path
+        self._checked: 'dict[str, int]' = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.dbpath.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.dbpath, timeout=10, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                conn.execute('DROP TABLE IF EXISTS entries')  # Rebuilt below
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                self.rebuild()
+                conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        return self._conn
+
+    def _relative(self, path) -> 'Optional[str]':
+        """Pure. None if the path is outside of the root"""
+        try:
+            relative = Path(path).relative_to(self.root)
+        except ValueError:
+            return None
+        return '' if relative == Path('.') else relative.as_posix()
+
+    # Writes
+    def add_file(self, filepath, url: 'Optional[str]' = None) -> 'IO':
+        """Add a downloaded file, and every dir above it"""
+        relative = self._relative(filepath)
+        if not relative or _is_partial(os.path.basename(relative)):
+            return
+        stat = os.stat(filepath)
+        rows = [_row(relative, False, url, stat.st_size, stat.st_mtime, stat.st_ino)]
+        parent = _parent(relative)
+        while parent:
+            rows.append(_row(parent, True))
+            parent = _parent(parent)
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows[0]
+                )
+                conn.executemany(
+                    'INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    rows[1:]
+                )
+
+    def remove(self, path) -> 'IO':
+        """Remove a file or a dir, with everything inside it"""
+        relative = self._relative(path)
+        if relative is None:
+            return
+        if not relative:
+            self.clear()
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for table in ('entries', 'access'):
+                    conn.execute(
+                        f'DELETE FROM {table} WHERE path = ? OR substr(path, 1, ?) = ?',
+                        (relative, len(relative) + 1, f'{relative}/')
+                    )
+
+    def clear(self) -> 'IO':
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM entries')
+                conn.execute('DELETE FROM access')
+
+    def touch(self, path) -> 'IO':
+        """Record that a page or post was viewed"""
+        relative = self._relative(path)
+        if not relative:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT INTO access VALUES (?, ?, 1) ON CONFLICT (path)'
+                    ' DO UPDATE SET accessed = excluded.accessed, hits = hits + 1',
+                    (relative, time.time())
+                )
+
+    def rebuild(self) -> 'IO':
+        """Forget every entry, then walk the root again.
+        Views are kept for the paths that still exist
+        """
+        with self._lock:
+            self._checked.clear()
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM entries')
+            self._scan()
+            with conn:
+                conn.execute('DELETE FROM access WHERE path NOT IN (SELECT path FROM entries)')
+
+    def _scan(self) -> 'IO':
+        rows = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            relative = self._relative(dirpath)
+            for d in dirnames:
+                rows.append(_row(_join(relative, d), True))
+            for f in filenames:
+                if _is_partial(f):
+                    continue
+                stat = os.stat(os.path.join(dirpath, f))
+                rows.append(_row(
+                    _join(relative, f), False, None, stat.st_size, stat.st_mtime, stat.st_ino
+                ))
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows
+            )
+
+    # Queries
+    def children(self, path) -> 'Optional[list[str]]':
+        """Sorted names inside the dir, without hidden ones, or None if it is outside
+        of the root
+        """
+        relative = self._relative(path)
+        if relative is None:
+            return None
+        query = (
+            "SELECT name FROM entries WHERE parent = ? AND substr(name, 1, 1) != '.'"
+            " ORDER BY name"
+        )
+        names = self._names(query, (relative,))
+        if self._remove_gone(path, relative, names):
+            names = self._names(query, (relative,))
+        return names
+
+    def mode2_dirs(self) -> 'list[str]':
+        """Artist dirs with individually viewed posts. Not checked against disk;
+        they are checked when listed with children()
+        """
+        return self._names(
+            "SELECT parent FROM entries WHERE name = 'individual' AND parent != ''"
+            " AND instr(parent, '/') = 0 ORDER BY parent",
+            ()
+        )
+
+    def total_size(self) -> int:
+        """Bytes used by every catalogued file; hard links to the same file count once"""
+        with self._lock:
+            query = (
+                'SELECT TOTAL(size) FROM (SELECT MAX(size) AS size FROM entries'
+                ' WHERE is_dir = 0 GROUP BY COALESCE(inode, path))'
+            )
+            return int(self._connect().execute(query).fetchone()[0])
+
+    def files(self) -> 'list[tuple[str, int, float, int]]':
+        """(path, size, fetched, inode) of every catalogued file"""
+        with self._lock:
+            query = 'SELECT path, size, fetched, inode FROM entries WHERE is_dir = 0'
+            return self._connect().execute(query).fetchall()
+
+    def accesses(self) -> 'dict[str, tuple[float, int]]':
+        """Maps each viewed path to when it was last viewed, and how many times"""
+        with self._lock:
+            query = 'SELECT path, accessed, hits FROM access'
+            return {
+                path: (accessed, hits)
+                for path, accessed, hits in self._connect().execute(query)
+            }
+
+    def _names(self, query: str, args: tuple) -> 'list[str]':
+        with self._lock:
+            return [row[0] for row in self._connect().execute(query, args)]
+
+    def _remove_gone(self, path, relative: str, names: 'list[str]') -> 'IO[bool]':
+        """If the dir changed since it was last checked, remove the names that are
+        no longer in it. One stat per call; one listdir only if it changed.
+        Returns whether any was removed
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is not None and self._checked.get(relative) == mtime:
+            return False
+
+        on_disk = set(os.listdir(path)) if mtime is not None else set()
+        gone = [name for name in names if name not in on_disk]
+        for name in gone:
+            self.remove(Path(path) / name)
+        if mtime is not None:
+            self._checked[relative] = mtime
+        return bool(gone)
+
+    def close(self) -> 'IO':
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _parent(relative: str) -> str:
+    """Pure"""
+    return relative.rpartition('/')[0]
+
+
+def _join(parent: str, name: str) -> str:
+    """Pure"""
+    return f'{parent}/{name}' if parent else name
+
+
+def _row(relative: str, is_dir: bool, url=None, size=None, fetched=None, inode=None) -> tuple:
+    """Pure"""
+    return (
+        relative, _parent(relative), relative.rpartition('/')[2], int(is_dir),
+        url, size, fetched, inode
+    )
+
+
+def _is_partial(name: str) -> bool:
+    """Pure. Partial downloads, and the temporary files of files.atomic_write()"""
+    if not name.startswith('.'):
+        return False
+    parts = name.split('.')
+    return parts[-1] == 'part' or len(parts) > 3 and parts[-1].isdigit() and parts[-2].isdigit()
+
+
+db = Catalog(KONEKODIR, KONEKODIR.parent / 'catalog.sqlite3')
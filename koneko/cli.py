@@ -2,14 +2,15 @@
 terminal!)
 
 Usage:
-  koneko       [<link> | <searchstr>]
-  koneko [1|a] <link_or_id>
-  koneko [2|i] <link_or_id>
-  koneko (3|f) <link_or_id>
-  koneko [4|s] <searchstr>
-  koneko [5|n]
-  koneko [6|r]
-  koneko [q]
+  koneko [--offline]       [<link> | <searchstr>]
+  koneko [--offline] [1|a] <link_or_id>
+  koneko [--offline] [2|i] <link_or_id>
+  koneko [--offline] (3|f) <link_or_id>
+  koneko [--offline] [4|s] <searchstr>
+  koneko [--offline] [5|n]
+  koneko [--offline] [6|r]
+  koneko [--offline] [q]
+  koneko mirror <link_or_id> [--full]
   koneko (-h | --help)
   koneko (-v | --version)
 
@@ -18,6 +19,7 @@ Notes:
    otherwise your link would default to mode 1.
 *  It is assumed you won't need to search for an artist named '5' or 'n' from the
    command line, because it would go to mode 5.
+*  To search for an artist named 'mirror', give the (4|s) argument.
 
 Optional arguments (for specifying a mode):
   1 a  Mode 1 (Artist gallery)
@@ -27,6 +29,9 @@ Optional arguments (for specifying a mode):
   5 n  Mode 5 (Newest works from following artists ("illust follow"))
   6 r  Mode 6 (Recommended illustrations)
 
+Commands:
+  mirror  Download the whole gallery of an artist, without prompting. Can be resumed
+
 Required arguments if a mode is specified:
   <link>        Pixiv url, auto detect mode. Only works for modes 1, 2, and 4
   <link_or_id>  Either pixiv url or artist ID or image ID
@@ -35,12 +40,19 @@ Required arguments if a mode is specified:
 Options:
   (-h | --help)     Show this help
   (-v | --version)  Show version number
+  --offline         Don't login or download anything; browse only what is cached
+  --full            For mirror, also download every page of every post in full resolution
 """
 import sys  # Needed for tests
 
 from docopt import docopt
 
-from koneko import pure, main, __version__
+from koneko import pure, lazy_import, __version__
+
+
+# Not needed for --help and --version
+main = lazy_import('koneko.main')
+mirror = lazy_import('koneko.mirror')
 
 
 def handle_vh() -> 'Optional[dict]':
@@ -56,8 +68,16 @@ def handle_vh() -> 'Optional[dict]':
     return args
 
 
+def mode_given(args: 'docopt.Dict[str, str]') -> bool:
+    """Whether any argument other than --offline was given"""
+    return any(value for (key, value) in args.items() if key != '--offline')
+
+
 def launch_mode(args: 'docopt.Dict[str, str]', your_id: str):
-    print('Logging in...')
+    if args.get('--offline'):
+        print('Offline, showing only what is cached...')
+    else:
+        print('Logging in...')
 
     if (url_or_str := args['<link>']):
         return parse_no_mode(url_or_str, your_id)
@@ -68,6 +88,11 @@ def launch_mode(args: 'docopt.Dict[str, str]', your_id: str):
     return parse_mode_given(args)
 
 
+def launch_mirror(args: 'docopt.Dict[str, str]') -> 'IO':
+    print('Logging in...')
+    return mirror.mirror(pure.process_user_url(args['<link_or_id>']), full=args['--full'])
+
+
 def parse_no_mode(url_or_str: str, your_id: str):
     if 'users' in url_or_str:
         return main.ArtistModeLoop(pure.process_user_url(url_or_str)).start()
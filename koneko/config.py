@@ -4,17 +4,25 @@ Structure:
     - Safe config setting getters, will return default on failure
     - Calculations
     - Interactive config functions for first launch setup
+
+Getters are memoized until the config file is re-read. The grid geometry is
+computed once into a Layout snapshot, which is recomputed only after the terminal
+is resized (SIGWINCH, see watch_terminal_size()) or the config file is changed.
 """
 import os
+import time
+import signal
+import functools
 from enum import Enum
 from pathlib import Path
+from collections import namedtuple
 from getpass import getpass
 from configparser import ConfigParser
 
 from placeholder import m
 from returns.result import safe
 
-from koneko import pure, TERM
+from koneko import pure, printer, TERM
 
 
 @safe
@@ -41,15 +49,44 @@ class Dimension(Enum):
     y = 'height'
 
 
+def _memoized(method: 'func[T]') -> 'func[T]':
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        key = (method.__name__, args)
+        if key not in self._values:
+            self._values[key] = method(self, *args)
+        return self._values[key]
+    return wrapper
+
+
 class Config:
+    # Seconds between checks of whether the file has changed
+    CHECK_INTERVAL = 1
+
     def __init__(self, path):
         self.config_path = path
+        self._read()
+
+    def _read(self) -> 'IO':
         config_object = ConfigParser()
         config_object.read(self.config_path)
         self.config: 'dict[str, dict[str, str]' = {
             section: dict(config_object.items(section))
             for section in config_object.sections()
         }
+        self._values = {}
+        self._mtime = _mtime(self.config_path)
+        self._checked = time.monotonic()
+
+    def reload_if_changed(self) -> 'IO[bool]':
+        """Re-read the file if it was modified, checking at most every CHECK_INTERVAL"""
+        if time.monotonic() - self._checked < self.CHECK_INTERVAL:
+            return False
+        self._checked = time.monotonic()
+        if _mtime(self.config_path) == self._mtime:
+            return False
+        self._read()
+        return True
 
     @safe
     def get_setting(self, section: str, setting: str) -> 'Result[str, KeyError]':
@@ -61,41 +98,87 @@ class Config:
     def _get_int(self, section: str, setting: str, default: int) -> int:
         return self.get_setting(section, setting).bind(parse_int).value_or(default)
 
+    def _get_choice(self, section: str, setting: str, choices: 'tuple[str]') -> str:
+        """The first choice is the default, also used for invalid settings"""
+        choice = self.get_setting(section, setting).map(str.lower).value_or(choices[0])
+        return choice if choice in choices else choices[0]
+
 
     @safe
     def credentials(self) -> 'Result[dict[str, str], KeyError]':
         return self.config['Credentials']
 
+    @_memoized
     def use_ueberzug(self) -> bool:
         return self._get_bool('experimental', 'use_ueberzug', False)
 
+    @_memoized
     def scroll_display(self) -> bool:
         return self._get_bool('experimental', 'scroll_display', True)
 
+    @_memoized
     def image_mode_previews(self) -> bool:
         return self._get_bool('experimental', 'image_mode_previews', False)
 
+    @_memoized
+    def use_asyncio(self) -> bool:
+        return self._get_bool('experimental', 'use_asyncio', False)
+
+    @_memoized
+    def renderer(self) -> str:
+        """Ignored if use_ueberzug is on"""
+        return self._get_choice('experimental', 'renderer', ('kitty', 'pixcat'))
+
+    @_memoized
+    def kitty_transmission(self) -> str:
+        return self._get_choice(
+            'experimental', 'kitty_transmission', ('auto', 'file', 'shm', 'direct')
+        )
+
+    @_memoized
     def print_info(self) -> bool:
         return self._get_bool('misc', 'print_info', True)
 
+    @_memoized
     def page_spacing(self) -> int:
         return self._get_int('lscat', 'page_spacing', 23)
 
     def users_page_spacing(self) -> int:
         return self.page_spacing() - 3
 
+    @_memoized
     def thumbnail_size(self) -> int:
         return self._get_int('lscat', 'thumbnail_size', 310)
 
+    @_memoized
     def ueberzug_center_spaces(self) -> int:
         return self._get_int('experimental', 'ueberzug_center_spaces', 20)
 
+    @_memoized
+    def download_workers(self) -> int:
+        return max(1, self._get_int('performance', 'download_workers', 10))
+
+    @_memoized
+    def prefetch_depth(self) -> int:
+        return max(0, self._get_int('performance', 'prefetch_depth', 2))
+
+    @_memoized
+    def cache_size_limit(self) -> int:
+        """In MiB. 0 means unlimited"""
+        return max(0, self._get_int('performance', 'cache_size_limit', 0))
+
+    @_memoized
+    def cache_eviction_policy(self) -> str:
+        return self._get_choice('performance', 'cache_eviction_policy', ('lru', 'lfu'))
+
+    @_memoized
     def gen_users_settings(self) -> 'tuple[int, int]':
         return (
             self._get_int('lscat', 'users_print_name_xcoord', 18),
             self._get_int('lscat', 'images_x_spacing', 2)
         )
 
+    @_memoized
     def gallery_print_spacing(self) -> 'list[int]':
         return (
             self.get_setting('lscat', 'gallery_print_spacing')
@@ -104,6 +187,7 @@ class Config:
             .value_or([9, 17, 17, 17, 17])
         )
 
+    @_memoized
     def dimension(self, dimension: Dimension, fallbacks) -> 'tuple[int, int]':
         return (
             self._get_int('lscat', f'image_{dimension.value}', fallbacks[0]),
@@ -111,28 +195,99 @@ class Config:
         )
 
 
+def _mtime(path) -> 'IO[Optional[int]]':
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
 api = Config(Path('~/.config/koneko/config.ini').expanduser())
 
 
+Layout = namedtuple('Layout', (
+    'api',             # The Config it was computed from
+    'ncols',
+    'nrows',
+    'xcoords',         # Of each column
+    'users_xcoords',   # Of each column, in user modes (offset by one)
+    'ycoords',         # Of each row
+    'thumbnail_size',
+    'page_spacing',
+    'users_page_spacing',
+))
+
+_layout: 'Optional[Layout]' = None
+_watching = False
+
+
+def layout() -> Layout:
+    """The current snapshot of the grid geometry, computed if it is outdated"""
+    global _layout
+    snapshot = _layout
+    if snapshot is None or snapshot.api is not api or api.reload_if_changed():
+        snapshot = _layout = compute_layout(api, TERM.width, TERM.height)
+    return snapshot
+
+
+def compute_layout(config: Config, width: int, height: int) -> Layout:
+    width_settings = config.dimension(Dimension.x, (18, 2))
+    height_settings = config.dimension(Dimension.y, (8, 1))
+    return Layout(
+        api=config,
+        ncols=pure.ncols(width, *width_settings),
+        nrows=pure.nrows(height, *height_settings),
+        xcoords=tuple(pure.xcoords(width, *width_settings)),
+        users_xcoords=tuple(pure.xcoords(width, *width_settings, 1)),
+        ycoords=tuple(pure.ycoords(height, *height_settings)),
+        thumbnail_size=config.thumbnail_size(),
+        page_spacing=config.page_spacing(),
+        users_page_spacing=config.users_page_spacing(),
+    )
+
+
+def invalidate_layout() -> 'IO':
+    global _layout
+    _layout = None
+
+
+def watch_terminal_size() -> 'IO':
+    """Recompute the layout after the terminal is resized. Call from the main thread"""
+    global _watching
+    if _watching or not hasattr(signal, 'SIGWINCH'):
+        return
+    _watching = True
+    previous = signal.getsignal(signal.SIGWINCH)
+
+    def on_resize(signum, frame):
+        invalidate_layout()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGWINCH, on_resize)
+
+
 def ncols_config() -> int:
-    return pure.ncols(TERM.width, *api.dimension(Dimension.x, (18, 2)))
+    return layout().ncols
 
 
 def nrows_config() -> int:
-    return pure.nrows(TERM.height, *api.dimension(Dimension.y, (8, 1)))
+    return layout().nrows
 
 
-def xcoords_config(offset=0) -> 'list[int]':
-    return pure.xcoords(TERM.width, *api.dimension(Dimension.x, (18, 2)), offset)
+def xcoords_config(offset=0) -> 'tuple[int]':
+    """offset=1 for user modes, where the first column is the artist"""
+    snapshot = layout()
+    return snapshot.users_xcoords if offset else snapshot.xcoords
 
 
-def ycoords_config() -> 'list[int]':
-    return pure.ycoords(TERM.height, *api.dimension(Dimension.y, (8, 1)))
+def ycoords_config() -> 'tuple[int]':
+    return layout().ycoords
 
 
 # Technically frontend
 def begin_config() -> 'tuple[dict[str, str], str]':
-    os.system('clear')
+    printer.clear_screen()
     config_path = Path('~/.config/koneko/config.ini').expanduser()
     if config_path.exists():
         return api.credentials().unwrap(), api.get_setting('Credentials', 'id').unwrap()
@@ -167,7 +322,7 @@ def _ask_your_id(credentials) -> 'tuple[dict[str, str], str]':
 
 
 def _write_config(credentials, config_path) -> 'IO':
-    os.system('clear')
+    printer.clear_screen()
     parser = ConfigParser()
     parser.read_dict({'Credentials': credentials})
     config_path.parent.mkdir(exist_ok=True)
@@ -177,7 +332,7 @@ def _write_config(credentials, config_path) -> 'IO':
 
 
 def _append_default_config(config_path) -> 'IO':
-    # Why not use python? Because it's functional, readable, and
-    # this one liner defeats any potential speed benefits
+    """Append the example config, without its credentials section (first 8 lines)"""
     example_cfg = Path('~/.local/share/koneko/example_config.ini').expanduser()
-    os.system(f'tail {example_cfg} -n +9 >> {config_path}')
+    with open(example_cfg, 'r') as example, open(config_path, 'a') as c:
+        c.writelines(example.readlines()[8:])
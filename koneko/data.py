@@ -54,14 +54,6 @@ class AbstractData(ABC):
     def next_offset(self) -> str:
         return self.next_url.split('&')[-1].split('=')[-1]
 
-    @property
-    def is_immediate_next(self) -> bool:
-        """
-        Prevent download if not immediately next page, eg
-        p1 (p2 prefetched) -> p2 (p3) -> p1 -> p2 (p4 won't prefetch)
-        """
-        return (int(self.next_offset) - int(self.offset)) <= 30
-
     @property
     def urls_as_names(self) -> 'list[str]':
         return [pure.split_backslash_last(url) for url in self.all_urls]
@@ -130,12 +122,21 @@ class GalleryData(AbstractData):
 
 
 class UserData(AbstractData):
+    def __init__(self, main_path: 'Path'):
+        super().__init__(main_path)
+        # The raw JSON in the cache is only the list of users
+        self.all_next_urls: 'dict[int, str]' = {}
+
     # Required
     def update(self, raw: 'Json', page_num=None):
         """Adds newly requested raw json into the cache"""
         key = page_num or self.page_num
         self.all_pages_cache[key] = raw['user_previews']
-        self.next_url = raw['next_url']
+        self.all_next_urls[key] = raw['next_url']
+
+    @property
+    def next_url(self) -> str:
+        return self.all_next_urls[self.page_num]
 
     @lru_cache
     def artist_user_id(self, post_number: int) -> str:
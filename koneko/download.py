@@ -1,6 +1,12 @@
 """Download functions. See ../puml/download.puml. All of them download through
 _download_with_tracker(), which downloads through api.myapi.protected_download().
 
+All multi-image downloads are submitted to a single, program-wide DownloadPool
+(`download.pool`), so the number of download threads is bounded by the config,
+no matter how many pages (or prefetches) are downloading at the same time.
+Each download has a Priority, so that visible thumbnails are fetched first.
+With the experimental asyncio backend, downloads run on engine.engine instead.
+
 The _async_filter_and_download() branch is for downloading multiple images, and includes:
     - init_download()
         - _async_download_rename()
@@ -21,16 +27,164 @@ but ui can call download_url()
 """
 
 import os
+import heapq
+import atexit
 import itertools
+import threading
+from enum import IntEnum
 from pathlib import Path
-from shutil import rmtree
 from collections import namedtuple
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, wait, as_completed
 
+import requests
 from funcy import autocurry
 
 from koneko.data import UserData
-from koneko import api, pure, utils, files
+from koneko import api, pure, cache, utils, files, config, manifest, thumbnails
+
+
+class Priority(IntEnum):
+    """Classes of download jobs. Lower values are always started first"""
+    VISIBLE = 0    # Grid cells on the current terminal page, in display order
+    OFFSCREEN = 1  # The rest of the current page (other terminal scroll pages)
+    PREFETCH = 2   # Pages that the user has not opened yet
+    PREVIEW = 3    # Image mode previews
+    THUMBNAIL = 4  # Pre-scaling downloaded images for display (not a download)
+
+    @property
+    def is_background(self) -> bool:
+        return self >= Priority.PREFETCH
+
+
+class DownloadPool:
+    """Program-wide singleton: a bounded number of worker threads sharing one
+    priority queue. Queued background jobs (prefetch and previews) are paused while
+    there is any foreground work queued, and can only ever occupy half of the
+    workers, so that the page the user is looking at never waits for them
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap: 'list[tuple]' = []
+        self._counter = itertools.count()  # Tie breaker: FIFO within same priority
+        self._workers: 'list[threading.Thread]' = []
+        self._background_limit = 1
+        self._background_running = 0
+        self._promoted: 'dict[object, Priority]' = {}
+        self._shutdown = False
+
+    def _start_workers(self) -> 'IO':
+        """Started lazily (because singleton is instantiated before config)"""
+        if self._shutdown:
+            raise RuntimeError('Cannot submit downloads after shutdown')
+        if self._workers:
+            return
+        number_of_workers = config.api.download_workers()
+        self._background_limit = max(1, number_of_workers // 2)
+        for i in range(number_of_workers):
+            worker = threading.Thread(
+                target=self._work, name=f'koneko-download-{i}', daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _can_start_next(self) -> bool:
+        """The top of the heap is the most important job; if it is a background job
+        then there is no foreground job queued at all
+        """
+        return bool(self._heap) and (
+            not self._heap[0][0].is_background
+            or self._background_running < self._background_limit
+        )
+
+    def _work(self) -> 'IO':
+        while True:
+            with self._cond:
+                while not self._can_start_next():
+                    if self._shutdown:
+                        return
+                    self._cond.wait()
+                priority, _, _, future, func, args, token, _ = heapq.heappop(self._heap)
+                if priority.is_background:
+                    self._background_running += 1
+
+            if token is not None and token.is_set():
+                future.cancel()
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = func(*args)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+            if priority.is_background:
+                with self._cond:
+                    self._background_running -= 1
+                    self._cond.notify_all()
+
+    def submit(self, func, *args, priority=Priority.OFFSCREEN, rank=0, token=None,
+               group=None) -> Future:
+        """Queue func(*args) to be run by one of the workers.
+        Jobs of the same priority are started in ascending rank, then FIFO.
+        If the token is set before the job starts, it is cancelled instead.
+        Jobs in a group (eg, the downloads of one page) can be promoted together
+        """
+        future = Future()
+        with self._cond:
+            self._start_workers()
+            if group in self._promoted:
+                priority = min(priority, self._promoted[group])
+            heapq.heappush(
+                self._heap,
+                (priority, rank, next(self._counter), future, func, args, token, group)
+            )
+            self._cond.notify()
+        return future
+
+    def map(self, func, *iterables, priorities=None, token=None,
+            group=None) -> 'list[Future]':
+        """priorities: optional iterable of (priority, rank) for each job"""
+        priorities = priorities or itertools.repeat((Priority.OFFSCREEN, 0))
+        return [
+            self.submit(func, *args, priority=priority, rank=rank, token=token, group=group)
+            for (args, (priority, rank)) in zip(zip(*iterables), priorities)
+        ]
+
+    def promote(self, group, priority: Priority) -> 'IO':
+        """Raise the queued jobs of the group to at least the given priority, eg when
+        the user opens a page that was being prefetched. Jobs submitted to the group
+        later get it too, in case the page is still being submitted
+        """
+        with self._cond:
+            self._promoted[group] = min(priority, self._promoted.get(group, priority))
+            self._heap = [
+                (priority, *job[1:]) if job[-1] == group and job[0] > priority else job
+                for job in self._heap
+            ]
+            heapq.heapify(self._heap)
+            self._cond.notify_all()
+
+    def shutdown(self, wait_for_workers=False) -> 'IO':
+        """Cancel every queued job and stop the workers. Running jobs are not
+        interrupted; wait for them only if wait_for_workers is True
+        """
+        with self._cond:
+            self._shutdown = True
+            workers, self._workers = self._workers, []
+            for job in self._heap:
+                job[3].cancel()
+            self._heap.clear()
+            self._promoted.clear()
+            self._cond.notify_all()
+
+        if wait_for_workers:
+            for worker in workers:
+                worker.join()
+
+
+pool = DownloadPool()
+atexit.register(pool.shutdown)
 
 
 # - Wrappers around download functions, for downloading multi-images
@@ -42,30 +196,50 @@ def save_number_of_artists(data) -> 'IO':
         f.write(str(data.splitpoint))
 
 
-def init_download(data: 'data.<class>', tracker: 'lscat.<class>') -> 'IO':
-    """Download the illustrations of one page  and rename them."""
+def init_download(data: 'data.<class>', tracker: 'lscat.<class>', priority=None,
+                  token=None) -> 'IO':
+    """Download the illustrations of one page  and rename them.
+    If priority is not given, it is decided by the tracker's display order.
+    Raises utils.Cancelled if the token was set before all of them finished
+    """
     if files.dir_not_empty(data):
         return True
 
     if data.page_num == 1:
         print('Cache is outdated, reloading...')
-    if data.download_path.is_dir():
-        rmtree(data.download_path)
+    files.remove_stale_files(data.download_path, data.newnames_with_ext)
 
     if data.all_urls:
-        _async_download_rename(data, tracker)
+        _async_download_rename(data, tracker, priority, token)
+        manifest.write(
+            data.download_path, dict(zip(data.newnames_with_ext, data.all_urls))
+        )
+        _prescale_thumbnails(data)
 
     if isinstance(data, UserData):
         save_number_of_artists(data)
+    cache.evict_in_background()
+
+
+def _prescale_thumbnails(data) -> 'IO':
+    """Kitty and pixcat show the cached thumbnails; ueberzug scales images itself"""
+    if config.api.use_ueberzug():
+        return
+    size = config.api.thumbnail_size()
+    for name in data.newnames_with_ext:
+        pool.submit(
+            thumbnails.make, data.download_path / name, size, priority=Priority.THUMBNAIL
+        )
 
 
 # - Download functions for multiple images
-def _async_download_rename(data, tracker=None) -> 'IO':
+def _async_download_rename(data, tracker=None, priority=None, token=None) -> 'IO':
     newnames = itertools.filterfalse(os.path.isfile, data.newnames_with_ext)
-    _async_filter_and_download(data, newnames, tracker)
+    _async_filter_and_download(data, newnames, tracker, priority, token)
 
 
-def async_download_no_rename(download_path, urls, tracker=None) -> 'IO':
+def async_download_no_rename(download_path, urls, tracker=None, priority=None,
+                             token=None) -> 'IO':
     if not urls:
         return True
 
@@ -73,31 +247,66 @@ def async_download_no_rename(download_path, urls, tracker=None) -> 'IO':
     data = FakeData(download_path, urls)
     names = itertools.cycle((None,))
 
-    _async_filter_and_download(data, names, tracker)
+    _async_filter_and_download(data, names, tracker, priority, token)
 
 
 @utils.spinner('')
-def async_download_spinner(download_path: Path, urls) -> 'IO':
+def async_download_spinner(download_path: Path, urls, priority=None) -> 'IO':
     """Batch download in background with spinner. For mode 2; multi-image posts"""
-    async_download_no_rename(download_path, urls)
+    async_download_no_rename(download_path, urls, priority=priority)
 
 
-# Might multiprocessing be faster to bypass urllib's pool limit?
-# The lscat generator cannot be pickled, as well as api.myapi
-# essentially everything has to be rewritten with multiprocessing in mind
+def _async_filter_and_download(data, newnames, tracker, priority=None, token=None):
+    """Submit every url to the shared pool, then block until all have finished
+    (or were stopped by the token)
+    """
+    helper = _download_with_tracker(path=data.download_path, tracker=tracker, token=token)
+    priorities = _priorities(len(data.all_urls), tracker, priority)
+    os.makedirs(data.download_path, exist_ok=True)
+    if config.api.use_asyncio():
+        _engine_download(data, newnames, tracker, priorities, token)
+    else:
+        wait(pool.map(
+            helper, data.all_urls, newnames,
+            priorities=priorities, token=token, group=data.download_path
+        ))
+    if token is not None:
+        token.check()
 
 
-def _async_filter_and_download(data, newnames, tracker):
-    helper = _download_with_tracker(path=data.download_path, tracker=tracker)
-    os.makedirs(data.download_path, exist_ok=True)
-    with ThreadPoolExecutor(max_workers=len(data.all_urls)) as executor:
-        executor.map(helper, data.all_urls, newnames)
+def _engine_download(data, newnames, tracker, priorities, token=None) -> 'IO':
+    """For the asyncio backend: every download runs concurrently on the event loop.
+    They are submitted in priority order; the tracker is updated from this thread
+    """
+    jobs = sorted(zip(priorities, data.all_urls, newnames), key=lambda job: job[0])
+    futures = {
+        api.myapi.download_future(url, data.download_path, name, token): name
+        for (_, url, name) in jobs
+    }
+    for future in as_completed(futures):
+        if tracker and not future.exception():
+            tracker.update(futures[future])
+
+
+def _priorities(total: int, tracker, priority) -> 'list[tuple[Priority, int]]':
+    """Without an explicit priority, images that will be displayed on the first
+    terminal page are visible, in the order the tracker will display them
+    """
+    if priority is not None:
+        return [(priority, i) for i in range(total)]
+    if tracker is None:
+        return [(Priority.OFFSCREEN, i) for i in range(total)]
+
+    return [
+        (Priority.VISIBLE if rank < tracker.visible else Priority.OFFSCREEN, rank)
+        for rank in pure.display_ranks(tracker.orders, total)
+    ]
 
 
 @autocurry
-def _download_with_tracker(url, img_name, path, tracker) -> 'IO':
+def _download_with_tracker(url, img_name, path, tracker, token) -> 'IO':
     """Actually downloads one pic given one url"""
-    api.myapi.protected_download(url, path, img_name)
+    api.myapi.protected_download(url, path, img_name, token)
     if tracker:
         tracker.update(img_name)
 
@@ -111,6 +320,7 @@ def download_url(download_path: Path, url, filename: str) -> 'IO':
     if not Path(filename).is_file():
         print('   Downloading illustration...', flush=True, end='\r')
         api.myapi.protected_download(url, download_path, filename)
+        cache.evict_in_background()
 
 
 def download_url_verified(url, png=False) -> 'IO':
@@ -118,7 +328,12 @@ def download_url_verified(url, png=False) -> 'IO':
     url, filename, filepath = pure.full_img_details(url, png=png)
     download_path = Path('~/Downloads').expanduser()
 
-    download_url(download_path, url, filename)
+    try:
+        download_url(download_path, url, filename)
+    except requests.HTTPError:
+        if png:
+            raise
+        return download_url_verified(url, png=True)
 
     verified = files.verify_full_download(filepath)
     if not verified:
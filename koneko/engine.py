@@ -0,0 +1,206 @@
+"""Optional asyncio backend for api and download (experimental `use_asyncio` setting)
+
+One event loop runs in a background thread, and every JSON request and image
+download runs on it as a coroutine sharing a single aiohttp session, instead of
+being a blocking call inside its own thread.
+Other threads submit coroutines and get back concurrent.futures.Future objects,
+so api.APIHandler and download keep their blocking interfaces.
+
+JSON requests are built by pixivpy without being sent (see PreparingAPI), so the
+urls, headers, auth and parsing all stay pixivpy's; only the sending is replaced.
+"""
+
+import os
+import atexit
+import asyncio
+import threading
+from contextlib import suppress
+from collections import namedtuple
+from concurrent.futures import Future
+
+from pixivpy3 import PixivError, AppPixivAPI
+
+from koneko import pure, utils, files, config, catalog, blobstore, ratelimit
+
+
+REFERER = 'https://app-api.pixiv.net/'
+CHUNK_SIZE = 64 * 1024
+
+PreparedRequest = namedtuple(
+    'PreparedRequest', ('method', 'url', 'headers', 'params', 'data')
+)
+
+
+class PreparingAPI(AppPixivAPI):
+    """Every pixivpy request method returns the request it would have sent"""
+
+    def requests_call(self, method, url, headers=None, params=None, data=None,
+                      stream=False) -> PreparedRequest:
+        merged_headers = self.additional_headers.copy()
+        merged_headers.update(headers or {})
+        return PreparedRequest(method, url, dict(merged_headers), params, data)
+
+    def parse_result(self, req: PreparedRequest) -> PreparedRequest:
+        return req
+
+
+async def _in_thread(func, *args) -> 'T':
+    """Run the blocking func in the loop's default executor"""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def _link_downloaded(url: str, filepath: str) -> 'IO[bool]':
+    """Link the image if it was already downloaded for another page"""
+    if blobstore.link(url, filepath):
+        catalog.db.add_file(filepath, url)
+        return True
+    return False
+
+
+def _remove_partial(filepath: str) -> 'IO':
+    with suppress(FileNotFoundError):
+        os.remove(files.partial_path(filepath))
+
+
+def _save_download(partpath: str, filepath: str, url: str) -> 'IO':
+    os.replace(partpath, filepath)
+    blobstore.add(url, filepath)
+    catalog.db.add_file(filepath, url)
+
+
+class AsyncEngine:
+    """Program-wide singleton, owns the event loop thread and the aiohttp session"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: 'Optional[asyncio.AbstractEventLoop]' = None
+        self._thread: 'Optional[threading.Thread]' = None
+        # Only touched inside the loop thread, so they need no lock
+        self._aiohttp: 'module'
+        self._session: 'Optional[aiohttp.ClientSession]' = None
+        self._semaphore: 'asyncio.Semaphore'
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        """Started lazily, so that aiohttp is only needed if the backend is used"""
+        with self._lock:
+            if self._loop is None:
+                self._aiohttp = utils.try_import_aiohttp()
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name='koneko-asyncio', daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro: 'Coroutine[T]') -> 'Future[T]':
+        """Run the coroutine on the event loop, from any other thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self._start())
+
+    async def _get_session(self) -> 'aiohttp.ClientSession':
+        if self._session is None:
+            limit = config.api.download_workers()
+            self._semaphore = asyncio.Semaphore(limit)
+            self._session = self._aiohttp.ClientSession(
+                connector=self._aiohttp.TCPConnector(limit=limit)
+            )
+        return self._session
+
+    async def request_json(self, prepared: PreparedRequest) -> 'Json':
+        session = await self._get_session()
+        async with session.request(
+            prepared.method,
+            prepared.url,
+            headers=prepared.headers,
+            params=prepared.params,
+            data=prepared.data,
+        ) as response:
+            text = await response.text()
+        if ratelimit.app_api.observe(response.status, response.headers):
+            raise PixivError(f'pixiv responded with status {response.status}')
+
+        try:
+            return AppPixivAPI.parse_json(text)
+        except ValueError as e:
+            raise PixivError(
+                f'parse_json() error: {e}', header=response.headers, body=text
+            )
+
+    async def download(self, url: str, filepath: str, tries=3, token=None) -> bool:
+        """Stream one image to filepath, through a partial file like
+        api.APIHandler.protected_download(). At most download_workers at a time.
+        If the token is set mid-transfer, the partial file is removed
+        and utils.Cancelled is raised.
+        Like the sync path, client errors other than pure.worth_retrying() are not retried.
+        File and catalog I/O runs in the loop's executor, so it never blocks other downloads
+        """
+        if await _in_thread(_link_downloaded, url, filepath):
+            return True
+
+        session = await self._get_session()
+        async with self._semaphore:
+            for attempt in range(tries):
+                # Waiting for the bucket (or its backoff) doesn't block the loop
+                await asyncio.sleep(ratelimit.images.reserve())
+                try:
+                    return await self._download_once(session, url, filepath, token)
+                except self._aiohttp.ClientResponseError as e:
+                    if attempt + 1 == tries or not pure.worth_retrying(e.status):
+                        raise
+                except self._aiohttp.ClientError:
+                    if attempt + 1 == tries:
+                        raise
+                except utils.Cancelled:
+                    await _in_thread(_remove_partial, filepath)
+                    raise
+
+    async def _download_once(self, session, url: str, filepath: str, token) -> bool:
+        if token is not None:
+            token.check()
+        partpath = files.partial_path(filepath)
+        offset = await _in_thread(files.partial_size, partpath)
+        headers = {'Referer': REFERER, **pure.range_headers(offset)}
+
+        async with session.get(url, headers=headers) as response:
+            ratelimit.images.observe(response.status, response.headers)
+            if response.status == 416:  # The partial file is invalid
+                await _in_thread(os.remove, partpath)
+            response.raise_for_status()
+
+            # The server might ignore the range and send the whole file
+            start = offset if response.status == 206 else 0
+            f = await _in_thread(open, partpath, 'ab' if start else 'wb')
+            try:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if token is not None:
+                        token.check()
+                    await _in_thread(f.write, chunk)
+            finally:
+                await _in_thread(f.close)
+            expected = pure.expected_size(start, response.headers)
+
+        size = await _in_thread(files.partial_size, partpath)
+        if expected is not None and size != expected:
+            # Retried (and resumed) by self.download()
+            raise self._aiohttp.ClientPayloadError(
+                f'Got {size} of {expected} bytes from {url}'
+            )
+        await _in_thread(_save_download, partpath, filepath, url)
+        return True
+
+    async def _close_session(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def shutdown(self) -> 'IO':
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_session(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=5)
+
+
+engine = AsyncEngine()
+atexit.register(engine.shutdown)
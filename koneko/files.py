@@ -1,19 +1,89 @@
 import os
 import imghdr
+import threading
 from pathlib import Path
-from shutil import rmtree
+from shutil import rmtree, disk_usage
+from contextlib import suppress
 
 from placeholder import _
-from funcy import curry, lfilter
-from returns.pipeline import flow
+from funcy import lfilter
 
-from koneko import KONEKODIR
+from koneko import KONEKODIR, catalog, manifest, thumbnails
+
+
+PARTIAL_SUFFIX = '.part'
+
+
+# Partial downloads
+def partial_path(filepath: str) -> str:
+    """Pure. Downloads are written here first, then renamed to filepath when complete.
+    Hidden, so they are never displayed
+    """
+    head, tail = os.path.split(filepath)
+    return os.path.join(head, f'.{tail}{PARTIAL_SUFFIX}')
+
+
+def is_partial(name: str) -> bool:
+    """Pure"""
+    return name.startswith('.') and name.endswith(PARTIAL_SUFFIX)
+
+
+def without_partial(names: 'list[str]') -> 'list[str]':
+    """Pure"""
+    return [name for name in names if not is_partial(name)]
+
+
+def partial_size(partpath: str) -> 'IO[int]':
+    """Number of bytes already downloaded, ie the offset to resume from"""
+    try:
+        return os.path.getsize(partpath)
+    except OSError:
+        return 0
+
+
+# Atomic writes
+def temporary_path(path: 'Path') -> 'Path':
+    """Hidden, and unique to the process and thread, so writers never collide"""
+    return path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}')
+
+
+def atomic_write(path: 'Path', data: 'Union[str, bytes]') -> 'IO':
+    """Write to a temporary file first, then rename it over path, so that readers
+    (and other processes) never see a half written file, even if this one crashes
+    """
+    tmp = temporary_path(path)
+    try:
+        with open(tmp, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp)
+        raise
 
 
 # Outbound IO
 def remove_dir_if_exist(data) -> 'Maybe[IO]':
     if data.download_path.is_dir():
         rmtree(data.download_path)
+        catalog.db.remove(data.download_path)
+
+def remove_stale_files(download_path: Path, names: 'list[str]') -> 'Maybe[IO]':
+    """Remove everything in the dir except the given names, their partial downloads
+    and the thumbnail cache, so that an interrupted page is resumed instead of
+    downloaded again from scratch
+    """
+    if not download_path.is_dir():
+        return
+    keep = set(names) | {partial_path(name) for name in names} | {thumbnails.THUMBDIR}
+    for entry in os.scandir(download_path):
+        if entry.name in keep:
+            continue
+        if entry.is_dir():
+            rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+        catalog.db.remove(entry.path)
 
 def verify_full_download(filepath: Path) -> 'IO[bool]':
     verified = imghdr.what(filepath)
@@ -40,13 +110,17 @@ def read_invis(data) -> 'IO[int]':
     with open(data.download_path / '.koneko', 'r') as f:
         return int(f.read())
 
+def free_space(path: 'Path') -> 'IO[int]':
+    """Bytes free on the filesystem of path, or of its closest existing parent"""
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return disk_usage(path).free
+
 def filter_history(path: 'Path') -> 'list[str]':
-    return flow(
-        path,
-        os.listdir,
-        sorted,
-        curry(lfilter)(_ != 'history')
-    )
+    """Paths inside KONEKODIR are looked up in the catalog instead of listed"""
+    if (names := catalog.db.children(path)) is None:
+        names = sorted(os.listdir(path))
+    return lfilter(_ != 'history', names)
 
 
 def _dir_up_to_date(data, sorted_dir) -> bool:
@@ -62,19 +136,32 @@ def _dir_up_to_date(data, sorted_dir) -> bool:
 
 
 def dir_not_empty(data: 'Data') -> bool:
-    if data.download_path.is_dir() and (_dir := os.listdir(data.download_path)):
-        sorted_dir = sorted(_dir)
-        if '.koneko' in sorted_dir[0]:
-            return _dir_up_to_date(data, sorted_dir[1:])
-        return _dir_up_to_date(data, sorted_dir)
+    if (names := manifest.names(data.download_path)) is not None:
+        return _dir_up_to_date(data, names)
+
+    # Pages downloaded before manifests existed
+    if data.download_path.is_dir() and (_dir := _visible_files(data.download_path)):
+        return _dir_up_to_date(data, sorted(_dir))
     return False
 
 
+def page_names(download_path: 'Path') -> 'list[str]':
+    """Sorted names of the images in a page, from its manifest if it has one"""
+    if (names := manifest.names(download_path)) is not None:
+        return names
+    return sorted(_visible_files(download_path))
+
+
+def _visible_files(path: 'Path') -> 'list[str]':
+    """Hidden files (.koneko, the manifest and partial downloads) are not images"""
+    return [f for f in os.listdir(path) if not f.startswith('.')]
+
+
 def filter_dir(modes: 'list[str]') -> 'list[str]':
     """Given a list of modes to include, filter KONEKODIR to those modes"""
     allowed_names = filter_modes_allowed(modes)
     predicate = filter_modes_predicate(modes, allowed_names)
-    return [d for d in os.listdir(KONEKODIR) if predicate(d)]
+    return [d for d in catalog.db.children(catalog.db.root) if predicate(d)]
 
 
 def filter_modes_allowed(modes: 'list[str]') -> 'set[str]':
@@ -95,16 +182,13 @@ def filter_modes_predicate(modes: 'list[str]', allowed_names: 'set[str]') -> 'fn
     if '1' in modes:
         return lambda d: d.isdigit() or d in allowed_names
     elif '2' in modes:
-        return lambda d: d in find_mode2_dirs() or d in allowed_names
+        mode2_dirs = set(find_mode2_dirs())
+        return lambda d: d in mode2_dirs or d in allowed_names
     return lambda d: d in allowed_names
 
 
 def find_mode2_dirs() -> 'list[str]':
-    return [
-        f for f in os.listdir(KONEKODIR)
-        if f.isdigit()
-        and 'individual' in os.listdir(KONEKODIR / f)
-    ]
+    return [f for f in catalog.db.mode2_dirs() if f.isdigit()]
 
 
 def valid_mode1(path: 'Path') -> bool:
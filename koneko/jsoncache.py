@@ -0,0 +1,113 @@
+"""Persistent cache of API JSON responses, so that cached pages can be shown
+without waiting for a network round trip.
+
+Responses are keyed by the pixivpy method (the endpoint) and its arguments
+(which include the offset), and kept outside of KONEKODIR so that they never
+appear in the page dirs. The pages of one view (the same arguments, except the
+offset) are grouped in a dir, so that they can be forgotten together.
+The mtime of each file is the last time the response was known to be up to
+date, compared against a per-endpoint TTL and MAX_STALE.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+from collections import namedtuple
+
+from pixivpy3 import AppPixivAPI
+
+from koneko import files, KONEKODIR
+
+
+JSONDIR = KONEKODIR.parent / 'json'
+
+# Seconds a response is fresh for. Stale responses are still served,
+# but are revalidated in the background.
+TTL = {
+    'user_illusts': 60 * 60,
+    'illust_detail': 24 * 60 * 60,
+    'user_following': 24 * 60 * 60,
+    'search_user': 24 * 60 * 60,
+    'illust_follow': 10 * 60,
+    'illust_related': 24 * 60 * 60,
+    'illust_recommended': 60 * 60,
+}
+
+# Seconds a stale response can still be served for (while it is revalidated).
+# Older responses are fetched again before being shown, except offline.
+MAX_STALE = {
+    'user_illusts': 7 * 24 * 60 * 60,
+    'illust_detail': 30 * 24 * 60 * 60,
+    'user_following': 30 * 24 * 60 * 60,
+    'search_user': 30 * 24 * 60 * 60,
+    'illust_follow': 24 * 60 * 60,
+    'illust_related': 30 * 24 * 60 * 60,
+    'illust_recommended': 24 * 60 * 60,
+}
+
+Entry = namedtuple('Entry', ('json', 'fresh', 'expired'))
+
+
+def key(method: str, args: tuple, kwargs: dict) -> str:
+    """Pure. Arguments are compared as strings: ids and offsets are passed as ints
+    in some places and as strs in others, for the same request
+    """
+    request = json.dumps(
+        [method, [str(arg) for arg in args], {k: str(v) for k, v in kwargs.items()}],
+        sort_keys=True,
+    )
+    return hashlib.sha1(request.encode()).hexdigest()
+
+
+def group(method: str, args: tuple, kwargs: dict) -> str:
+    """Pure. The same for every page of a view"""
+    return key(method, args, {k: v for k, v in kwargs.items() if k != 'offset'})
+
+
+def _path(method, args, kwargs) -> 'Path':
+    return JSONDIR / method / group(method, args, kwargs) / f'{key(method, args, kwargs)}.json'
+
+
+def read(method: str, args: tuple, kwargs: dict) -> 'Optional[Entry]':
+    path = _path(method, args, kwargs)
+    try:
+        age = time.time() - path.stat().st_mtime
+        with open(path, 'r') as f:
+            raw = AppPixivAPI.parse_json(f.read())
+    except (OSError, ValueError):
+        return None
+    return Entry(raw, age < TTL.get(method, 0), age >= MAX_STALE.get(method, 0))
+
+
+def write(method: str, args: tuple, kwargs: dict, raw: 'Json') -> 'IO[bool]':
+    """Returns True if the response changed, False if it was only revalidated"""
+    path = _path(method, args, kwargs)
+    text = json.dumps(raw, sort_keys=True)
+    try:
+        with open(path, 'r') as f:
+            if f.read() == text:
+                os.utime(path)
+                return False
+    except OSError:
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    files.atomic_write(path, text)
+    return True
+
+
+def cacheable(raw: 'Json') -> bool:
+    """Pure. Don't cache mocks, or the error responses pixiv sends with status 200"""
+    return isinstance(raw, dict) and 'error' not in raw
+
+
+def forget(method: str, args: tuple, kwargs: dict) -> 'IO':
+    """Remove the cached responses of every page of the view"""
+    shutil.rmtree(JSONDIR / method / group(method, args, kwargs), ignore_errors=True)
+
+
+def clear() -> 'IO':
+    if JSONDIR.is_dir():
+        shutil.rmtree(JSONDIR)
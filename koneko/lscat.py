@@ -3,13 +3,11 @@
 1) The ui classes start the download with the appropriate tracker instance.
    The tracker's update method acts as a callback upon a finished download
 2) After each image finishes downloading, the callback is triggered (`tracker.update()`)
-3) The `update()` method stores which images have finished downloading and their
-   respective number, but has not been displayed yet.
-4) On every callback, the `update()` method inspects the list against the given order.
-   If the next image to be shown is in the list, it is displayed.
-5) Immediately, remove the image from the lists and repeat the `_inspect()` method
-   for the next valid image. If there is one, repeat. If not, do nothing and wait for
-   more completed downloads
+3) The `update()` method stores the finished image in the slot of its number,
+   according to the given order.
+4) Then, every image from the next slot onwards that has finished downloading is
+   displayed, in order. At the first empty slot, do nothing and wait for more
+   completed downloads
 
 TLDR if you want to write your own renderer (with icat or not), the API is:
     - Provide a `tracker` with an `update()` method that receives completed downloads
@@ -17,13 +15,25 @@ TLDR if you want to write your own renderer (with icat or not), the API is:
 """
 
 import os
+import atexit
+import base64
+import random
+import itertools
 import threading
 from abc import ABC, abstractmethod
+from contextlib import suppress
+from collections import OrderedDict, namedtuple
 
-from pixcat import Image
 from returns.result import safe
 
-from koneko import pure, TERM, utils, files, config, printer, WELCOME_IMAGE
+from koneko import pure, TERM, cache, utils, files, config, printer, thumbnails, WELCOME_IMAGE
+from koneko import Lazy, lazy_import
+
+
+# Imported on first use (pixcat imports PIL and blessed)
+Image = lazy_import('pixcat', 'Image')
+shared_memory = lazy_import('multiprocessing.shared_memory')
+resource_tracker = lazy_import('multiprocessing.resource_tracker')
 
 
 class Display(ABC):
@@ -57,17 +67,158 @@ class Display(ABC):
 
 
 class Pixcat(Display):
-    """Program-wide singleton, central handler for pixcat images"""
+    """Program-wide singleton, central handler for pixcat images.
+    pixcat waits for kitty to answer each command, so they bypass printer.frame()
+    """
 
     def show(self, image_path, x, y, size) -> 'pixcat.Image':
-        return Image(image_path).thumbnail(size).show(align='left', x=x, y=y)
+        try:
+            image_path = thumbnails.make(image_path, size) or image_path
+        except OSError:  # Not an image; pixcat will deal with it
+            pass
+        with printer.unbuffered():
+            return Image(image_path).thumbnail(size).show(align='left', x=x, y=y)
 
     def show_center(self, image_path):
-        return Image(image_path).show(y=0)
+        with printer.unbuffered():
+            return Image(image_path).show(y=0)
 
     def hide(self, image: 'pixcat.Image'):
         if image:
-            image.hide()
+            with printer.unbuffered():
+                image.hide()
+
+
+KittyPlacement = namedtuple('KittyPlacement', ('image_id', 'placement_id'))
+
+
+class Kitty(Pixcat):
+    """Program-wide singleton, the default renderer. Each thumbnail is uploaded to
+    kitty only once, under a stable image ID; showing it again (eg scrolling back)
+    only sends a placement command of a few bytes. Hiding deletes the placement but
+    keeps the image in kitty; the least recently shown images are deleted from
+    kitty when there are more than MAX_UPLOADED, so its memory stays bounded.
+    Clearing the screen frees every image that is not placed, so after a clear
+    (see printer.cleared) every thumbnail is uploaded again.
+    Images that can't be cached as thumbnails are shown by pixcat, as before.
+
+    Transmission mediums (see pure.kitty_medium()):
+        file: kitty reads the thumbnail from its path; only the path goes over the pty
+        shm: the thumbnail is copied into POSIX shared memory, which kitty reads
+        direct: the thumbnail is sent inline as base64, for remote terminals (ssh)
+    """
+
+    MAX_UPLOADED = 256
+
+    def __init__(self, medium='file'):
+        self.medium = medium
+        self._lock = threading.Lock()
+        self._uploaded: 'OrderedDict[tuple[str, int], int]' = OrderedDict()
+        self._cleared = printer.cleared  # When self._uploaded was last valid
+        # Random start (like pixcat) so that the IDs don't clash with other programs
+        self._image_ids = itertools.count(random.randint(1, 2 ** 31))
+        self._placement_ids = itertools.count(1)
+
+    def show(self, image_path, x, y, size) -> 'Union[KittyPlacement, pixcat.Image]':
+        try:
+            thumbnail = thumbnails.make(image_path, size)
+        except OSError:  # Not an image; pixcat will deal with it
+            thumbnail = None
+        if thumbnail is None:
+            return super().show(image_path, x, y, size)
+
+        with self._lock:
+            image_id = self._upload(thumbnail)
+            placement = KittyPlacement(image_id, next(self._placement_ids))
+            print(TERM.move_x(x), end='')
+            print(TERM.move_y(y), end='')
+            print(pure.kitty_code(a='p', i=image_id, p=placement.placement_id, q=2))
+        return placement
+
+    def _upload(self, thumbnail: 'Path') -> int:
+        """Returns the image ID of the thumbnail, transmitting it if needed.
+        Keyed by mtime too, so that a thumbnail that was made again is sent again
+        """
+        if self._cleared != printer.cleared:
+            self._uploaded.clear()
+            self._cleared = printer.cleared
+
+        key = (str(thumbnail), thumbnail.stat().st_mtime_ns)
+        if key in self._uploaded:
+            self._uploaded.move_to_end(key)
+            return self._uploaded[key]
+
+        image_id = self._uploaded[key] = next(self._image_ids)
+        if self.medium == 'shm':
+            print(_transmit_shm(image_id, thumbnail), end='')
+        elif self.medium == 'direct':
+            print(_transmit_direct(image_id, thumbnail), end='')
+        else:
+            print(_transmit_file(image_id, thumbnail), end='')
+
+        while len(self._uploaded) > self.MAX_UPLOADED:
+            _, evicted = self._uploaded.popitem(last=False)
+            print(pure.kitty_code(a='d', d='I', i=evicted, q=2), end='')
+        return image_id
+
+    def hide(self, image: 'Union[KittyPlacement, pixcat.Image]'):
+        if isinstance(image, KittyPlacement):
+            # Lowercase: delete the placement, but keep the image for later
+            print(pure.kitty_code(a='d', d='i', i=image.image_id, p=image.placement_id,
+                                  q=2), end='', flush=True)
+        else:
+            super().hide(image)
+
+
+def _b64(data: bytes) -> str:
+    return base64.standard_b64encode(data).decode()
+
+
+def _transmit_file(image_id: int, thumbnail: 'Path') -> str:
+    return pure.kitty_code(
+        _b64(str(thumbnail).encode()), a='t', t='f', f=100, i=image_id, q=2
+    )
+
+
+# Names of the segments sent to kitty. Kitty unlinks each after reading it;
+# any it never read (eg, an error hidden by q=2) is unlinked on exit
+_shm_segments: 'list[str]' = []
+
+
+def _transmit_shm(image_id: int, thumbnail: 'Path') -> 'IO[str]':
+    data = thumbnail.read_bytes()
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        shm.buf[:len(data)] = data
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    name = f'/{shm.name}'
+    shm.close()
+    # Not the resource tracker's, which would unlink it before kitty reads it
+    resource_tracker.unregister(name, 'shared_memory')
+    if not _shm_segments:
+        atexit.register(_unlink_shm_segments)
+    _shm_segments.append(shm.name)
+    return pure.kitty_code(
+        _b64(name.encode()), a='t', t='s', f=100, S=len(data), i=image_id, q=2
+    )
+
+
+def _unlink_shm_segments() -> 'IO':
+    while _shm_segments:
+        name = _shm_segments.pop()
+        with suppress(FileNotFoundError):
+            shm = shared_memory.SharedMemory(name)
+            shm.close()
+            shm.unlink()
+
+
+def _transmit_direct(image_id: int, thumbnail: 'Path') -> 'IO[str]':
+    return ''.join(pure.kitty_chunked_codes(
+        _b64(thumbnail.read_bytes()), a='t', t='d', f=100, i=image_id, q=2
+    ))
 
 
 class Ueberzug(Display):
@@ -112,7 +263,16 @@ class Ueberzug(Display):
             placement.visibility = self.invisible
 
 
-api = Ueberzug() if config.api.use_ueberzug() else Pixcat()
+def _new_display() -> Display:
+    if config.api.use_ueberzug():
+        return Ueberzug()
+    if config.api.renderer() == 'pixcat':
+        return Pixcat()
+    return Kitty(pure.kitty_medium(config.api.kitty_transmission(), os.environ))
+
+
+# Chosen on first use, so that importing lscat doesn't read the config or import pixcat
+api = Lazy(_new_display)
 
 
 def show_single_x(x: int, thumbnail_size: int) -> 'IO[Image]':
@@ -124,70 +284,100 @@ def show_single_y(y: int, size: int) -> 'IO[Image]':
 
 
 def handle_scroll(cls, data, myslice):
-    tracker = cls(data)
-    tracker.orders = tracker.orders[myslice]
-    for x in sorted(os.listdir(data.download_path)):
-        if not x.startswith('.'):
+    cache.touch(data.download_path)
+    # The tracker clears the screen, so it is part of the frame too
+    with printer.frame():
+        tracker = cls(data)
+        tracker.orders = tracker.orders[myslice]
+        names = files.page_names(data.download_path)
+        tracker.skip_missing(names)
+        for x in names:
             tracker.update(x)
     return tracker.images
 
 
 def show_instant(cls: 'lscat.<class>', data: 'data.<class>') -> 'IO':
-    tracker = cls(data)
-    # Filter out invisible files
-    # (used to save splitpoint and total_imgs without requesting)
-    for x in os.listdir(data.download_path):
-        if not x.startswith('.'):
+    cache.touch(data.download_path)
+    with printer.frame():
+        tracker = cls(data)
+        names = files.page_names(data.download_path)
+        tracker.skip_missing(names)
+        for x in names:
             tracker.update(x)
 
-    if isinstance(cls, TrackDownloads) and config.api.print_info():
-        number_of_cols = config.ncols_config()
-        spacings = config.api.gallery_print_spacing()
-        printer.print_cols(spacings, number_of_cols)
-        print('\n')
+        if isinstance(cls, TrackDownloads) and config.api.print_info():
+            number_of_cols = config.ncols_config()
+            spacings = config.api.gallery_print_spacing()
+            printer.print_cols(spacings, number_of_cols)
+            print('\n')
 
 
 class AbstractTracker(ABC):
+    """Displays images in the given orders, as soon as every image before it
+    has finished downloading, no matter in which order the downloads finish.
+
+    Each number in orders has a slot in an array; a finished download fills its
+    slot, then the longest filled prefix is displayed. Each update is O(1)
+    (amortized) and the lock is never held while displaying: if another thread
+    is already displaying, it will display this image too.
+    Everything displayed by one update is written to the terminal as one frame.
+    """
+
     def __init__(self):
         # Defined in child classes
         self.orders: 'list[int]'
+        self.visible: int  # Number of images in the first terminal page
         self.generator: 'generator[str]'
 
         self._lock = threading.Lock()
-        self._downloaded: 'list[str]' = []
-        self._numlist: 'list[int]' = []
+        self._displaying = False
         self.images = []
 
         self.generator.send(None)
 
+    @property
+    def orders(self) -> 'list[int]':
+        """The numbers of images (their three digit prefix) in display order"""
+        return self._orders
+
+    @orders.setter
+    def orders(self, orders: 'list[int]') -> None:
+        self._orders = orders
+        self._slot_of: 'dict[int, int]' = {num: slot for (slot, num) in enumerate(orders)}
+        self._ready: 'list[Optional[str]]' = [None] * len(orders)
+        self._next = 0  # The slot to display next
+
+    def skip_missing(self, names: 'list[str]') -> None:
+        """Don't wait for the images that are not in names (eg a partly downloaded
+        page, offline). By default the display stops at the first missing image
+        """
+
     def update(self, new: str) -> 'IO':
-        # Can't use queues/channels instead of a lock, because of race conditions
         with self._lock:
-            self._downloaded.append(new)
-            self._numlist.append(int(new[:3]))
-
-        self._inspect()
-
-    def _inspect(self) -> 'IO':
-        """Inspect the list of images that have finished downloading but not displayed
-        yet. According to the given orders list, if the next image to be displayed
-        is in the list, display it, then look for the next next image and repeat.
+            slot = self._slot_of.get(int(new[:3]))
+            if slot is None:  # Not displayed on this terminal page
+                return
+            self._ready[slot] = new
+            if self._displaying:
+                return
+            self._displaying = True
+
+        with printer.frame():
+            while (pic := self._pop_next()) is not None:
+                self.images.append(self.generator.send(pic))
+                self.generator.send(None)
+
+    def _pop_next(self) -> 'Optional[str]':
+        """Take the next image to display, if it has finished downloading.
+        Otherwise, stop displaying, until an update fills the next slot
         """
-        if not self.orders:
-            return
-
-        next_num = self.orders[0]
-
-        if next_num in self._numlist:
-            pic = self._downloaded[self._numlist.index(next_num)]
-            self.images.append(self.generator.send(pic))
-            self.generator.send(None)
-
-            self.orders = self.orders[1:]
-            self._downloaded.remove(pic)
-            self._numlist.remove(next_num)
-            if self._downloaded and self.orders:
-                self._inspect()
+        with self._lock:
+            if self._next < len(self._ready) and self._ready[self._next] is not None:
+                pic, self._ready[self._next] = self._ready[self._next], None
+                self._next += 1
+                return pic
+            self._displaying = False
+            return None
 
 
 class TrackDownloads(AbstractTracker):
@@ -195,6 +385,7 @@ class TrackDownloads(AbstractTracker):
 
     def __init__(self, data: 'data.<class>'):
         self.orders = list(range(30))
+        self.visible = utils.max_images()
         # TODO: cannot merge yet because ueberzug version prevents 'overflowing'
         # during initial download
         if config.api.use_ueberzug():
@@ -203,6 +394,15 @@ class TrackDownloads(AbstractTracker):
             self.generator = generate_page(data.download_path)
         super().__init__()
 
+    def skip_missing(self, names):
+        """Overrides base class: each image is placed by its number, so gaps are
+        fine, except with ueberzug, which places them in the order they come
+        """
+        if config.api.use_ueberzug():
+            return
+        numbers = {int(name[:3]) for name in names}
+        self.orders = [num for num in self.orders if num in numbers]
+
 
 class TrackDownloadsUsers(AbstractTracker):
     """For user modes (3 & 4)"""
@@ -220,6 +420,7 @@ class TrackDownloadsUsers(AbstractTracker):
         # Each artist has 3 previews, so the total number of pics is
         # splitpoint * 3 + splitpoint == splitpoint * 4
         self.orders = pure.generate_orders(splitpoint * 4, splitpoint)
+        self.visible = utils.max_images_user()
 
         # TODO: Cannot merge yet because generate_users() goes to a new terminal page for every row
         if config.api.use_ueberzug():
@@ -235,6 +436,7 @@ class TrackDownloadsImage(AbstractTracker):
     def __init__(self, data):
         min_num = data.page_num + 1
         self.orders = list(range(min_num, 30))
+        self.visible = 4  # Max 4 previews
         self.generator = generate_previews(data.download_path, min_num)
         super().__init__()
 
@@ -246,14 +448,15 @@ class TrackDownloadsImage(AbstractTracker):
 
 def generate_page(path: 'Path') -> 'IO':
     """Given number, calculate its coordinates and display it, then yield"""
-    left_shifts = config.xcoords_config()
-    rowspaces = config.ycoords_config()
-    number_of_cols = config.ncols_config()
-    number_of_rows = config.nrows_config()
-    page_spacing = config.api.page_spacing()
-    thumbnail_size = config.api.thumbnail_size()
-
-    os.system('clear')
+    layout = config.layout()
+    left_shifts = layout.xcoords
+    rowspaces = layout.ycoords
+    number_of_cols = layout.ncols
+    number_of_rows = layout.nrows
+    page_spacing = layout.page_spacing
+    thumbnail_size = layout.thumbnail_size
+
+    printer.clear_screen()
     while True:
         # Release control. When _inspect() sends another image,
         # assign to the variables and display it again
@@ -272,13 +475,14 @@ def generate_page(path: 'Path') -> 'IO':
 
 
 def generate_page_ueberzug(path: 'Path') -> 'IO':
-    left_shifts = config.xcoords_config()
-    rowspaces = config.ycoords_config()
-    number_of_cols = config.ncols_config()
-    number_of_rows = config.nrows_config()
-    thumbnail_size = config.api.thumbnail_size()
-
-    os.system('clear')
+    layout = config.layout()
+    left_shifts = layout.xcoords
+    rowspaces = layout.ycoords
+    number_of_cols = layout.ncols
+    number_of_rows = layout.nrows
+    thumbnail_size = layout.thumbnail_size
+
+    printer.clear_screen()
     for i in range(number_of_cols * number_of_rows):
         x = i % number_of_cols
         y = i // number_of_cols
@@ -293,12 +497,13 @@ def generate_page_ueberzug(path: 'Path') -> 'IO':
 
 
 def generate_users(path: 'Path', print_info=True) -> 'IO':
-    preview_xcoords = config.xcoords_config(offset=1)[-3:]
+    layout = config.layout()
+    preview_xcoords = layout.users_xcoords[-3:]
     message_xcoord, padding = config.api.gen_users_settings()
-    page_spacing = config.api.users_page_spacing()
-    thumbnail_size = config.api.thumbnail_size()
+    page_spacing = layout.users_page_spacing
+    thumbnail_size = layout.thumbnail_size
 
-    os.system('clear')
+    printer.clear_screen()
     while True:
         # Wait for artist pic
         a_img = yield
@@ -326,15 +531,16 @@ def generate_users(path: 'Path', print_info=True) -> 'IO':
 
 
 def generate_users_ueberzug(path: 'Path', print_info=True) -> 'IO':
-    preview_xcoords = config.xcoords_config(offset=1)[-3:]
+    layout = config.layout()
+    preview_xcoords = layout.users_xcoords[-3:]
     message_xcoord, padding = config.api.gen_users_settings()
-    thumbnail_size = config.api.thumbnail_size()
+    thumbnail_size = layout.thumbnail_size
 
-    number_of_rows = config.nrows_config()
-    rowspaces = config.ycoords_config()
+    number_of_rows = layout.nrows
+    rowspaces = layout.ycoords
     msg_rows = [rowspaces[0]] + [rowspaces[1]] * (number_of_rows - 1)
 
-    os.system('clear')
+    printer.clear_screen()
     for row in range(number_of_rows):
         ycoord = row % number_of_rows
         a_img = yield
@@ -364,10 +570,11 @@ def generate_users_ueberzug(path: 'Path', print_info=True) -> 'IO':
 
 
 def generate_previews(path: 'Path', min_num: int) -> 'IO':
-    rowspaces = config.ycoords_config()
-    left_shifts = config.xcoords_config()
+    layout = config.layout()
+    rowspaces = layout.ycoords
+    left_shifts = layout.xcoords
     _xcoords = (left_shifts[0], left_shifts[-1])
-    thumbnail_size = config.api.thumbnail_size()
+    thumbnail_size = layout.thumbnail_size
 
     for preview_num in range(4):  # Max 4 previews
         image = yield
@@ -47,6 +47,7 @@ from koneko import (
 
 # Main functions that organise work
 def main() -> 'IO':
+    config.watch_terminal_size()
     if len(sys.argv) == 1:
         _main()
 
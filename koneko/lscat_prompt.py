@@ -2,7 +2,7 @@ import os
 from collections import namedtuple
 from abc import ABC, abstractmethod
 
-from koneko import utils, lscat, config, TERM, printer, FakeData
+from koneko import utils, files, lscat, config, TERM, printer, FakeData
 
 
 def scroll_prompt(tracker, data, max_images):
@@ -93,12 +93,12 @@ class AbstractLoop(ABC):
                     show_images = False
 
                 elif ans == 'n':
-                    os.system('clear')
+                    printer.clear_screen()
                     self.current_page += 1
                     show_images = True
 
                 elif ans == 'p':
-                    os.system('clear')
+                    printer.clear_screen()
                     self.current_page -= 1
                     show_images = True
 
@@ -176,7 +176,10 @@ class ImageLoop(AbstractLoop):
         # Unique
         self.use_ueberzug = config.api.use_ueberzug()
         self.root = root
-        self.all_images = [f for f in sorted(os.listdir(root)) if (root / f).is_file()]
+        self.all_images = [
+            f for f in files.page_names(root)
+            if (root / f).is_file()
+        ]
         self.image_path = self.all_images[0]
         # Only used if show previews is on
         self.FakeData = namedtuple('data', ('download_path', 'page_num'))
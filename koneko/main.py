@@ -11,11 +11,10 @@ Structure:
     - Frequent
 """
 
-import os
 import sys
 from abc import ABC, abstractmethod
 
-from koneko import ui, pure, utils, prompt, screens, picker, lscat_app
+from koneko import ui, pure, utils, prompt, screens, picker, printer, lscat_app
 
 
 def main_loop(_, your_id: str) -> 'IO':
@@ -136,7 +135,7 @@ class ArtistModeLoop(AbstractLoop):
 
     def _go_to_mode(self) -> 'IO':
         """Implements abstractmethod: go to mode 1"""
-        os.system('clear')
+        printer.clear_screen()
         self.mode = ui.ArtistGallery(self._user_input)
         prompt.gallery_like_prompt(self.mode)
 
@@ -158,7 +157,7 @@ class ViewPostModeLoop(AbstractLoop):
 
     def _go_to_mode(self) -> 'IO':
         """Implements abstractmethod: Go to mode 2"""
-        os.system('clear')
+        printer.clear_screen()
         ui.view_post_mode(self._user_input)
 
     def __str__(self) -> str:
@@ -179,7 +178,7 @@ class FollowingUserModeLoop(AbstractLoop):
 
     def _go_to_mode(self) -> 'IO':
         """Implements abstractmethod: Go to mode 3"""
-        os.system('clear')
+        printer.clear_screen()
         self.mode = ui.FollowingUsers(self._user_input)
         prompt.user_prompt(self.mode)
 
@@ -213,7 +212,7 @@ class SearchUsersModeLoop(AbstractLoop):
 
     def _go_to_mode(self) -> 'IO':
         """Implements abstractmethod: Go to mode 4"""
-        os.system('clear')
+        printer.clear_screen()
         self.mode = ui.SearchUsers(self._user_input)
         prompt.user_prompt(self.mode)
 
@@ -0,0 +1,71 @@
+"""Per-page manifest of downloaded images, so that checking whether a page is
+up to date, and counting or listing its images, is a read of one small file
+instead of a directory scan (which is slow on network home dirs and large caches).
+
+Written by download.init_download() once the images of a page have been
+downloaded. It is hidden, so it is never displayed. Pages downloaded before
+manifests existed have none, and callers fall back to listing the dir.
+"""
+
+import os
+import json
+import hashlib
+
+from koneko import files, catalog
+
+
+MANIFEST = '.manifest.json'
+VERSION = 1
+
+
+def path(download_path: 'Path') -> 'Path':
+    return download_path / MANIFEST
+
+
+def read(download_path: 'Path') -> 'Optional[dict[str, dict]]':
+    """Maps each file name to its record; None if the page has no valid manifest"""
+    try:
+        with open(path(download_path), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, TypeError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('version') != VERSION:
+        return None
+    return manifest['files']
+
+
+def names(download_path: 'Path') -> 'Optional[list[str]]':
+    if (records := read(download_path)) is None:
+        return None
+    return sorted(records)
+
+
+def write(download_path: 'Path', urls: 'dict[str, str]') -> 'IO[dict[str, dict]]':
+    """Record every file name (mapped to its source url) that was downloaded.
+    Names that failed to download are left out, so the page stays outdated
+    """
+    records = {}
+    for name, url in urls.items():
+        filepath = download_path / name
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            continue
+        records[name] = {
+            'size': stat.st_size,
+            'sha1': _hash(filepath),
+            'url': url,
+            'fetched': stat.st_mtime,
+        }
+
+    files.atomic_write(path(download_path), json.dumps({'version': VERSION, 'files': records}))
+    catalog.db.add_file(path(download_path))  # Counts towards the cache size
+    return records
+
+
+def _hash(filepath: 'Path') -> 'IO[str]':
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
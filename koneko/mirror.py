@@ -0,0 +1,171 @@
+"""`koneko mirror <artist>`: download an artist's whole gallery without the
+interactive prompt, eg for archiving.
+
+Pages are requested (in order, following next_url) by a pager thread, up to
+`prefetch_depth` pages ahead of the downloads, so the next response is usually
+ready by the time the images of a page are done. Each page is downloaded into
+the same dir as mode 1 would (KONEKODIR / artist id / page number), so the
+mirrored gallery can be browsed instantly (or with --offline) afterwards.
+With --full, the original resolution of every page of every post is also
+downloaded, into ORIGINALS_DIR / artist id.
+
+Mirroring can be interrupted and resumed: the next page to download is saved in
+STATEDIR after each page, and removed once the last page is done. Images that
+are already downloaded are skipped, and partial downloads are resumed.
+The responses are always fetched again (and cached, like the ui would), so a
+re-run never archives an outdated listing.
+"""
+
+import os
+import json
+import time
+import queue
+import itertools
+import threading
+from pathlib import Path
+
+import requests
+
+from koneko import api, data, pure, files, config, download, KONEKODIR
+
+
+STATEDIR = KONEKODIR.parent / 'mirror'
+ORIGINALS_DIR = Path('~/Downloads').expanduser() / 'koneko'
+
+
+class Summary:
+    """Counts of what was mirrored, for the progress lines and the final summary"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.pages = 0
+        self.posts = 0
+        self.downloaded = 0
+        self.originals = 0
+        self.failed: 'list[str]' = []
+
+    def __str__(self) -> str:
+        elapsed = time.monotonic() - self.start
+        failed = f', {len(self.failed)} failed' if self.failed else ''
+        return (
+            f'Mirrored {self.pages} pages, {self.posts} posts '
+            f'({self.downloaded} new, {self.originals} originals{failed}) '
+            f'in {elapsed:.1f}s'
+        )
+
+
+# - State, for resuming
+def _state_path(artist_user_id: str) -> 'Path':
+    return STATEDIR / f'{artist_user_id}.json'
+
+
+def read_state(artist_user_id: str) -> 'tuple[int, Union[int, str]]':
+    """The page number and offset to start from: where the last run stopped.
+    The offset is kept as a str, like data.GalleryData.next_offset
+    """
+    try:
+        with open(_state_path(artist_user_id), 'r') as f:
+            state = json.load(f)
+        return int(state['page_num']), str(int(state['offset']))
+    except (OSError, ValueError, KeyError, TypeError):
+        return 1, 0
+
+
+def write_state(artist_user_id: str, page_num: int, offset: str) -> 'IO':
+    path = _state_path(artist_user_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    files.atomic_write(path, json.dumps({'page_num': page_num, 'offset': offset}))
+
+
+def clear_state(artist_user_id: str) -> 'IO':
+    _state_path(artist_user_id).unlink(missing_ok=True)
+
+
+# - The pipeline
+def _paginate(artist_user_id: str, gdata: 'data.GalleryData', pages: 'queue.Queue') -> 'IO':
+    """Put every page from gdata.page_num onwards into the queue, then None.
+    If a request fails, the exception is put instead
+    """
+    try:
+        with api.myapi.refreshing():
+            while True:
+                gdata.update(api.myapi.artist_gallery(artist_user_id, gdata.offset))
+                pages.put(gdata.clone_with_page(gdata.page_num))
+                if not gdata.next_url:
+                    break
+                gdata.offset = gdata.next_offset
+                gdata.page_num += 1
+    except Exception as e:
+        pages.put(e)
+    else:
+        pages.put(None)
+
+
+def download_original(url: str, path: 'Path') -> 'IO[bool]':
+    """Pixiv's urls don't say whether the original is a jpg or a png, so try both"""
+    jpg, png = (pure.change_url_to_full(url, png=is_png) for is_png in (False, True))
+    if any((path / pure.split_backslash_last(full)).is_file() for full in (jpg, png)):
+        return False
+    try:
+        return api.myapi.protected_download(jpg, path, None)
+    except requests.HTTPError:
+        return api.myapi.protected_download(png, path, None)
+
+
+def _download_originals(page: 'data.GalleryData', path: 'Path', summary: Summary) -> 'IO':
+    os.makedirs(path, exist_ok=True)
+    urls = [
+        url
+        for post in page.current_illusts
+        for url in pure.page_urls_in_post(post, 'large')
+    ]
+    futures = download.pool.map(download_original, urls, itertools.repeat(path))
+    for url, future in zip(urls, futures):
+        try:
+            summary.originals += bool(future.result())
+        except (ConnectionError, requests.RequestException):
+            summary.failed.append(url)
+
+
+def _download_page(page: 'data.GalleryData', summary: Summary) -> 'IO':
+    names = page.newnames_with_ext
+    cached = sum((page.download_path / name).is_file() for name in names)
+    download.init_download(page, None)
+    now_cached = sum((page.download_path / name).is_file() for name in names)
+
+    summary.pages += 1
+    summary.posts += len(names)
+    summary.downloaded += now_cached - cached
+    summary.failed.extend(
+        url
+        for (url, name) in zip(page.all_urls, names)
+        if not (page.download_path / name).is_file()
+    )
+
+
+def mirror(artist_user_id: str, full=False) -> 'IO[Summary]':
+    artist_user_id = str(artist_user_id)
+    gdata = data.GalleryData(KONEKODIR / artist_user_id)
+    gdata.page_num, gdata.offset = read_state(artist_user_id)
+    if gdata.page_num > 1:
+        print(f'Resuming from page {gdata.page_num}')
+
+    pages = queue.Queue(maxsize=max(1, config.api.prefetch_depth()))
+    threading.Thread(
+        target=_paginate, args=(artist_user_id, gdata, pages), daemon=True
+    ).start()
+
+    summary = Summary()
+    while (page := pages.get()) is not None:
+        if isinstance(page, Exception):
+            raise page
+        _download_page(page, summary)
+        if full:
+            _download_originals(page, ORIGINALS_DIR / artist_user_id, summary)
+        if page.next_url:
+            write_state(artist_user_id, page.page_num + 1, page.next_offset)
+        print(f'Page {page.page_num}: {len(page.newnames_with_ext)} posts. {summary}')
+
+    clear_state(artist_user_id)
+    print(summary)
+    return summary
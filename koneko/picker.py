@@ -1,11 +1,14 @@
-import os
 import sys
 from shutil import rmtree
 
 from pick import Picker
 from placeholder import m
 
-from koneko import utils, files, screens, KONEKODIR
+from koneko import utils, files, catalog, printer, blobstore, lazy_import, KONEKODIR
+
+
+# Imports the whole ui (and the api), which lscat doesn't need
+screens = lazy_import('koneko.screens')
 
 
 # Constants
@@ -32,7 +35,7 @@ def _pick_dirs_picker(actions: 'list[str]', title: str) -> Picker:
 
 
 def lscat_app_main() -> 'IO[int]':
-    os.system('clear')
+    printer.clear_screen()
     title = 'Welcome to the lscat interactive script\nPlease select an action'
     actions = (
         '1. Launch koneko configuration assistance',
@@ -171,6 +174,8 @@ def handle_delete(path: 'Path') -> 'IO[Path]':
     confirm = input("Enter 'y' to confirm\n")
     if confirm == 'y':
         rmtree(path)
+        catalog.db.remove(path)
+        blobstore.prune_in_background()
         return path.parent
     return path
 
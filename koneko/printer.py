@@ -1,4 +1,6 @@
-import os
+import io
+import sys
+import threading
 from contextlib import contextmanager
 
 from koneko import TERM
@@ -9,6 +11,99 @@ def write(value: str) -> 'IO':
     print(value, end='', flush=True)
 
 
+# Frames: collect the output of a whole grid, and write it to the terminal at once
+_local = threading.local()
+_frames_lock = threading.Lock()
+_frames = 0  # Number of threads inside a frame
+
+
+class _FrameStdout:
+    """Replaces sys.stdout while any thread is inside a frame. Only the writes of
+    those threads are collected; other threads still write straight through
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+    def write(self, text: str) -> int:
+        if (buffer := getattr(_local, 'buffer', None)) is not None:
+            return buffer.write(text)
+        return self.stdout.write(text)
+
+    def flush(self) -> 'IO':
+        if getattr(_local, 'buffer', None) is None:
+            self.stdout.flush()
+
+    def __getattr__(self, name: str):
+        # Eg fileno(), for pixcat to get the terminal size
+        return getattr(self.stdout, name)
+
+
+@contextmanager
+def frame() -> 'IO':
+    """Everything this thread prints inside (including the kitty escape codes)
+    is written to the terminal in a single write at the end, except in unbuffered().
+    Nested frames are part of the outermost one.
+    """
+    global _frames
+    if getattr(_local, 'buffer', None) is not None:
+        yield
+        return
+
+    _local.buffer = io.StringIO()
+    with _frames_lock:
+        if _frames == 0:
+            sys.stdout = _FrameStdout(sys.stdout)
+        _frames += 1
+    try:
+        yield
+    finally:
+        text, _local.buffer = _local.buffer.getvalue(), None
+        with _frames_lock:
+            _frames -= 1
+            stdout = sys.stdout
+            if isinstance(stdout, _FrameStdout):
+                stdout = stdout.stdout
+                if _frames == 0:
+                    sys.stdout = stdout
+        stdout.write(text)
+        stdout.flush()
+
+
+@contextmanager
+def unbuffered() -> 'IO':
+    """For writes that wait for the terminal to answer (eg pixcat's transmit and
+    display), which never comes if the frame holds them back: write out what the
+    frame of this thread collected so far, then write straight through in the block
+    """
+    if (buffer := getattr(_local, 'buffer', None)) is None:
+        yield
+        return
+
+    stdout = sys.stdout.stdout if isinstance(sys.stdout, _FrameStdout) else sys.stdout
+    stdout.write(buffer.getvalue())
+    stdout.flush()
+    _local.buffer = None
+    try:
+        yield
+    finally:
+        _local.buffer = io.StringIO()
+
+
+# Number of times the screen was cleared; kitty then frees the images that are not placed
+cleared = 0
+
+
+def clear_screen() -> 'IO':
+    """Same as the `clear` command (including the scrollback, and the images in
+    it), without spawning a process
+    """
+    global cleared
+    if TERM.does_styling:
+        write(f'{TERM.clear}\033[3J')
+        cleared += 1
+
+
 def move_cursor_up(num: int) -> 'IO':
     if num > 0:
         write(f'\033[{num}A')
@@ -80,7 +175,7 @@ def maybe_print_center_spaces(actions, ueberzug_center_spaces):
 
 def print_doc(doc: str) -> 'IO':
     """Prints a given string in the bottom of the terminal"""
-    os.system('clear')
+    clear_screen()
     number_of_newlines = doc.count('\n')
     bottom = TERM.height - (number_of_newlines + 2)
     with TERM.location(0, bottom):
@@ -159,6 +159,91 @@ def generate_orders(total_pics: int, artists_count: int) -> 'list[int]':
     return order
 
 
+def display_ranks(orders: 'list[int]', total: int) -> 'list[int]':
+    """Returns the position in the display order of each image number.
+    Images that are not in orders (never displayed) are ranked last
+    >>> display_ranks([0, 2, 1], 4)
+    [0, 2, 1, 6]
+    """
+    positions = {number: pos for (pos, number) in enumerate(orders)}
+    return [positions.get(number, len(orders) + number) for number in range(total)]
+
+
+def kitty_code(payload: str = '', **controls) -> str:
+    """Escape code of a kitty graphics protocol command"""
+    keys = ','.join(f'{key}={value}' for (key, value) in controls.items())
+    return f'\033_G{keys};{payload}\033\\'
+
+
+def kitty_chunked_codes(payload: str, chunk_size=4096, **controls) -> 'list[str]':
+    """Escape codes of a command with inline data, which kitty requires to be
+    split into chunks. Only the first chunk has the controls
+    """
+    chunks = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+    chunks = chunks or ['']
+    return [
+        kitty_code(chunk, **(controls if i == 0 else {}), m=int(i < len(chunks) - 1))
+        for (i, chunk) in enumerate(chunks)
+    ]
+
+
+def kitty_medium(setting: str, environ: 'Mapping[str, str]') -> str:
+    """Files and shared memory can only be read by a kitty on the same machine"""
+    if setting != 'auto':
+        return setting
+    if any(var in environ for var in ('SSH_CONNECTION', 'SSH_CLIENT', 'SSH_TTY')):
+        return 'direct'
+    return 'file'
+
+
+# For login
+def token_lifetime(auth_response: 'Json', default=3600) -> int:
+    """Seconds until the access token in pixiv's auth response expires"""
+    try:
+        expires_in = auth_response['response']['expires_in']
+    except (KeyError, TypeError):
+        return default
+    return expires_in if isinstance(expires_in, int) and expires_in > 0 else default
+
+
+def describe_request(method: str, args: tuple, kwargs: dict) -> str:
+    arguments = [repr(arg) for arg in args] + [f'{k}={v!r}' for k, v in kwargs.items()]
+    return f'{method}({", ".join(arguments)})'
+
+
+# For downloads
+def range_headers(offset: int) -> 'dict[str, str]':
+    """Headers to request the rest of a file, after the first offset bytes"""
+    return {'Range': f'bytes={offset}-'} if offset else {}
+
+
+def expected_size(offset: int, headers: 'Mapping[str, str]') -> 'Optional[int]':
+    """The size of the whole file, if the server said how long the rest is"""
+    try:
+        return offset + int(headers['Content-Length'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def worth_retrying(status: int) -> bool:
+    """Other client errors (eg 404, for an original that is a png, not a jpg)
+    would only fail again. A 416 means the partial file was invalid and removed
+    """
+    return status in (416, 429) or status >= 500
+
+
+# For picker
+def human_size(size: int) -> str:
+    """Like `du -h`, eg 1.5G"""
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'T'
+    return f'{size:.1f}{unit}' if unit != 'B' else f'{size}{unit}'
+
+
 # For lscat_app
 def line_width(spacings: 'list[int]', ncols: int) -> int:
     return sum(spacings) + ncols
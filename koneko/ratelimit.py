@@ -0,0 +1,118 @@
+"""Client-side rate limiting for requests to pixiv
+
+Every request first takes a token from the bucket of the host it goes to,
+so bursts are smoothed out to a steady rate instead of being sent at once.
+When pixiv answers with 429 or 5xx, the whole bucket is paused for an
+exponentially increasing, jittered delay, so that retries (by funcy.retry)
+from every thread wait for the server to recover, instead of hammering it.
+"""
+
+import time
+import random
+import threading
+
+
+BACKOFF_BASE = 1.0  # Seconds
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """Thread-safe token bucket, refilled at `rate` tokens per second,
+    holding at most `capacity` tokens (the allowed burst)
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._not_before = 0.0  # Monotonic time that a backoff ends
+        self._failures = 0  # Consecutive responses that needed a backoff
+
+        self.acquired = 0
+        self.throttled = 0  # Requests that had to wait
+        self.waited = 0.0  # Seconds spent waiting
+        self.backoffs = 0
+
+    def reserve(self) -> float:
+        """Take a token, returning how many seconds to wait before using it.
+        Tokens can go negative, so that every waiting request holds its place in line
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+
+            wait = max(0.0, -self._tokens / self.rate, self._not_before - now)
+            self.acquired += 1
+            if wait > 0:
+                self.throttled += 1
+                self.waited += wait
+            return wait
+
+    def acquire(self) -> 'IO':
+        """Block until the request is allowed. Use `await asyncio.sleep(reserve())`
+        in coroutines instead
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def backoff(self, retry_after: 'Optional[float]' = None) -> float:
+        """Pause the bucket after a 429/5xx response, returning the delay"""
+        with self._lock:
+            self._failures += 1
+            self.backoffs += 1
+            if retry_after is None:
+                retry_after = backoff_delay(self._failures)
+            self._not_before = max(self._not_before, time.monotonic() + retry_after)
+            return retry_after
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+
+    def observe(self, status: int, headers: 'Mapping[str, str]') -> bool:
+        """Feed back the status of a response. Returns True if it should be retried"""
+        if status in RETRY_STATUSES:
+            self.backoff(parse_retry_after(headers.get('Retry-After')))
+            return True
+        self.success()
+        return False
+
+    def as_dict(self) -> 'dict[str, float]':
+        with self._lock:
+            return {
+                'acquired': self.acquired,
+                'throttled': self.throttled,
+                'waited': self.waited,
+                'backoffs': self.backoffs,
+            }
+
+
+def backoff_delay(failures: int) -> float:
+    """Exponential backoff with 'equal jitter': half of the delay is random,
+    so that threads which failed together don't all retry together
+    """
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_retry_after(value: 'Optional[str]') -> 'Optional[float]':
+    """Pure. Only the delay-seconds form is used; HTTP dates fall back to backoff"""
+    try:
+        return min(BACKOFF_MAX, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+app_api = TokenBucket(rate=2, capacity=5)  # JSON requests to app-api.pixiv.net
+images = TokenBucket(rate=30, capacity=30)  # Downloads from i.pximg.net
+
+
+def stats() -> 'dict[str, dict[str, float]]':
+    return {'app_api': app_api.as_dict(), 'images': images.as_dict()}
@@ -1,7 +1,6 @@
-import os
 import shutil
 
-from koneko import ui, cli, utils, config, lscat, KONEKODIR, __version__, WELCOME_IMAGE
+from koneko import ui, cli, utils, config, lscat, printer, catalog, blobstore, jsoncache, KONEKODIR, __version__, WELCOME_IMAGE
 
 
 def begin_prompt(printmessage=True) -> 'IO[str]':
@@ -35,7 +34,7 @@ def begin_prompt(printmessage=True) -> 'IO[str]':
 
 @utils.catch_ctrl_c
 def show_man_loop() -> 'IO':
-    os.system('clear')
+    printer.clear_screen()
     print(cli.__doc__)
     print(' ' * 3, '=' * 30)
     print(ui.ArtistGallery.__doc__)
@@ -46,7 +45,7 @@ def show_man_loop() -> 'IO':
     print(' ' * 3, '=' * 30)
     print(ui.IllustFollowGallery.__doc__)
     input('\n\nEnter any key to return: ')
-    os.system('clear')
+    printer.clear_screen()
 
 
 @utils.catch_ctrl_c
@@ -58,17 +57,20 @@ def clear_cache_loop() -> 'IO[bool]':
         help_command = input('\nEnter y to confirm: ')
         if help_command == 'y':
             shutil.rmtree(KONEKODIR)
-            os.system('clear')
+            jsoncache.clear()
+            catalog.db.clear()
+            blobstore.clear()
+            printer.clear_screen()
             return True
         else:
             print('Operation aborted!')
-            os.system('clear')
+            printer.clear_screen()
             return False
 
 
 @utils.catch_ctrl_c
 def info_screen_loop() -> 'IO':
-    os.system('clear')
+    printer.clear_screen()
     messages = (
         '',
         f'koneko こねこ version {__version__} beta\n',
@@ -95,5 +97,5 @@ def info_screen_loop() -> 'IO':
     image = lscat.api.show(WELCOME_IMAGE.parent / '79494300_p0.png', 0, 0, size)
 
     input('\nEnter any key to return: ')
-    os.system('clear')
+    printer.clear_screen()
     lscat.api.hide(image)
@@ -0,0 +1,72 @@
+"""Cache of pre-scaled thumbnails for lscat.Pixcat, so that showing a page again
+(scrolling, going back, show_instant) reads and sends a small image, instead of
+pixcat re-reading and resizing the full image every time.
+
+Thumbnails are kept in a hidden dir inside each page dir, so they are removed
+together with the page (reload, eviction). They are keyed by the source image
+and the thumbnail size, and are stale if the source is newer.
+download.init_download() pre-scales every image of a page on the download pool
+right after the page is downloaded; anything missed is scaled on first display.
+Only images in KONEKODIR are cached, so lscat_app never writes into other dirs.
+"""
+
+import io
+import os
+import glob
+from pathlib import Path
+from contextlib import suppress
+
+from koneko import KONEKODIR, files, catalog, lazy_import
+
+
+THUMBDIR = '.thumbnails'
+Image = lazy_import('PIL.Image')  # Imported on first use
+
+
+def thumbnail_path(image_path: 'Path', size: int) -> 'Path':
+    """Pure"""
+    image_path = Path(image_path)
+    return image_path.parent / THUMBDIR / f'{image_path.name}.{size}.png'
+
+
+def cacheable(image_path: 'Path') -> bool:
+    """Pure"""
+    return KONEKODIR in Path(image_path).parents
+
+
+def get(image_path: 'Path', size: int) -> 'IO[Optional[Path]]':
+    """The thumbnail of the image, if it is cached and up to date"""
+    thumbnail = thumbnail_path(image_path, size)
+    try:
+        if thumbnail.stat().st_mtime_ns >= os.stat(image_path).st_mtime_ns:
+            return thumbnail
+    except OSError:
+        pass
+    return None
+
+
+def make(image_path: 'Path', size: int) -> 'IO[Optional[Path]]':
+    """Scale and save the thumbnail, if it isn't already cached"""
+    if not cacheable(image_path):
+        return None
+    if (thumbnail := get(image_path, size)) is not None:
+        return thumbnail
+
+    thumbnail = thumbnail_path(image_path, size)
+    thumbnail.parent.mkdir(exist_ok=True)
+    scaled = io.BytesIO()
+    with Image.open(image_path) as image:
+        image.thumbnail((size, size), Image.LANCZOS)
+        image.save(scaled, format='PNG', compress_level=1)
+    files.atomic_write(thumbnail, scaled.getvalue())
+    catalog.db.add_file(thumbnail)  # Counts towards the cache size
+    return thumbnail
+
+
+def remove(image_path: 'Path') -> 'IO':
+    """Remove the thumbnails of every size of the image"""
+    image_path = Path(image_path)
+    for thumbnail in (image_path.parent / THUMBDIR).glob(f'{glob.escape(image_path.name)}.*.png'):
+        with suppress(FileNotFoundError):
+            os.remove(thumbnail)
+        catalog.db.remove(thumbnail)
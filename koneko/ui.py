@@ -12,18 +12,25 @@ from koneko import (
     data,
     pure,
     TERM,
+    cache,
     lscat,
     utils,
     files,
     colors,
     config,
     prompt,
+    catalog,
     printer,
+    blobstore,
     download,
     KONEKODIR,
 )
 
 
+# Prefetching stops when there is less free disk space than this many bytes
+PREFETCH_MIN_FREE = 500 * 1024 ** 2
+
+
 class AbstractUI(ABC):
     @abstractmethod
     def __init__(self, main_path) -> 'IO':
@@ -41,8 +48,14 @@ class AbstractUI(ABC):
         # Attribute defined in self.start()
         self._data: 'data.<class>'  # Instantiated data class, not reference
         self.images: 'list[Image]' = []
-        # Attribute defined in self.prefetch_thread()
+        # Attribute defined in self._prefetch()
         self._prefetch_thread: threading.Thread
+        # Guards the three below, and notifies when a page is ready or prefetching stops
+        self._prefetch_lock = threading.Condition()
+        self._prefetching = False
+        self._prefetched_pages: 'set[int]' = set()  # Defined in self.start()
+        # Given to all background work of this view; replaced when it is cancelled
+        self._token = utils.CancelToken()
 
         self.use_ueberzug = config.api.use_ueberzug()
         self.scrollable = self.use_ueberzug or not config.api.scroll_display()
@@ -73,10 +86,16 @@ class AbstractUI(ABC):
         # self._data defined here not in __init__, so that reload() will wipe cache
         # This has to be taken into account before any attempts to make this a subclass of Data
         self._data = self._data_class(main_path)
-        if self._data.download_path.is_dir() and os.listdir(self._data.download_path):
+        # Pages of this view are not evicted, even if the user stays on one for long
+        cache.pin(self, main_path)
+        if api.myapi.offline:
+            self._show_offline()
+        elif self._data.download_path.is_dir() and files.page_names(self._data.download_path):
             self._show_then_fetch()
         else:
             self._download_from_scratch()
+        with self._prefetch_lock:
+            self._prefetched_pages = {self._data.page_num}
         self._prefetch()
 
     def _download_from_scratch(self) -> 'IO':
@@ -91,6 +110,29 @@ class AbstractUI(ABC):
         self._verify_up_to_date()
         self._report()
 
+    def _show_offline(self) -> 'IO':
+        """Read-only: show whatever is cached of the page, never download or delete.
+        Raises api.Offline if the page's response is not cached
+        """
+        self._request_then_save()
+        self._show_cached()
+
+    def _show_cached(self) -> 'IO':
+        if self._data.download_path.is_dir():
+            self.scroll_or_show()
+        self._report()
+        self._report_missing()
+
+    def _report_missing(self) -> 'IO':
+        names = self._data.newnames_with_ext
+        missing = [name for name in names if not (self._data.download_path / name).is_file()]
+        if missing:
+            printer.print_bottom(
+                f'Offline: {len(missing)} of {len(names)} images of this page are not cached',
+                use_ueberzug=self.use_ueberzug,
+                offset=1,
+            )
+
     def _verify_up_to_date(self) -> 'IO':
         if files.dir_not_empty(self._data):
             return True
@@ -98,15 +140,41 @@ class AbstractUI(ABC):
         self._download_save_images()
 
     def _download_save_images(self):
-        tracker = self._tracker_class(self._data)
+        # Images are displayed as they finish (each in its own frame), after the clear
+        with printer.frame():
+            tracker = self._tracker_class(self._data)
         download.init_download(self._data, tracker)
         self.images = tracker.images
 
     def _prefetch(self) -> 'IO':
-        """Reassign the thread again and start; as threads can only be started once"""
-        self._prefetch_thread = threading.Thread(target=self._prefetch_next_page)
+        """Start prefetching the pages ahead, unless a thread is already doing so.
+        A running thread follows the current page, so it never needs restarting
+        """
+        with self._prefetch_lock:
+            if self._prefetching:
+                return
+            self._prefetching = True
+            token = self._token
+        # Reassign the thread again and start; as threads can only be started once
+        self._prefetch_thread = threading.Thread(
+            target=self._prefetch_next_pages, args=(token,)
+        )
         self._prefetch_thread.start()
 
+    def _cancel_background_work(self, wait=False) -> 'IO':
+        """Stop prefetching, including downloads in progress, eg when leaving the view.
+        The stopped thread no longer counts, so self._prefetch() can start a new one.
+        If wait is True, also wait for it to stop writing, eg before deleting the page dirs
+        """
+        with self._prefetch_lock:
+            self._token.set()
+            self._token = utils.CancelToken()
+            self._prefetching = False
+            self._prefetch_lock.notify_all()
+        thread = getattr(self, '_prefetch_thread', None)
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
+
     def _request_then_save(self, page_num=None) -> 'IO':
         """Do request and save it"""
         result = self._pixivrequest()
@@ -115,30 +183,99 @@ class AbstractUI(ABC):
         else:
             self._data.update(result)
 
-    def _prefetch_next_page(self) -> 'IO':
-        # Wait for initial request to finish, so the data object is instantiated
-        # Else next_url won't be set yet
-        self._maybe_join_thread()
+    def _prefetch_next_pages(self, token: utils.CancelToken) -> 'IO':
+        """Keep the pages from the current page to prefetch_depth pages ahead ready,
+        in order. Pages that fall out of the window (eg, the user went back) are skipped
+        """
+        page_num = 0
+        try:
+            # Wait for initial request to finish, so the data object is instantiated
+            # Else next_url won't be set yet
+            self._maybe_join_thread()
+            while page_num := self._next_page_to_prefetch(page_num, token):
+                if not self._prefetch_page(page_num, token):
+                    break
+        except utils.Cancelled:
+            pass
+        finally:
+            if page_num is not None:  # Stopped before the window was filled
+                self._stop_prefetching(token)
+
+    def _next_page_to_prefetch(self, last: int, token) -> 'Optional[int]':
+        """Stops prefetching if there is no page left in the window.
+        Checked under the lock, so that self._prefetch() can't miss the stop
+        """
+        with self._prefetch_lock:
+            if token.is_set():
+                return None
+            current = self._data.page_num
+            page_num = max(last + 1, current)
+            while page_num in self._prefetched_pages:
+                page_num += 1
+            if page_num <= current + config.api.prefetch_depth():
+                return page_num
+            self._stop_prefetching(token)
+            return None
+
+    def _stop_prefetching(self, token) -> None:
+        """A cancelled thread was already replaced, so it must not touch the state"""
+        with self._prefetch_lock:
+            if token is self._token:
+                self._prefetching = False
+                self._prefetch_lock.notify_all()
+
+    def _prefetch_page(self, page_num: int, token) -> 'IO[bool]':
+        """Request the page (if not done already) and download its images.
+        Returns False if it is the last page, or if the disk is almost full
+        """
+        if page_num not in self._data.all_pages_cache:
+            previous = self._data.clone_with_page(page_num - 1)
+            if not previous.next_url:
+                return False
+            if files.free_space(self._data.main_path) < PREFETCH_MIN_FREE:
+                return False
+            self._data.offset = previous.next_offset
+            try:
+                result = self._pixivrequest()
+            except api.Offline:
+                return False
+            token.check()  # The view might have been reloaded with new data
+            self._data.update(result, page_num)
+
+        # Offline, only the responses are prefetched (from the json cache)
+        if not api.myapi.offline:
+            # If the user is already waiting for this page, it is not a prefetch any more
+            priority = (
+                download.Priority.VISIBLE
+                if page_num == self._data.page_num
+                else download.Priority.PREFETCH
+            )
+            download.init_download(
+                self._data.clone_with_page(page_num), None, priority, token
+            )
 
-        if not (
-            self._data.next_url
-            or self._data.next_offset.isdigit()
-            or self._data.is_immediate_next
-        ):
-            return True
+        with self._prefetch_lock:
+            self._prefetched_pages.add(page_num)
+            self._prefetch_lock.notify_all()
+        return True
 
-        self._data.offset = self._data.next_offset
-        self._request_then_save(self._data.page_num + 1)
-        new = self._data.clone_with_page(int(self._data.offset) // 30 + 1)
-        download.init_download(new, None)
+    def _wait_for_page(self, page_num: int) -> 'IO':
+        """Wait until the page is downloaded, or until there will be no such page"""
+        with self._prefetch_lock:
+            self._prefetch_lock.wait_for(
+                lambda: page_num in self._prefetched_pages or not self._prefetching
+            )
 
     def next_page(self) -> 'IO':
         print('Downloading images in the next page...')
-        self._prefetch_thread.join()
-        self._data.page_num += 1
+        with self._prefetch_lock:
+            self._data.page_num += 1
         self.terminal_page = 0
+        # Its downloads might have been queued behind other work, as a prefetch
+        download.pool.promote(self._data.download_path, download.Priority.VISIBLE)
+        self._prefetch()  # Moves the window forward
+        self._wait_for_page(self._data.page_num)
         self._show_page()
-        self._prefetch()
 
     def previous_page(self) -> 'IO':
         if self._data.page_num <= 1:
@@ -179,24 +316,46 @@ class AbstractUI(ABC):
             lscat.show_instant(self._tracker_class, self._data)
 
     def _show_page(self) -> 'IO':
+        if api.myapi.offline:
+            return self._show_page_offline()
         if not files.dir_not_empty(self._data):
-            printer.print_bottom('This is the last page!')
-            self._data.page_num -= 1
-            return False
+            if self._data.page_num not in self._data.all_pages_cache:
+                printer.print_bottom('This is the last page!')
+                self._data.page_num -= 1
+                return False
+            # Eg, removed by hand, or evicted before this view pinned it
+            files.remove_dir_if_exist(self._data)
+            self._download_save_images()
+            return self._report()
 
         self.scroll_or_show()
         self._report()
 
+    def _show_page_offline(self) -> 'IO':
+        if self._data.page_num not in self._data.all_pages_cache:
+            printer.print_bottom('This page is not cached!')
+            self._data.page_num -= 1
+            return False
+        self._show_cached()
+
     def reload(self) -> 'IO':
+        if api.myapi.offline:
+            printer.print_bottom('Cannot reload while offline!')
+            return self._prompt(self)
         printer.print_bottom(
             'This will delete cached images and redownload them. Proceed?'
         )
         ans = input(f'Directory to be deleted: {self._data.main_path}\n')
         if ans == 'y' or not ans:
             # Will remove all data, but keep info on the main path
+            self._cancel_background_work(wait=True)
             rmtree(self._data.main_path)
+            catalog.db.remove(self._data.main_path)
+            blobstore.prune_in_background()
             lscat.api.hide_all(self.images)
-            self.start(self._data.main_path)
+            # Only the responses of this view are fetched again
+            with api.myapi.refreshing():
+                self.start(self._data.main_path)
         self._prompt(self)
 
 
@@ -244,8 +403,8 @@ class AbstractGallery(AbstractUI, ABC):
 
     def _back(self) -> 'IO':
         """After user 'back's from image prompt or artist gallery, start mode again"""
-        self.scroll_or_show()
-        self._report()
+        self._show_page()
+        self._prefetch()  # In case it was cancelled
         prompt.gallery_like_prompt(self)
 
 
@@ -297,6 +456,7 @@ class ArtistGallery(AbstractGallery):
         # Display image (using either coords or image number), the show this prompt
         if keyseqs[0] == 'b':
             lscat.api.hide_all(self.images)
+            self._cancel_background_work()
             # Gallery instance stopped here, return to previous state
         elif keyseqs[0] == 'r':
             self.reload()
@@ -375,6 +535,7 @@ class IllustFollowGallery(AbstractGallery):
         """Like self.view_image(), but goes to artist mode instead of image"""
         artist_user_id = self._data.artist_user_id(selected_image_num)
         lscat.api.hide_all(self.images)
+        self._cancel_background_work()
         mode = ArtistGallery(artist_user_id)
         prompt.gallery_like_prompt(mode)
         # Gallery prompt ends, user presses back
@@ -483,10 +644,12 @@ class AbstractUsers(AbstractUI, ABC):
             return False
 
         lscat.api.hide_all(self.images)
+        self._cancel_background_work()
         mode = ArtistGallery(artist_user_id)
         prompt.gallery_like_prompt(mode)
         # After backing from gallery
         self._show_page()
+        self._prefetch()
         prompt.user_prompt(self)
 
 
@@ -587,9 +750,9 @@ class ViewImage(ToImage):
         return post_json.id
 
     def maybe_show_preview(self) -> 'IO':
-        os.system('clear')
-        image = sorted(os.listdir(self._gdata.download_path))[self._selected_image_num]
-        lscat.api.show_center(self._gdata.main_path / str(self._gdata.page_num) / image)
+        printer.clear_screen()
+        image = files.page_names(self._gdata.download_path)[self._selected_image_num]
+        lscat.api.show_center(self._gdata.download_path / image)
 
     def download_image(self, idata) -> 'IO':
         download.download_url(
@@ -640,7 +803,8 @@ class Image(data.ImageData):  # Extends the data class by adding IO actions on t
     def __init__(self, raw: 'Json', image_id: str, firstmode=False):
         super().__init__(raw, image_id, firstmode)
         self.use_ueberzug = config.api.use_ueberzug()
-        self.event = threading.Event()
+        # Set when the previews (and their downloads) should stop
+        self.event = utils.CancelToken()
         # Defined in self.start_preview()
         self.loc: 'tuple[int]'
         self.image: 'list[Image]' = []
@@ -655,8 +819,9 @@ class Image(data.ImageData):  # Extends the data class by adding IO actions on t
         return ViewPostMode(image_id).start()
 
     def display_initial(self) -> 'IO':
-        os.system('clear')
+        printer.clear_screen()
         self.image = lscat.api.show_center(self.download_path / self.large_filename)
+        cache.touch(cache.unit_of(self.download_path / self.large_filename))
         printer.print_bottom(
             f'Page 1/{self.number_of_pages}', use_ueberzug=self.use_ueberzug
         )
@@ -722,9 +887,11 @@ class Image(data.ImageData):  # Extends the data class by adding IO actions on t
         # Pass in path to api.download as planned
         threading.Thread(target=self._prefetch_next_image).start()
         if not (self.download_path / self.image_filename).is_dir():
-            download.async_download_spinner(self.download_path, [self.current_url])
+            download.async_download_spinner(
+                self.download_path, [self.current_url], download.Priority.VISIBLE
+            )
 
-        os.system('clear')
+        printer.clear_screen()
         lscat.api.hide(self.image)
         lscat.api.hide_all(self.preview_images)
 
@@ -740,7 +907,9 @@ class Image(data.ImageData):  # Extends the data class by adding IO actions on t
         with suppress(IndexError):
             next_img_url = self.next_img_url
         if next_img_url:
-            download.async_download_spinner(self.download_path, [next_img_url])
+            download.async_download_spinner(
+                self.download_path, [next_img_url], download.Priority.PREVIEW
+            )
 
     def leave(self, force=False) -> 'IO':
         lscat.api.hide(self.image)
@@ -762,7 +931,7 @@ class Image(data.ImageData):  # Extends the data class by adding IO actions on t
     def start_preview(self) -> 'IO':
         self.loc = TERM.get_location()
         if config.api.image_mode_previews() and self.number_of_pages > 1:
-            self.event = threading.Event()  # Reset event, in case if it's set
+            self.event = utils.CancelToken()  # Reset event, in case if it's set
             threading.Thread(target=self.preview).start()
 
     def preview(self) -> 'IO':
@@ -784,9 +953,13 @@ class Image(data.ImageData):  # Extends the data class by adding IO actions on t
             if path.is_file():
                 tracker.update(name)
             else:
-                download.async_download_no_rename(
-                    self.download_path, [url], tracker=tracker
-                )
+                try:
+                    download.async_download_no_rename(
+                        self.download_path, [url], tracker, download.Priority.PREVIEW,
+                        self.event
+                    )
+                except utils.Cancelled:
+                    return
 
             if i == 4:  # Last pic
                 printer.move_cursor_xy(self.loc[0], self.loc[1])
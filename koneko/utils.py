@@ -18,12 +18,14 @@ from math import ceil
 from sys import platform
 from pathlib import Path
 from collections import Counter
-from subprocess import check_output
 from logging.handlers import RotatingFileHandler
 
 import funcy
 
-from koneko import config, KONEKODIR
+from koneko import pure, cache, files, config, printer, lazy_import, KONEKODIR
+
+
+urlretrieve = lazy_import('urllib.request', 'urlretrieve')  # Only for the first launch
 
 
 # History and logging
@@ -61,6 +63,22 @@ def format_frequent(counter: 'dict[str, int]') -> 'list[str]':
     return [f'{k} ({v})' for (k, v) in counter.items()]
 
 
+# Cancellation
+class Cancelled(Exception):
+    """Raised by work that was stopped because its CancelToken was set"""
+
+
+class CancelToken(threading.Event):
+    """Set when the work it was given to is no longer wanted (eg, the user left the
+    view that started it). The work stops at its next check(); downloads check
+    between every chunk
+    """
+
+    def check(self) -> None:
+        if self.is_set():
+            raise Cancelled
+
+
 # Wrapping other functions
 def _spin(done: 'Event', message: str) -> None:
     for char in itertools.cycle('|/-\\'):  # Infinite loop
@@ -90,7 +108,7 @@ def catch_ctrl_c(func: 'func[T]') -> 'T':
     try:
         return func()
     except KeyboardInterrupt:
-        os.system('clear')
+        printer.clear_screen()
 
 
 # Calculations
@@ -107,7 +125,7 @@ def max_images_user():
 
 
 def max_terminal_scrolls(data, is_gallery_mode: bool) -> int:
-    number_of_images = len(os.listdir(data.download_path))
+    number_of_images = len(files.page_names(data.download_path))
     if is_gallery_mode:
         return number_of_images // max_images() + 1
     return number_of_images // max_images_user()
@@ -175,18 +193,13 @@ def handle_missing_pics() -> 'IO':
 
     basedir.mkdir(parents=True)
     for pic in ('71471144_p0.png', '79494300_p0.png'):
-        os.system(f'curl -s {baseurl}{pic} -o {basedir}/{pic}')
+        urlretrieve(f'{baseurl}{pic}', f'{basedir}/{pic}')
 
-    os.system('clear')
+    printer.clear_screen()
 
 
 def get_cache_size() -> str:
-    extra = '' if platform == 'darwin' else '--apparent-size'
-    return (
-        check_output(f'du -hs {extra} {KONEKODIR} | cut -f1', shell=True)
-        .decode('utf-8')
-        .rstrip()
-    )
+    return pure.human_size(cache.usage())
 
 
 def quit_on_q(ans: str):
@@ -194,10 +207,18 @@ def quit_on_q(ans: str):
         sys.exit(0)
 
 
-# Ueberzug
+# Optional dependencies
 def try_import_ueberzug():
     try:
         import ueberzug.lib.v0 as ueberzug
     except ImportError as e:
         raise ImportError("Install with `pip install ueberzug`") from e
     return ueberzug
+
+
+def try_import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError("Install with `pip install aiohttp`") from e
+    return aiohttp
@@ -37,16 +37,17 @@ setup(
     include_package_data=True,
     install_requires=[
         'PixivPy~=3.5',
+        'requests~=2.24',
         'pixcat~=0.1',
         'docopt~=0.6',
         'blessed~=1.17',
         'pick>=0.6,<2.0',
-        'funcy~=1.14',
+        'funcy>=1.15',
         'returns~=0.14',
         'placeholder~=1.1',
     ],
     tests_require=['pytest>=5.4,<7.0'],
-    extras_require={'ueberzug': ['ueberzug~=18.1']},
+    extras_require={'ueberzug': ['ueberzug~=18.1'], 'asyncio': ['aiohttp~=3.7']},
     entry_points={
         'console_scripts': [
             'koneko=koneko.__main__:_main',
@@ -0,0 +1,90 @@
+"""Compares the renderers in lscat, by drawing a grid of thumbnails twice
+(the second time is like scrolling back, or going back to a cached page).
+Reports the time taken and the bytes written to the terminal for each draw.
+Not to be used with pytest; run it inside kitty, from the repo root:
+
+    python testing/benchmark_renderers.py [<dir of images>] [<number of images>]
+
+By default it draws the images of KONEKODIR / testgallery.
+Over ssh, only the 'direct' kitty medium can work.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+from koneko import KONEKODIR, TERM, lscat, files, printer, thumbnails
+
+
+class CountingStdout:
+    """Passes everything through to the terminal, counting the bytes written"""
+
+    def __init__(self, stdout):
+        self._stdout = stdout
+        self.written = 0
+
+    def write(self, text):
+        self.written += len(text.encode())
+        return self._stdout.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stdout, name)
+
+
+def draw(display, images, size) -> 'list':
+    columns = max(1, TERM.width // (size // 10 + 2))
+    shown = []
+    for i, image in enumerate(images):
+        x = (i % columns) * (size // 10 + 2)
+        y = (i // columns) * (size // 20 + 1) % max(1, TERM.height - size // 20)
+        shown.append(display.show(image, x, y, size))
+    return shown
+
+
+def measure(display, images, size) -> 'list[tuple[float, int]]':
+    results = []
+    for _ in range(2):
+        counter = sys.stdout = CountingStdout(sys.__stdout__)
+        start = time.perf_counter()
+        shown = draw(display, images, size)
+        sys.stdout.flush()
+        elapsed = time.perf_counter() - start
+        sys.stdout = sys.__stdout__
+
+        results.append((elapsed, counter.written))
+        for image in shown:
+            display.hide(image)
+    return results
+
+
+def main(path: 'Path', number: int):
+    images = [path / name for name in files.page_names(path)][:number]
+    size = 310
+    # Scale every thumbnail beforehand, so both renderers start from a warm cache
+    for image in images:
+        thumbnails.make(image, size)
+
+    displays = {
+        'pixcat': lscat.Pixcat(),
+        'kitty (file)': lscat.Kitty('file'),
+        'kitty (shm)': lscat.Kitty('shm'),
+        'kitty (direct)': lscat.Kitty('direct'),
+    }
+    results = {}
+    for name, display in displays.items():
+        printer.clear_screen()
+        results[name] = measure(display, images, size)
+    printer.clear_screen()
+
+    print(f'{len(images)} images from {path}')
+    print(f'{"renderer":<16}{"first draw":>26}{"redraw":>26}')
+    for name, draws in results.items():
+        cells = ''.join(f'{secs * 1000:>12.1f} ms{written:>9} B' for secs, written in draws)
+        print(f'{name:<16}{cells}')
+
+
+if __name__ == '__main__':
+    main(
+        Path(sys.argv[1]) if len(sys.argv) > 1 else KONEKODIR / 'testgallery',
+        int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    )
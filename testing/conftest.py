@@ -7,6 +7,36 @@ from contextlib import contextmanager
 import pytest
 
 
+@pytest.fixture(autouse=True)
+def use_tmp_catalog(monkeypatch, tmp_path_factory):
+    """Never touch the catalog of the real cache"""
+    from koneko import catalog
+    tmp = tmp_path_factory.mktemp('catalog')
+    db = catalog.Catalog(tmp / 'cache', tmp / 'catalog.sqlite3')
+    monkeypatch.setattr('koneko.catalog.db', db)
+    yield db
+    db.close()
+
+
+@pytest.fixture(autouse=True)
+def use_tmp_blobdir(monkeypatch, tmp_path_factory):
+    """Never touch the image store of the real cache"""
+    blobdir = tmp_path_factory.mktemp('blobs')
+    monkeypatch.setattr('koneko.blobstore.BLOBDIR', blobdir)
+    return blobdir
+
+
+@pytest.fixture(autouse=True)
+def reset_config_snapshot():
+    """Tests patch the terminal size and settings, so never reuse computed values"""
+    from koneko import config
+    config.invalidate_layout()
+    config.api._values.clear()
+    yield
+    config.invalidate_layout()
+    config.api._values.clear()
+
+
 @pytest.fixture()
 def send_enter(monkeypatch):
     monkeypatch.setattr('builtins.input', lambda *x: '')
@@ -25,6 +55,17 @@ def patch_cbreak(monkeypatch):
     monkeypatch.setattr('koneko.TERM.cbreak', fakecbreak)
 
 
+@pytest.fixture
+def no_subprocess(monkeypatch):
+    """Navigating must never spawn a process (eg `clear`)"""
+    def spawn(*args, **kwargs):
+        raise AssertionError(f'Spawned a process: {args}')
+
+    monkeypatch.setattr('os.system', spawn)
+    monkeypatch.setattr('os.posix_spawn', spawn)
+    monkeypatch.setattr('subprocess.Popen', spawn)
+
+
 class CustomExit(SystemExit):
     """Replaces all expected instances of an exit,
     to ensure that code exits only where this exception is mocked into
@@ -72,11 +113,20 @@ def setup_test_config(path, Config, *args):
         'misc': {
             'print_info': 'on'
         },
+        'performance': {
+            'download_workers': 10,
+            'prefetch_depth': 2,
+            'cache_size_limit': 0,
+            'cache_eviction_policy': 'lru',
+        },
         'experimental': {
             'image_mode_previews': 'off',
+            'use_asyncio': 'off',
             'use_ueberzug': 'off',
             'scroll_display': 'on',
             'ueberzug_center_spaces': 20,
+            'renderer': 'kitty',
+            'kitty_transmission': 'auto',
         }
     }
 
@@ -0,0 +1,53 @@
+"""Reports what importing koneko's entry points costs, like `python -X importtime`
+but sorted, and for a fresh interpreter each time.
+Not to be used with pytest (see test_imports.py for the budget); run it with:
+
+    python testing/importtime.py [<module> ...] [-n <number of rows>]
+"""
+
+import sys
+import subprocess
+
+
+ENTRY_POINTS = ('koneko.__main__', 'koneko.lscat_app')
+
+
+def measure(module: str) -> 'list[tuple[int, int, str]]':
+    """(cumulative, self, name) of every import, in microseconds, slowest first"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(rows, reverse=True)
+
+
+def total(module: str, measured=None) -> int:
+    """Microseconds to import the module, including everything it imports"""
+    measured = measured or measure(module)
+    return next(cumulative for cumulative, _, name in measured if name == module)
+
+
+def report(module: str, rows: int) -> 'IO':
+    measured = measure(module)
+    print(f'{module}: {total(module, measured) / 1000:.1f} ms')
+    print(f'{"cumulative":>12}{"self":>10}  module')
+    for cumulative, self_us, name in measured[:rows]:
+        print(f'{cumulative / 1000:>9.1f} ms{self_us / 1000:>7.1f} ms  {name}')
+    print()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    rows = 25
+    if '-n' in args:
+        index = args.index('-n')
+        rows = int(args[index + 1])
+        del args[index:index + 2]
+    for module in args or ENTRY_POINTS:
+        report(module, rows)
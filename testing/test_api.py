@@ -1,9 +1,23 @@
+import io
+import os
+import threading
 from unittest.mock import Mock, call
 
 import pytest
 from pixivpy3 import PixivError
 
-from koneko import api
+from koneko import api, utils, engine, ratelimit
+
+
+@pytest.fixture(autouse=True)
+def use_tmp_jsondir(monkeypatch, tmp_path):
+    monkeypatch.setattr('koneko.jsoncache.JSONDIR', tmp_path / 'json')
+
+
+@pytest.fixture(autouse=True)
+def unlimited_rate(monkeypatch):
+    monkeypatch.setattr('koneko.ratelimit.app_api', ratelimit.TokenBucket(1000, 1000))
+    monkeypatch.setattr('koneko.ratelimit.images', ratelimit.TokenBucket(1000, 1000))
 
 
 def raises():
@@ -28,7 +42,7 @@ def test_api_login_without_token_no_error(monkeypatch):
     testapi.start({'username': 'test', 'password': '1234'})
 
     assert mocked_api.method_calls == [call.login('test', '1234')]
-    assert mocked_api.subscripts == ['response', 'refresh_token']
+    assert mocked_api.subscripts == ['response', 'refresh_token', 'response', 'expires_in']
     assert writer_mock.call_args_list == [call(api.myapi._token_file, mocked_api.login())]
 
 
@@ -65,7 +79,7 @@ def test_api_login_with_token_token_error_uses_normal_method(monkeypatch):
     testapi.start({'username': 'test', 'password': '1234'})
 
     assert mocked_api.method_calls == [call.login('test', '1234')]
-    assert mocked_api.subscripts == ['response', 'refresh_token']
+    assert mocked_api.subscripts == ['response', 'refresh_token', 'response', 'expires_in']
     assert writer_mock.call_args_list == [call(api.myapi._token_file, mocked_api.login())]
 
 
@@ -98,6 +112,64 @@ def test_api_mode1(monkeypatch):
     assert testapi._login_done == True
 
 
+def test_api_mode_cached_does_not_wait_for_login():
+    mocked_api = Mock()
+    mocked_api.user_illusts.return_value = {'illusts': []}
+    testapi = api.APIHandler()
+    testapi._api = mocked_api
+    testapi._login_started = False
+    testapi.artist_gallery(123, 0)  # Cache the response
+
+    mock_thread = Mock()
+    testapi._api_thread = mock_thread
+    testapi._login_started = True
+    testapi._login_done = False
+
+    assert testapi.artist_gallery(123, 0) == {'illusts': []}
+    assert mock_thread.mock_calls == []
+    assert mocked_api.user_illusts.call_count == 1
+
+
+def test_api_refresh_token(monkeypatch):
+    writer_mock = Mock()
+    monkeypatch.setattr('koneko.files.write_token_file', writer_mock)
+    timers = []
+    monkeypatch.setattr('threading.Timer', lambda delay, f: timers.append(delay) or Mock())
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api.auth.return_value = {
+        'response': {'refresh_token': 'new_token', 'expires_in': 3600}
+    }
+    testapi._token = 'old_token'
+
+    testapi._schedule_refresh(100)
+    assert timers == [0]
+    testapi._refresh()
+
+    assert testapi._api.auth.call_args_list == [call(refresh_token='old_token')]
+    assert testapi._token == 'new_token'
+    assert writer_mock.call_args_list == [call(testapi._token_file, 'new_token')]
+    assert timers == [0, 3600 - api.REFRESH_MARGIN]
+    # Not due, so nothing happens
+    testapi._refresh()
+    assert testapi._api.auth.call_count == 1
+
+
+def test_api_refresh_token_failed_retries(monkeypatch):
+    timers = []
+    monkeypatch.setattr('threading.Timer', lambda delay, f: timers.append(delay) or Mock())
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api.auth = lambda **k: raises()
+    testapi._token = 'token'
+
+    testapi._schedule_refresh(0)
+    testapi._refresh()
+
+    assert testapi._token == 'token'
+    assert timers == [0, api.REFRESH_RETRY]
+
+
 def test_api_mode2(monkeypatch):
     mocked_api = Mock()
     mock_thread = Mock()
@@ -200,18 +272,312 @@ def test_api_mode6(monkeypatch):
     assert testapi._login_done == True
 
 
-def test_api_protected_download(monkeypatch):
-    mocked_api = Mock()
+class FakeResponse:
+    def __init__(self, content, status_code=200, headers=None):
+        self.raw = io.BytesIO(content)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise api.requests.HTTPError(self.status_code, response=self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        pass
+
+
+def test_api_request_served_from_cache(monkeypatch):
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api.user_illusts.return_value = {'illusts': [{'id': 1}]}
+
+    assert testapi._request('user_illusts', 123, offset=0) == {'illusts': [{'id': 1}]}
+    assert testapi._request('user_illusts', 123, offset=0).illusts[0].id == 1
+    assert testapi._api.user_illusts.call_count == 1
+
+
+def test_api_request_stale_revalidates(monkeypatch):
+    monkeypatch.setattr('koneko.jsoncache.TTL', {'user_illusts': 0})
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api.user_illusts.side_effect = [{'illusts': [1]}, {'illusts': [2]}]
+    threads = []
+    monkeypatch.setattr(
+        'threading.Thread',
+        lambda target, args, kwargs, daemon: threads.append((target, args, kwargs)) or Mock()
+    )
+
+    testapi._request('user_illusts', 123, offset=0)
+    # Stale, so the old response is returned and a revalidation is started
+    assert testapi._request('user_illusts', 123, offset=0) == {'illusts': [1]}
+    target, args, kwargs = threads[0]
+    target(*args, **kwargs)
+    assert testapi._request('user_illusts', 123, offset=0) == {'illusts': [2]}
+
+
+def test_in_flight_coalesces():
+    in_flight = api.InFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow(x):
+        calls.append(x)
+        started.set()
+        release.wait()
+        return x * 2
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(in_flight.run('k', slow, 1)))
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(in_flight.run('k', slow, 1)))
+        for _ in range(3)
+    ]
+    for thread in followers:
+        thread.start()
+    while in_flight.coalesced < 3:
+        pass
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [2] * 4
+    assert in_flight.coalesced == 3
+    # Finished requests are not coalesced with later ones
+    assert in_flight.run('k', slow, 2) == 4
+    assert calls == [1, 2]
+
+
+def test_in_flight_shares_exceptions():
+    in_flight = api.InFlight()
+    with pytest.raises(PixivError):
+        in_flight.run('k', raises)
+    assert in_flight._futures == {}
+
+
+def test_api_response_hook_backs_off():
+    response = Mock(status_code=429, headers={'Retry-After': '3'})
+
+    with pytest.raises(PixivError):
+        api._observe_api_response(response)
+    assert ratelimit.app_api.backoffs == 1
+    assert 2.9 < ratelimit.app_api.reserve() <= 3
+
+    api._observe_api_response(Mock(status_code=200, headers={}))
+    assert ratelimit.app_api._failures == 0
+
+
+def test_api_protected_download(monkeypatch, tmp_path):
+    mocked_session = Mock()
+    mocked_session.get.return_value = FakeResponse(b'image')
     mock_thread = Mock()
 
     testapi = api.APIHandler()
-    testapi._api = mocked_api
+    testapi._image_session = mocked_session
     testapi._api_thread = mock_thread
     testapi._login_started = True
     testapi._login_done = False
 
-    testapi.protected_download('url', 'path', 'name')
-
-    assert mocked_api.mock_calls == [call.download('url', path='path', name='name')]
+    assert testapi.protected_download('https://i.pximg.net/a/b.jpg', tmp_path, 'name')
+    # Existing files are not downloaded again
+    assert not testapi.protected_download('https://i.pximg.net/a/b.jpg', tmp_path, 'name')
+    # Same url under another name is linked from the store, not downloaded again
+    assert testapi.protected_download('https://i.pximg.net/a/b.jpg', tmp_path, None)
+
+    assert (tmp_path / 'name').read_bytes() == b'image'
+    assert (tmp_path / 'b.jpg').samefile(tmp_path / 'name')
+    assert mocked_session.mock_calls == [
+        call.get('https://i.pximg.net/a/b.jpg', stream=True, headers={})
+    ]
     assert mock_thread.mock_calls == [call.join()]
     assert testapi._login_done == True
+    assert testapi.connection_stats.requests == 1
+
+
+def test_image_session(monkeypatch):
+    stats = api.ConnectionStats()
+    session = api.new_image_session(stats, 7)
+
+    adapter = session.get_adapter('https://i.pximg.net/img.jpg')
+    assert isinstance(adapter, api.ImageAdapter)
+    assert adapter._pool_maxsize == 7
+    assert session.get_adapter('https://s.pximg.net/img.jpg') is adapter
+    assert session.headers['Referer'] == api.REFERER
+
+    pool = adapter.poolmanager.connection_from_url('https://i.pximg.net/img.jpg')
+    assert pool.ConnectionCls.stats is stats
+    assert pool.pool.maxsize == 7
+
+
+def test_connection_stats():
+    stats = api.ConnectionStats()
+    for _ in range(5):
+        stats.add_request()
+    stats.add_connection(0.25)
+    stats.add_connection(0.5)
+
+    assert stats.reused == 3
+    assert stats.as_dict() == {
+        'requests': 5, 'connections': 2, 'reused': 3, 'handshake_time': 0.75
+    }
+
+
+def test_api_protected_download_resumes(monkeypatch, tmp_path):
+    responses = [
+        # Connection dropped after 3 of 5 bytes
+        FakeResponse(b'abc', headers={'Content-Length': '5'}),
+        FakeResponse(b'de', status_code=206, headers={'Content-Length': '2'}),
+    ]
+    mocked_session = Mock()
+    mocked_session.get.side_effect = lambda *a, **k: responses.pop(0)
+    testapi = api.APIHandler()
+    testapi._image_session = mocked_session
+    testapi._login_done = True
+
+    assert testapi.protected_download('https://i.pximg.net/a/b.jpg', tmp_path, 'name')
+
+    assert (tmp_path / 'name').read_bytes() == b'abcde'
+    assert not (tmp_path / '.name.part').exists()
+    assert mocked_session.get.call_args_list == [
+        call('https://i.pximg.net/a/b.jpg', stream=True, headers={}),
+        call('https://i.pximg.net/a/b.jpg', stream=True, headers={'Range': 'bytes=3-'}),
+    ]
+
+
+def test_api_protected_download_range_ignored(tmp_path):
+    (tmp_path / '.name.part').write_bytes(b'old')
+    mocked_session = Mock()
+    mocked_session.get.return_value = FakeResponse(b'image', headers={'Content-Length': '5'})
+    testapi = api.APIHandler()
+    testapi._image_session = mocked_session
+    testapi._login_done = True
+
+    assert testapi.protected_download('https://i.pximg.net/a/b.jpg', tmp_path, 'name')
+    assert (tmp_path / 'name').read_bytes() == b'image'
+
+
+def test_api_protected_download_cancelled(tmp_path):
+    token = utils.CancelToken()
+
+    class CancellingRaw(io.BytesIO):
+        def read(self, size):
+            chunk = super().read(size)
+            if self.tell() > engine.CHUNK_SIZE:
+                token.set()
+            return chunk
+
+    mocked_session = Mock()
+    mocked_session.get.return_value = FakeResponse(b'')
+    mocked_session.get.return_value.raw = CancellingRaw(b'x' * engine.CHUNK_SIZE * 3)
+    testapi = api.APIHandler()
+    testapi._image_session = mocked_session
+    testapi._login_done = True
+
+    with pytest.raises(utils.Cancelled):
+        testapi.protected_download('https://i.pximg.net/a/b.jpg', tmp_path, 'name', token)
+    # The partial file is removed, and cancelling is not retried
+    assert os.listdir(tmp_path) == []
+    assert mocked_session.get.call_count == 1
+
+
+def test_api_offline_request():
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api.user_illusts.return_value = {'illusts': [1]}
+    testapi._request('user_illusts', 123, offset=0)
+    testapi.go_offline()
+
+    assert testapi._request('user_illusts', 123, offset=0) == {'illusts': [1]}
+    with pytest.raises(api.Offline, match=r"user_illusts\(123, offset=30\) is not cached"):
+        testapi._request('user_illusts', 123, offset=30)
+    assert testapi._api.user_illusts.call_count == 1
+
+
+def test_api_offline_stale_not_revalidated(monkeypatch):
+    monkeypatch.setattr('koneko.jsoncache.TTL', {'user_illusts': 0})
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api.user_illusts.return_value = {'illusts': [1]}
+    testapi._request('user_illusts', 123, offset=0)
+    testapi.go_offline()
+    monkeypatch.setattr('threading.Thread', Mock(side_effect=AssertionError))
+
+    assert testapi._request('user_illusts', 123, offset=0) == {'illusts': [1]}
+
+
+def test_api_offline_does_not_login():
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api_thread = Mock()
+    testapi.go_offline()
+
+    testapi.start({'username': 'test', 'password': '1234'})
+
+    assert testapi._api_thread.mock_calls == []
+    assert testapi._api.mock_calls == []
+
+
+def test_api_offline_protected_download(tmp_path):
+    (tmp_path / 'cached.jpg').touch()
+    testapi = api.APIHandler()
+    testapi._image_session = Mock(side_effect=AssertionError)
+    testapi.go_offline()
+
+    assert testapi.protected_download('https://i.pximg.net/cached.jpg', tmp_path, None) is False
+    with pytest.raises(api.Offline, match='missing.jpg is not cached'):
+        testapi.protected_download('https://i.pximg.net/missing.jpg', tmp_path, None)
+    assert not testapi.download_future(
+        'https://i.pximg.net/cached.jpg', tmp_path, None
+    ).result()
+    with pytest.raises(api.Offline):
+        testapi.download_future('https://i.pximg.net/missing.jpg', tmp_path, None).result()
+
+
+@pytest.mark.parametrize('status_code, attempts', ((404, 1), (403, 1), (503, 3), (429, 3)))
+def test_api_protected_download_retries_only_transient_errors(tmp_path, status_code, attempts):
+    mocked_session = Mock()
+    mocked_session.get.side_effect = lambda *a, **k: FakeResponse(b'', status_code=status_code)
+    testapi = api.APIHandler()
+    testapi._image_session = mocked_session
+
+    with pytest.raises(api.requests.HTTPError):
+        testapi.protected_download('https://i.pximg.net/a/b.jpg', tmp_path, None)
+    assert mocked_session.get.call_count == attempts
+
+
+def test_api_request_expired_is_fetched_first(monkeypatch):
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api.user_illusts.side_effect = [{'illusts': [1]}, {'illusts': [2]}]
+    testapi._request('user_illusts', 123, offset=0)
+    monkeypatch.setattr('koneko.jsoncache.MAX_STALE', {'user_illusts': 0})
+
+    assert testapi._request('user_illusts', 123, offset=0) == {'illusts': [2]}
+    # Offline, it is still served
+    testapi._api.user_illusts.side_effect = AssertionError
+    testapi.go_offline()
+    assert testapi._request('user_illusts', 123, offset=0) == {'illusts': [2]}
+
+
+def test_api_refreshing():
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+    testapi._api.user_illusts.side_effect = lambda user_id, offset: {'illusts': [user_id, offset]}
+    for user_id, offset in ((123, 0), (123, 30), (456, 0)):
+        testapi._request('user_illusts', user_id, offset=offset)
+
+    with testapi.refreshing():
+        testapi._request('user_illusts', 123, offset=0)
+        testapi._request('user_illusts', '123', offset='0')
+    assert testapi._api.user_illusts.call_count == 5
+
+    # Another page of the refreshed view is fetched again, other views are not
+    testapi._request('user_illusts', 123, offset=30)
+    testapi._request('user_illusts', 456, offset=0)
+    assert testapi._api.user_illusts.call_count == 6
+    assert testapi._request('user_illusts', 123, offset=0) == {'illusts': ['123', '0']}
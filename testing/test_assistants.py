@@ -35,7 +35,7 @@ def test_page_spacing_assistant(monkeypatch, disable_pixcat, capsys):
     responses = iter(['', 'not_a_number', '30'])
     monkeypatch.setattr('builtins.input', lambda *a: next(responses))
     monkeypatch.setattr('koneko.assistants.time.sleep', lambda *a, **k: Mock())
-    monkeypatch.setattr('koneko.assistants.os.system', lambda *a, **k: Mock())
+    monkeypatch.setattr('koneko.assistants.printer.clear_screen', lambda *a, **k: Mock())
 
     monkeypatch.setattr('koneko.Terminal.height', 40)
 
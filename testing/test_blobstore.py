@@ -0,0 +1,80 @@
+import os
+
+from koneko import blobstore
+
+
+URL = 'https://i.pximg.net/c/540x540_70/img-master/img/2020/05/03/81258221_p0_master1200.jpg'
+
+
+def test_add_then_link(tmp_path):
+    (tmp_path / '000_a.jpg').write_bytes(b'image')
+    assert not blobstore.link(URL, tmp_path / '001_a.jpg')
+
+    blobstore.add(URL, tmp_path / '000_a.jpg')
+    assert blobstore.blob_path(URL).read_bytes() == b'image'
+
+    assert blobstore.link(URL, tmp_path / '001_a.jpg')
+    assert (tmp_path / '001_a.jpg').samefile(tmp_path / '000_a.jpg')
+    # Only the blob and the two page files link to the image
+    assert os.stat(tmp_path / '000_a.jpg').st_nlink == 3
+
+
+def test_link_copies_without_hardlinks(tmp_path, monkeypatch):
+    (tmp_path / '000_a.jpg').write_bytes(b'image')
+    blobstore.add(URL, tmp_path / '000_a.jpg')
+
+    def no_hardlinks(*a):
+        raise PermissionError
+    monkeypatch.setattr('koneko.blobstore.os.link', no_hardlinks)
+
+    assert blobstore.link(URL, tmp_path / '001_a.jpg')
+    assert (tmp_path / '001_a.jpg').read_bytes() == b'image'
+    assert not (tmp_path / '001_a.jpg').samefile(tmp_path / '000_a.jpg')
+
+
+def test_prune(tmp_path):
+    (tmp_path / '000_a.jpg').write_bytes(b'a')
+    (tmp_path / '001_b.jpg').write_bytes(b'b')
+    blobstore.add('a', tmp_path / '000_a.jpg')
+    blobstore.add('b', tmp_path / '001_b.jpg')
+
+    os.remove(tmp_path / '000_a.jpg')
+    assert blobstore.prune() == 1
+    assert not blobstore.blob_path('a').exists()
+    assert blobstore.blob_path('b').exists()
+
+
+def test_prune_in_background(tmp_path):
+    (tmp_path / '000_a.jpg').write_bytes(b'a')
+    blobstore.add('a', tmp_path / '000_a.jpg')
+    os.remove(tmp_path / '000_a.jpg')
+
+    blobstore.prune_in_background()
+    blobstore._thread.join()
+    assert not blobstore.blob_path('a').exists()
+
+
+def test_prune_skips_vanished_blobs(tmp_path, monkeypatch):
+    for name in ('a', 'b'):
+        (tmp_path / name).write_bytes(name.encode())
+        blobstore.add(name, tmp_path / name)
+        os.remove(tmp_path / name)
+
+    scandir = os.scandir
+    def pruned_by_another_thread(path):
+        entries = list(scandir(path))
+        if path == str(blobstore.blob_path('a').parent):
+            os.remove(blobstore.blob_path('a'))
+        return iter(entries)
+    monkeypatch.setattr('koneko.blobstore.os.scandir', pruned_by_another_thread)
+
+    assert blobstore.prune() == 1
+    assert not blobstore.blob_path('b').exists()
+
+
+def test_clear(tmp_path):
+    (tmp_path / '000_a.jpg').write_bytes(b'a')
+    blobstore.add('a', tmp_path / '000_a.jpg')
+    blobstore.clear()
+    assert not blobstore.BLOBDIR.exists()
+    assert blobstore.prune() == 0
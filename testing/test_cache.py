@@ -0,0 +1,124 @@
+import os
+import time
+from types import SimpleNamespace
+from pathlib import PurePosixPath
+
+from koneko import cache
+
+
+def test_unit_of_thumbnail():
+    assert (
+        cache.unit_of(PurePosixPath('123/1/.thumbnails/000_a.jpg.100.png'))
+        == PurePosixPath('123/1')
+    )
+    assert (
+        cache.unit_of(PurePosixPath('123/individual/.thumbnails/456_p0.jpg.100.png'))
+        == PurePosixPath('123/individual/456_p0.jpg')
+    )
+
+
+def test_unit_of():
+    assert cache.unit_of(PurePosixPath('123/1/000_a.jpg')) == PurePosixPath('123/1')
+    assert (
+        cache.unit_of(PurePosixPath('123/individual/456_p0.jpg'))
+        == PurePosixPath('123/individual/456_p0.jpg')
+    )
+    assert (
+        cache.unit_of(PurePosixPath('123/individual/456/456_p1.jpg'))
+        == PurePosixPath('123/individual/456')
+    )
+
+
+def test_units():
+    cached_files = [
+        ('123/1/000_a.jpg', 10, 100.0, 1),
+        ('123/1/001_b.jpg', 20, 200.0, 2),
+        ('123/1/.manifest.json', 1, 200.0, 3),
+        ('123/individual/456_p0.jpg', 5, 50.0, 4),
+        ('123/individual/.thumbnails/456_p0.jpg.100.png', 1, 60.0, 5),
+        ('illustfollow/1/000_a.jpg', 10, 100.0, 1),  # Hard link
+        ('history', 1, 0.0, 6),
+    ]
+    accesses = {'123/1': (300.0, 4), 'deleted/1': (1.0, 1)}
+    assert cache.units(cached_files, accesses) == {
+        '123/1': [26, 300.0, 4],
+        '123/individual/456_p0.jpg': [6, 60.0, 0],
+        'illustfollow/1': [5, 100.0, 0],
+    }
+
+
+def test_to_evict_lru():
+    units = {'a': [10, 100.0, 9], 'b': [10, 50.0, 1], 'c': [10, 200.0, 0]}
+    assert cache.to_evict(units, 'lru', 30, now=10 ** 6) == []
+    assert cache.to_evict(units, 'lru', 20, now=10 ** 6) == ['b']
+    assert cache.to_evict(units, 'lru', 5, now=10 ** 6) == ['b', 'a', 'c']
+
+
+def test_to_evict_lfu():
+    units = {'a': [10, 100.0, 9], 'b': [10, 50.0, 1], 'c': [10, 200.0, 0]}
+    assert cache.to_evict(units, 'lfu', 15, now=10 ** 6) == ['c', 'b']
+
+
+def test_to_evict_keeps_recently_viewed():
+    units = {'old': [10, 0.0, 0], 'current': [10, 1000.0, 1]}
+    assert cache.to_evict(units, 'lru', 0, now=1000.0 + cache.MIN_IDLE - 1) == ['old']
+
+
+def test_to_evict_keeps_pinned():
+    units = {'1/1': [10, 0.0, 0], '1/2': [10, 0.0, 0], '12/1': [10, 0.0, 0], '2': [10, 0.0, 0]}
+    assert cache.to_evict(units, 'lru', 0, now=10 ** 6, pinned=['1', '2']) == ['12/1']
+    assert cache.is_pinned('1/individual/a.jpg', ['1'])
+    assert not cache.is_pinned('12/1', ['1'])
+
+
+def test_evict(tmp_path, monkeypatch, use_tmp_catalog):
+    use_tmp_catalog.root = tmp_path
+    monkeypatch.setattr('koneko.config.api.cache_size_limit', lambda: 1)  # MiB
+    monkeypatch.setattr('koneko.config.api.cache_eviction_policy', lambda: 'lru')
+
+    old = time.time() - cache.MIN_IDLE * 2
+    for page in ('1', '2'):
+        (tmp_path / '123' / page).mkdir(parents=True)
+        filepath = tmp_path / '123' / page / '000_a.jpg'
+        filepath.write_bytes(b'x' * 1024 ** 2)
+        os.utime(filepath, (old, old))
+        use_tmp_catalog.add_file(filepath)
+    assert cache.usage() == 2 * 1024 ** 2
+
+    # Page 1 was viewed, so page 2 is the least recently used
+    cache.touch(tmp_path / '123' / '1')
+    later = time.time() + cache.MIN_IDLE
+    monkeypatch.setattr('koneko.cache.time', SimpleNamespace(time=lambda: later))
+
+    assert cache.evict() == ['123/2']
+    assert not (tmp_path / '123' / '2').exists()
+    assert (tmp_path / '123' / '1' / '000_a.jpg').exists()
+    assert cache.usage() == 1024 ** 2
+
+
+def test_evict_unlimited(monkeypatch):
+    monkeypatch.setattr('koneko.config.api.cache_size_limit', lambda: 0)
+    assert cache.evict() == []
+
+
+def test_evict_keeps_open_views(tmp_path, monkeypatch, use_tmp_catalog):
+    use_tmp_catalog.root = tmp_path
+    monkeypatch.setattr('koneko.config.api.cache_size_limit', lambda: 1)  # MiB
+    monkeypatch.setattr('koneko.config.api.cache_eviction_policy', lambda: 'lru')
+
+    old = time.time() - cache.MIN_IDLE * 2
+    for page in ('1', '2'):
+        (tmp_path / '123' / page).mkdir(parents=True)
+        filepath = tmp_path / '123' / page / '000_a.jpg'
+        filepath.write_bytes(b'x' * 1024 ** 2)
+        os.utime(filepath, (old, old))
+        use_tmp_catalog.add_file(filepath)
+
+    class View:
+        pass
+    view = View()
+    cache.pin(view, tmp_path / '123')
+    assert cache.evict() == []
+
+    del view
+    assert cache.evict() == ['123/1']
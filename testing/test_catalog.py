@@ -0,0 +1,136 @@
+import os
+from unittest.mock import Mock
+
+from koneko import catalog
+
+
+def make_catalog(tmp_path):
+    root = tmp_path / 'cache'
+    root.mkdir()
+    return root, catalog.Catalog(root, tmp_path / 'catalog.sqlite3')
+
+
+def test_first_open_scans_existing_cache(tmp_path):
+    root, db = make_catalog(tmp_path)
+    (root / '1234' / '1').mkdir(parents=True)
+    (root / '1234' / '1' / '000_a.jpg').write_bytes(b'abc')
+    (root / '1234' / '1' / '.koneko').touch()
+    (root / '1234' / '1' / '.001_b.jpg.part').touch()
+    (root / '5678' / 'individual').mkdir(parents=True)
+
+    assert db.children(root) == ['1234', '5678']
+    assert db.children(root / '1234') == ['1']
+    assert db.children(root / '1234' / '1') == ['000_a.jpg']
+    assert db.mode2_dirs() == ['5678']
+
+    # Only scanned once
+    (root / '9999').mkdir()
+    db.close()
+    assert db.children(root) == ['1234', '5678']
+    db.rebuild()
+    assert db.children(root) == ['1234', '5678', '9999']
+
+
+def test_entries_gone_from_disk(tmp_path, monkeypatch):
+    root, db = make_catalog(tmp_path)
+    for artist in ('1234', '5678'):
+        (root / artist / 'individual').mkdir(parents=True)
+        (root / artist / 'individual' / 'a.jpg').write_bytes(b'abc')
+    assert db.children(root) == ['1234', '5678']
+    assert db.children(root / '1234') == ['individual']
+    db.touch(root / '5678' / 'individual' / 'a.jpg')
+
+    # Unchanged dirs are not listed again
+    listdir = Mock(side_effect=AssertionError)
+    monkeypatch.setattr('koneko.catalog.os.listdir', listdir)
+    assert db.children(root) == ['1234', '5678']
+    monkeypatch.undo()
+
+    # Deleted by hand, so the catalog doesn't know until the dir is listed
+    (root / '1234' / 'individual' / 'a.jpg').unlink()
+    (root / '1234' / 'individual').rmdir()
+    assert db.mode2_dirs() == ['1234', '5678']
+    assert db.children(root / '1234') == []
+    assert db.mode2_dirs() == ['5678']
+    assert db.total_size() == 3
+
+    (root / '1234').rmdir()
+    assert db.children(root) == ['5678']
+    assert list(db.accesses()) == ['5678/individual/a.jpg']
+
+
+def test_add_file(tmp_path):
+    root, db = make_catalog(tmp_path)
+    assert db.children(root) == []
+
+    (root / '1234' / 'individual').mkdir(parents=True)
+    filepath = root / '1234' / 'individual' / '76695217_p0.jpg'
+    filepath.write_bytes(b'abc')
+    db.add_file(filepath, 'https://i.pximg.net/76695217_p0.jpg')
+
+    assert db.children(root) == ['1234']
+    assert db.children(root / '1234') == ['individual']
+    assert db.children(root / '1234' / 'individual') == ['76695217_p0.jpg']
+    assert db.mode2_dirs() == ['1234']
+
+    # Hidden files and paths outside of the root are ignored
+    (root / '1234' / '.koneko').touch()
+    db.add_file(root / '1234' / '.koneko')
+    db.add_file(tmp_path / 'catalog.sqlite3')
+    assert db.children(root / '1234') == ['individual']
+    assert db.children(tmp_path) is None
+
+
+def test_remove(tmp_path):
+    root, db = make_catalog(tmp_path)
+    for name in ('12/1/a.jpg', '12/2/b.jpg', '123/1/c.jpg'):
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).touch()
+        db.add_file(root / name)
+
+    db.remove(root / '12' / '1')
+    assert db.children(root / '12') == ['2']
+    # Siblings with the same prefix are kept
+    db.remove(root / '12')
+    assert db.children(root) == ['123']
+
+    db.remove(root)
+    assert db.children(root) == []
+
+
+def test_sizes_count_hidden_files_and_links_once(tmp_path):
+    root, db = make_catalog(tmp_path)
+    for page in ('1', '2'):
+        (root / '12' / page / '.thumbnails').mkdir(parents=True)
+    (root / '12' / '1' / 'a.jpg').write_bytes(b'abc')
+    os.link(root / '12' / '1' / 'a.jpg', root / '12' / '2' / 'a.jpg')
+    (root / '12' / '1' / '.manifest.json').write_bytes(b'{}')
+    (root / '12' / '1' / '.thumbnails' / 'a.jpg.100.png').write_bytes(b'p')
+    (root / '12' / '1' / '.a.jpg.part').write_bytes(b'partial')
+
+    assert db.total_size() == 3 + 2 + 1
+    assert db.children(root / '12' / '1') == ['a.jpg']
+
+    db.add_file(root / '12' / '2' / 'a.jpg')
+    db.add_file(root / '12' / '2' / '.a.jpg.part')
+    assert db.total_size() == 3 + 2 + 1
+
+
+def test_touch_and_sizes(tmp_path):
+    root, db = make_catalog(tmp_path)
+    (root / '12' / '1').mkdir(parents=True)
+    (root / '12' / '1' / 'a.jpg').write_bytes(b'abc')
+    (root / '12' / '1' / 'b.jpg').write_bytes(b'de')
+
+    assert db.total_size() == 5
+    assert sorted(path for path, _, _, _ in db.files()) == ['12/1/a.jpg', '12/1/b.jpg']
+
+    db.touch(root / '12' / '1')
+    db.touch(root / '12' / '1')
+    db.touch(tmp_path)  # Outside of the root
+    assert list(db.accesses()) == ['12/1']
+    assert db.accesses()['12/1'][1] == 2
+
+    db.remove(root / '12')
+    assert db.accesses() == {}
+    assert db.total_size() == 0
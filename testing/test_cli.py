@@ -2,7 +2,9 @@ from unittest.mock import Mock, call
 
 import pytest
 
-from koneko import cli, __version__
+from koneko import api, cli, __main__, __version__
+
+from conftest import CustomExit
 
 
 def capture_logging_in(capsys):
@@ -114,6 +116,57 @@ def test_frequent(monkeypatch, capsys):
     capture_logging_in(capsys)
 
 
+def test_offline(monkeypatch, capsys):
+    mock = Mock()
+    monkeypatch.setattr('koneko.cli.sys.argv', (['koneko', '--offline', 'a', '2232374']))
+    monkeypatch.setattr('koneko.cli.main.ArtistModeLoop', mock)
+
+    args = cli.handle_vh()
+    assert cli.mode_given(args)
+    assert cli.launch_mode(args, True)
+    assert mock.mock_calls == [call('2232374'), call().start()]
+    assert capsys.readouterr().out == 'Offline, showing only what is cached...\n'
+
+
+def test_offline_main_menu_not_cached(monkeypatch, capsys):
+    """Going back to the main menu and choosing something else that is not cached
+    shows the message again, instead of crashing
+    """
+    main_loop = Mock(side_effect=[api.Offline('not cached'), api.Offline('not cached'), CustomExit])
+    monkeypatch.setattr('koneko.__main__.sys.argv', ['koneko', '--offline'])
+    monkeypatch.setattr('koneko.__main__.config.begin_config', lambda: ({}, '1'))
+    monkeypatch.setattr('koneko.__main__.config.watch_terminal_size', lambda: True)
+    monkeypatch.setattr('koneko.__main__.printer.clear_screen', lambda: True)
+    monkeypatch.setattr('koneko.api.myapi.go_offline', lambda: True)
+    monkeypatch.setattr('koneko.__main__.main', Mock(main_loop=main_loop))
+    monkeypatch.setattr('builtins.input', lambda x=None: '')
+
+    with pytest.raises(CustomExit):
+        __main__._main()
+    assert main_loop.call_count == 3
+    assert capsys.readouterr().out.count('Offline, and not cached') == 2
+
+
+@pytest.mark.parametrize('args', (
+    ['mirror', '2232374'],
+    ['mirror', 'https://www.pixiv.net/en/users/2232374']))
+def test_mirror(monkeypatch, args, capsys):
+    mock = Mock()
+    monkeypatch.setattr('koneko.cli.sys.argv', (['koneko'] + args + ['--full']))
+    monkeypatch.setattr('koneko.cli.mirror.mirror', mock)
+
+    args = cli.handle_vh()
+    assert cli.launch_mirror(args)
+    assert mock.call_args_list == [call('2232374', full=True)]
+    capture_logging_in(capsys)
+
+
+@pytest.mark.parametrize('argv', (['koneko'], ['koneko', '--offline']))
+def test_no_mode_given(monkeypatch, argv):
+    monkeypatch.setattr('koneko.cli.sys.argv', argv)
+    assert not cli.mode_given(cli.handle_vh())
+
+
 @pytest.mark.parametrize('arg', ('-v', '--version'))
 def test_version(monkeypatch, arg, capsys):
     monkeypatch.setattr('koneko.cli.sys.argv', (['koneko', arg]))
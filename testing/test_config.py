@@ -1,5 +1,7 @@
 import os
+import signal
 import configparser
+from unittest.mock import Mock
 
 import pytest
 from returns.result import Success
@@ -16,7 +18,14 @@ defaults = (
     ('experimental', 'use_ueberzug', False),
     ('experimental', 'scroll_display', True),
     ('experimental', 'image_mode_previews', False),
+    ('experimental', 'use_asyncio', False),
     ('experimental', 'ueberzug_center_spaces', 20),
+    ('experimental', 'renderer', 'kitty'),
+    ('experimental', 'kitty_transmission', 'auto'),
+    ('performance', 'download_workers', 10),
+    ('performance', 'prefetch_depth', 2),
+    ('performance', 'cache_size_limit', 0),
+    ('performance', 'cache_eviction_policy', 'lru'),
 )
 
 
@@ -40,7 +49,8 @@ boolean_settings = (
     ('misc', 'print_info'),
     ('experimental', 'use_ueberzug'),
     ('experimental', 'scroll_display'),
-    ('experimental', 'image_mode_previews')
+    ('experimental', 'image_mode_previews'),
+    ('experimental', 'use_asyncio'),
 )
 
 
@@ -68,6 +78,9 @@ int_settings = (
     ('lscat', 'page_spacing'),
     ('lscat', 'thumbnail_size'),
     ('experimental', 'ueberzug_center_spaces'),
+    ('performance', 'download_workers'),
+    ('performance', 'prefetch_depth'),
+    ('performance', 'cache_size_limit'),
 )
 
 @pytest.mark.parametrize('setting', range(10,2))
@@ -80,6 +93,86 @@ def test_set_ints(tmp_path, setting, section, method):
     assert eval(f'testconfig.{method}()') == setting
 
 
+@pytest.mark.parametrize('setting', ('lfu', 'LFU'))
+def test_cache_eviction_policy(tmp_path, setting):
+    testconfig = setup_test_config(
+        tmp_path, config.Config,
+        Processer.set('performance', 'cache_eviction_policy', setting)
+    )
+    assert testconfig.cache_eviction_policy() == 'lfu'
+
+
+@pytest.mark.parametrize('section, method, setting', (
+    ('experimental', 'renderer', 'pixcat'),
+    ('experimental', 'kitty_transmission', 'file'),
+    ('experimental', 'kitty_transmission', 'shm'),
+    ('experimental', 'kitty_transmission', 'direct'),
+))
+def test_set_choices(tmp_path, section, method, setting):
+    testconfig = setup_test_config(
+        tmp_path, config.Config,
+        Processer.set(section, method, setting)
+    )
+    assert eval(f'testconfig.{method}()') == setting
+
+
+def test_getters_are_memoized(tmp_path, monkeypatch):
+    testconfig = setup_test_config(tmp_path, config.Config)
+    assert testconfig.page_spacing() == 23
+    monkeypatch.setattr(testconfig, 'get_setting', lambda *a: pytest.fail('Parsed again'))
+    assert testconfig.page_spacing() == 23
+
+
+def test_reload_if_changed(tmp_path, monkeypatch):
+    testconfig = setup_test_config(tmp_path, config.Config)
+    assert testconfig.page_spacing() == 23
+    setup_test_config(tmp_path, config.Config, Processer.set('lscat', 'page_spacing', '5'))
+    os.utime(tmp_path / 'test_config.ini', ns=(0, 0))
+
+    assert testconfig.reload_if_changed() is False  # Checked too recently
+    monkeypatch.setattr(testconfig, 'CHECK_INTERVAL', 0)
+    assert testconfig.reload_if_changed() is True
+    assert testconfig.page_spacing() == 5
+    assert testconfig.reload_if_changed() is False
+
+
+def test_layout_is_computed_once(tmp_path, monkeypatch):
+    monkeypatch.setattr('koneko.config.api', setup_test_config(tmp_path, config.Config))
+    monkeypatch.setattr('koneko.Terminal.width', 100)
+    monkeypatch.setattr('koneko.Terminal.height', 20)
+    layout = config.layout()
+    assert (layout.ncols, layout.nrows) == (5, 2)
+    assert config.xcoords_config() == layout.xcoords
+    assert config.xcoords_config(offset=1) == layout.users_xcoords
+    assert config.ycoords_config() == layout.ycoords
+
+    monkeypatch.setattr('koneko.Terminal.width', 40)
+    assert config.layout() is layout
+    config.invalidate_layout()
+    assert config.ncols_config() == 2
+
+
+def test_layout_recomputed_for_another_config(tmp_path, monkeypatch):
+    layout = config.layout()
+    monkeypatch.setattr('koneko.config.api', setup_test_config(tmp_path, config.Config))
+    assert config.layout() is not layout
+    assert config.layout().api is config.api
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGWINCH'), reason='No SIGWINCH')
+def test_resize_invalidates_layout(monkeypatch):
+    previous = Mock()
+    monkeypatch.setattr('koneko.config._watching', False)
+    monkeypatch.setattr(signal, 'getsignal', lambda signum: previous)
+    handlers = {}
+    monkeypatch.setattr(signal, 'signal', lambda signum, handler: handlers.update({signum: handler}))
+    config.watch_terminal_size()
+
+    layout = config.layout()
+    handlers[signal.SIGWINCH](signal.SIGWINCH, None)
+    assert config.layout() is not layout
+    assert previous.called
+
 
 def test_users_page_spacing_default(tmp_path):
     testconfig = setup_test_config(tmp_path, config.Config)
@@ -196,11 +289,7 @@ def test_begin_config_nonexistant_id(monkeypatch, tmp_path, use_test_cfg_path, c
     responses = iter(['myusername'] + responses)
     monkeypatch.setattr('builtins.input', lambda *a: next(responses))
     monkeypatch.setattr('koneko.config.getpass', lambda *a: 'mypassword')
-    # fix for macOS
-    monkeypatch.setattr(
-        'koneko.config.os.system',
-        lambda x: f'tail example_config.ini -n +9 >> {tmp_path / "test_config.ini"}'
-    )
+    monkeypatch.setattr('koneko.config._append_default_config', lambda x: True)
 
     creds, your_id = config.begin_config()
     assert your_id == testid
@@ -213,3 +302,22 @@ def test_begin_config_nonexistant_id(monkeypatch, tmp_path, use_test_cfg_path, c
 
     captured = capsys.readouterr()
     assert captured.out == '\nDo you want to save your pixiv ID? It will be more convenient\nto view artists you are following\n'
+
+
+def test_append_default_config(monkeypatch, tmp_path):
+    class FakePath:
+        def __init__(self, path):
+            pass
+
+        def expanduser(self):
+            return 'example_config.ini'
+
+    monkeypatch.setattr('koneko.config.Path', FakePath)
+    config_path = tmp_path / 'config.ini'
+    config_path.write_text('[Credentials]\nusername = koneko\n\n')
+    config._append_default_config(config_path)
+
+    testconfig = config.Config(config_path)
+    assert testconfig.get_setting('Credentials', 'username') == Success('koneko')
+    assert testconfig.page_spacing() == 23
+    assert testconfig.use_ueberzug() is False
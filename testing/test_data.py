@@ -52,16 +52,14 @@ def test_clone_with_page(mode):
 
 
 @pytest.mark.parametrize('mode', (gallery_updated, user_updated))
-def test_is_immediate_next(mode):
+def test_next_url_is_per_page(mode):
     data = mode()
-    assert data.offset == 0
-    assert data.next_offset == '30'
-    assert data.is_immediate_next is True
+    last_page = {**mode1, **mode3, 'next_url': None}
+    data.update(last_page, 2)
 
-    # This isn't realistic (offset will always be positive)
-    # but next_offset and next_url is tied to the JSON
-    data.offset = -30
-    assert data.is_immediate_next is False
+    assert data.next_offset == '30'
+    assert data.clone_with_page(2).next_url is None
+    assert data.clone_with_page(1).next_offset == '30'
 
 
 def test_urls_as_names_gdata():
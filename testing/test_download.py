@@ -1,10 +1,13 @@
+import time
+import threading
 from pathlib import Path
 from collections import namedtuple
 from unittest.mock import Mock, call
 
 import pytest
+import requests
 
-from koneko import download
+from koneko import utils, download
 
 
 def test_save_number_of_artists(tmp_path):
@@ -21,45 +24,74 @@ def test_init_download_dir_has_files(monkeypatch):
 
 def test_init_download(monkeypatch):
     mocked_api = Mock()
-    mocked_rmtree = Mock()
+    mocked_remove = Mock()
+    mocked_manifest = Mock()
     mocked_url = Mock()
     monkeypatch.setattr('koneko.api.myapi', mocked_api)
     monkeypatch.setattr('koneko.files.dir_not_empty', lambda x: False)
-    monkeypatch.setattr('koneko.download.rmtree', mocked_rmtree)
+    monkeypatch.setattr('koneko.files.remove_stale_files', mocked_remove)
+    monkeypatch.setattr('koneko.manifest.write', mocked_manifest)
+    mocked_prescale = Mock()
+    monkeypatch.setattr('koneko.download._prescale_thumbnails', mocked_prescale)
     monkeypatch.setattr('koneko.download.itertools.filterfalse', lambda *a: [mocked_url]*2)
     monkeypatch.setattr('koneko.download.os.makedirs', lambda *a, **k: True)  # Disable
 
     mocked_data = Mock()
     mocked_data.all_urls = [Mock()] * 2
+    mocked_data.newnames_with_ext = ['000_a.jpg', '001_b.jpg']
     mocked_tracker = Mock()
+    mocked_tracker.orders = [0, 1]
+    mocked_tracker.visible = 1
     download.init_download(mocked_data, mocked_tracker)
 
-    assert mocked_rmtree.call_args_list == [call(mocked_data.download_path)]
-    assert mocked_data.method_calls == [call.download_path.is_dir()]
+    assert mocked_remove.call_args_list == [
+        call(mocked_data.download_path, mocked_data.newnames_with_ext)
+    ]
     assert 'page_num' in dir(mocked_data)
     assert 'newnames_with_ext' in dir(mocked_data)
 
     assert mocked_tracker.method_calls == [call.update(mocked_url)] * 2
+    assert mocked_manifest.call_args_list == [call(
+        mocked_data.download_path,
+        {'000_a.jpg': mocked_data.all_urls[0], '001_b.jpg': mocked_data.all_urls[1]}
+    )]
+    assert mocked_prescale.call_args_list == [call(mocked_data)]
 
     assert mocked_api.method_calls == [
-        call.protected_download(mocked_data.all_urls[0], mocked_data.download_path, mocked_url),
-        call.protected_download(mocked_data.all_urls[1], mocked_data.download_path, mocked_url)
+        call.protected_download(mocked_data.all_urls[0], mocked_data.download_path, mocked_url, None),
+        call.protected_download(mocked_data.all_urls[1], mocked_data.download_path, mocked_url, None)
     ]
 
 
 def test_async_download_no_rename(monkeypatch, tmp_path):
     mocked_url = Mock()
     mocked_tracker = Mock()
+    mocked_tracker.orders = [0, 1]
+    mocked_tracker.visible = 1
     mocked_api = Mock()
     monkeypatch.setattr('koneko.api.myapi', mocked_api)
 
     download.async_download_no_rename(tmp_path, [mocked_url] * 2, mocked_tracker)
 
     assert mocked_tracker.method_calls == [call.update(None)] * 2
-    assert mocked_api.method_calls == [call.protected_download(mocked_url, tmp_path, None)] * 2
+    assert mocked_api.method_calls == [call.protected_download(mocked_url, tmp_path, None, None)] * 2
     assert tmp_path.exists()
 
 
+def test_async_download_no_rename_cancelled(monkeypatch, tmp_path):
+    token = utils.CancelToken()
+    mocked_api = Mock()
+    mocked_api.protected_download.side_effect = lambda *a: token.set()
+    monkeypatch.setattr('koneko.api.myapi', mocked_api)
+
+    with pytest.raises(utils.Cancelled):
+        download.async_download_no_rename(
+            tmp_path, ['url'] * 20, None, download.Priority.VISIBLE, token
+        )
+    # Jobs that were still queued when the token was set never start
+    assert mocked_api.protected_download.call_count < 20
+
+
 def test_download_url(monkeypatch, tmp_path, capsys):
     mocked_api = Mock()
     monkeypatch.setattr('koneko.api.myapi', mocked_api)
@@ -73,6 +105,30 @@ def test_download_url(monkeypatch, tmp_path, capsys):
     ]
 
 
+def test_download_url_verified_png_only(monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    (tmp_path / 'Downloads').mkdir()
+    requested = []
+
+    def protected_download(url, path, filename):
+        requested.append(url)
+        if url.endswith('.jpg'):
+            raise requests.HTTPError(404)
+        (path / filename).write_bytes(b'\x89PNG\r\n\x1a\n' + bytes(16))
+    monkeypatch.setattr('koneko.api.myapi.protected_download', protected_download)
+
+    download.download_url_verified(
+        'https://i.pximg.net/c/600x1200_90_webp/img-master/1_p0_master1200.jpg'
+    )
+
+    assert requested == [
+        'https://i.pximg.net/img-original/1_p0.jpg',
+        'https://i.pximg.net/img-original/1_p0.png',
+    ]
+    assert capsys.readouterr().out.endswith(
+        f'Image downloaded at {tmp_path / "Downloads" / "1_p0.png"}\n'
+    )
+
 
 class FakeData:
     def url(self):
@@ -92,3 +148,181 @@ def test_download_image_coords(monkeypatch, capsys):
 
     captured = capsys.readouterr()
     assert captured.out == f'Image downloaded at {Path("~/Downloads/fake").expanduser()}\n' * 2
+
+
+def test_download_pool_bounded(monkeypatch):
+    monkeypatch.setattr('koneko.config.api.download_workers', lambda: 3)
+    pool = download.DownloadPool()
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def job(x):
+        with lock:
+            running.append(x)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(x)
+        return x * 2
+
+    futures = pool.map(job, range(20))
+    assert [f.result() for f in futures] == [x * 2 for x in range(20)]
+    assert max(peak) <= 3
+    assert len(pool._workers) == 3
+    pool.shutdown(wait_for_workers=True)
+
+
+def test_download_pool_shutdown_cancels_queued(monkeypatch):
+    monkeypatch.setattr('koneko.config.api.download_workers', lambda: 1)
+    pool = download.DownloadPool()
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    first = pool.submit(block)
+    started.wait()
+    queued = pool.submit(lambda: True)
+    pool.shutdown()
+    release.set()
+
+    assert queued.cancelled()
+    assert first.result() is None
+    with pytest.raises(RuntimeError):
+        pool.submit(lambda: True)
+
+
+def test_download_pool_priority_order(monkeypatch):
+    monkeypatch.setattr('koneko.config.api.download_workers', lambda: 1)
+    pool = download.DownloadPool()
+    started = threading.Event()
+    release = threading.Event()
+    finished = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    pool.submit(block, priority=download.Priority.VISIBLE)
+    started.wait()
+    futures = [
+        pool.submit(finished.append, 'preview', priority=download.Priority.PREVIEW),
+        pool.submit(finished.append, 'prefetch', priority=download.Priority.PREFETCH),
+        pool.submit(finished.append, 'offscreen', priority=download.Priority.OFFSCREEN),
+        pool.submit(finished.append, 'second', priority=download.Priority.VISIBLE, rank=2),
+        pool.submit(finished.append, 'first', priority=download.Priority.VISIBLE, rank=1),
+    ]
+    release.set()
+    download.wait(futures)
+    pool.shutdown(wait_for_workers=True)
+
+    assert finished == ['first', 'second', 'offscreen', 'prefetch', 'preview']
+
+
+def test_download_pool_promote(monkeypatch):
+    monkeypatch.setattr('koneko.config.api.download_workers', lambda: 1)
+    pool = download.DownloadPool()
+    started = threading.Event()
+    release = threading.Event()
+    finished = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    pool.submit(block, priority=download.Priority.VISIBLE)
+    started.wait()
+    futures = [
+        pool.submit(finished.append, 'other', priority=download.Priority.OFFSCREEN),
+        pool.submit(finished.append, 'page 2, queued', priority=download.Priority.PREFETCH, group=2),
+        pool.submit(finished.append, 'page 3', priority=download.Priority.PREFETCH, group=3),
+    ]
+    # The user opens the page while its downloads are queued
+    pool.promote(2, download.Priority.VISIBLE)
+    # And the rest of the page is submitted after that
+    futures.append(
+        pool.submit(finished.append, 'page 2, late', priority=download.Priority.PREFETCH, group=2)
+    )
+    release.set()
+    download.wait(futures)
+    pool.shutdown(wait_for_workers=True)
+
+    assert finished == ['page 2, queued', 'page 2, late', 'other', 'page 3']
+
+def test_download_pool_cancelled_token(monkeypatch):
+    monkeypatch.setattr('koneko.config.api.download_workers', lambda: 1)
+    pool = download.DownloadPool()
+    release = threading.Event()
+    token = utils.CancelToken()
+
+    pool.submit(release.wait)
+    queued = pool.submit(lambda: True, token=token)
+    other = pool.submit(lambda: True)
+    token.set()
+    release.set()
+
+    assert other.result(timeout=5)
+    assert queued.cancelled()
+    pool.shutdown()
+
+
+def test_download_pool_background_limit(monkeypatch):
+    monkeypatch.setattr('koneko.config.api.download_workers', lambda: 4)
+    pool = download.DownloadPool()
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def job():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+
+    futures = [pool.submit(job, priority=download.Priority.PREFETCH) for _ in range(10)]
+    download.wait(futures)
+    pool.shutdown(wait_for_workers=True)
+
+    assert max(peak) <= 2
+
+
+def test_priorities():
+    FakeTracker = namedtuple('tracker', ('orders', 'visible'))
+    tracker = FakeTracker([0, 30, 31, 32, 1, 33, 34, 35], 4)
+    priorities = download._priorities(36, tracker, None)
+
+    assert priorities[0] == (download.Priority.VISIBLE, 0)
+    assert priorities[30] == (download.Priority.VISIBLE, 1)
+    assert priorities[32] == (download.Priority.VISIBLE, 3)
+    assert priorities[1] == (download.Priority.OFFSCREEN, 4)
+    assert priorities[2] == (download.Priority.OFFSCREEN, 10)
+
+    assert download._priorities(2, None, None) == [
+        (download.Priority.OFFSCREEN, 0), (download.Priority.OFFSCREEN, 1)
+    ]
+    assert download._priorities(2, tracker, download.Priority.PREFETCH) == [
+        (download.Priority.PREFETCH, 0), (download.Priority.PREFETCH, 1)
+    ]
+
+
+def test_prescale_thumbnails(monkeypatch, tmp_path):
+    mocked_submit = Mock()
+    monkeypatch.setattr('koneko.download.pool.submit', mocked_submit)
+    monkeypatch.setattr('koneko.config.api.use_ueberzug', lambda: False)
+    monkeypatch.setattr('koneko.config.api.thumbnail_size', lambda: 310)
+    FakeData = namedtuple('data', ('download_path', 'newnames_with_ext'))
+
+    download._prescale_thumbnails(FakeData(tmp_path, ['000_a.jpg']))
+    assert mocked_submit.call_args_list == [
+        call(download.thumbnails.make, tmp_path / '000_a.jpg', 310,
+             priority=download.Priority.THUMBNAIL)
+    ]
+
+    monkeypatch.setattr('koneko.config.api.use_ueberzug', lambda: True)
+    download._prescale_thumbnails(FakeData(tmp_path, ['000_a.jpg']))
+    assert mocked_submit.call_count == 1
@@ -0,0 +1,115 @@
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest.mock import Mock
+
+import pytest
+
+from koneko import api, engine, ratelimit
+
+
+def test_preparing_api():
+    preparer = engine.PreparingAPI()
+    preparer.set_auth('access', 'refresh')
+
+    prepared = preparer.user_illusts(123, offset=30)
+
+    assert isinstance(prepared, engine.PreparedRequest)
+    assert prepared.method == 'GET'
+    assert prepared.url == 'https://app-api.pixiv.net/v1/user/illusts'
+    assert prepared.params['user_id'] == 123
+    assert prepared.params['offset'] == 30
+    assert prepared.headers['Authorization'] == 'Bearer access'
+
+
+def test_send_without_asyncio_uses_pixivpy(monkeypatch):
+    monkeypatch.setattr('koneko.config.api.use_asyncio', lambda: False)
+    mocked_submit = Mock()
+    monkeypatch.setattr('koneko.engine.engine.submit', mocked_submit)
+    testapi = api.APIHandler()
+    testapi._api = Mock()
+
+    testapi._send('user_illusts', 123, offset=0)
+
+    testapi._api.user_illusts.assert_called_once_with(123, offset=0)
+    assert not mocked_submit.called
+
+
+IMAGE = bytes(range(256)) * 300
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.headers['Referer'] != engine.REFERER:
+            self.send_error(403)
+            return
+        start = int(self.headers.get('Range', 'bytes=0-')[6:-1])
+        body = IMAGE[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize('partial', (b'', IMAGE[:1000]))
+def test_engine_download(monkeypatch, tmp_path, partial):
+    pytest.importorskip('aiohttp')
+    catalogued_in = []
+    monkeypatch.setattr(
+        'koneko.catalog.db.add_file',
+        lambda *a: catalogued_in.append(threading.current_thread().name)
+    )
+    server = HTTPServer(('127.0.0.1', 0), ImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    testengine = engine.AsyncEngine()
+    if partial:
+        (tmp_path / '.img.jpg.part').write_bytes(partial)
+
+    try:
+        url = f'http://127.0.0.1:{server.server_port}/img.jpg'
+        filepath = str(tmp_path / 'img.jpg')
+        future = testengine.submit(testengine.download(url, filepath))
+        assert future.result(timeout=10)
+    finally:
+        testengine.shutdown()
+        server.shutdown()
+
+    assert (tmp_path / 'img.jpg').read_bytes() == IMAGE
+    assert not (tmp_path / '.img.jpg.part').exists()
+    # The sqlite write never blocks the other downloads on the loop
+    assert len(catalogued_in) == 1 and catalogued_in[0] != 'koneko-asyncio'
+
+
+class ErrorHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        self.send_error(int(self.path[1:]))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize('status, tries', ((403, 1), (404, 1), (500, 3)))
+def test_engine_download_retries_only_transient_errors(monkeypatch, tmp_path, status, tries):
+    aiohttp = pytest.importorskip('aiohttp')
+    monkeypatch.setattr('koneko.ratelimit.images', ratelimit.TokenBucket(1000, 1000))
+    monkeypatch.setattr('koneko.ratelimit.backoff_delay', lambda failures: 0)
+    ErrorHandler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), ErrorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    testengine = engine.AsyncEngine()
+
+    try:
+        url = f'http://127.0.0.1:{server.server_port}/{status}'
+        future = testengine.submit(testengine.download(url, str(tmp_path / 'img.jpg')))
+        with pytest.raises(aiohttp.ClientResponseError):
+            future.result(timeout=10)
+    finally:
+        testengine.shutdown()
+        server.shutdown()
+
+    assert len(ErrorHandler.requests) == tries
@@ -1,10 +1,11 @@
 import os
 from pathlib import Path
 from collections import namedtuple
+from unittest.mock import Mock
 
 import pytest
 
-from koneko import files, KONEKODIR
+from koneko import files, manifest, KONEKODIR
 
 
 def test_write_read_token_file(tmp_path):
@@ -17,8 +18,8 @@ def test_read_token_file_no_token(tmp_path):
     assert files.read_token_file(tmp_path) is None
 
 
-def test_find_mode2_dirs(tmp_path, monkeypatch):
-    monkeypatch.setattr('koneko.files.KONEKODIR', tmp_path)
+def test_find_mode2_dirs(tmp_path, use_tmp_catalog):
+    use_tmp_catalog.root = tmp_path
     (tmp_path / '1234' / 'individual').mkdir(parents=True)
     (tmp_path / '5678' / '1').mkdir(parents=True)
     assert files.find_mode2_dirs() == ['1234']
@@ -77,9 +78,91 @@ def test_dir_not_empty_all_images_present(tmp_path):
 
     assert files.dir_not_empty(data)
 
+def test_dir_not_empty_ignores_partial_downloads(tmp_path):
+    data = data_faker(tmp_path)
+    for f in data.all_names:
+        os.system(f'cp testing/files/{f} {tmp_path}')
+    (tmp_path / '.000_a.jpg.part').touch()
+    (tmp_path / '.koneko').touch()
+
+    assert files.dir_not_empty(data)
+
+def test_dir_not_empty_uses_manifest(tmp_path, monkeypatch):
+    data = data_faker(tmp_path)
+    for f in data.all_names:
+        os.system(f'cp testing/files/{f} {tmp_path}')
+    manifest.write(tmp_path, {name: 'url' for name in data.all_names})
+
+    monkeypatch.setattr('koneko.files.os.listdir', Mock(side_effect=AssertionError))
+    assert files.dir_not_empty(data)
+
+def test_dir_not_empty_outdated_manifest(tmp_path):
+    data = data_faker(tmp_path)
+    for f in data.all_names:
+        os.system(f'cp testing/files/{f} {tmp_path}')
+    # The last image failed to download
+    manifest.write(tmp_path, {name: 'url' for name in data.all_names[:-1]})
+
+    assert files.dir_not_empty(data) is False
+
+def test_page_names(tmp_path):
+    for name in ('001_b.jpg', '000_a.jpg', '.koneko', '.002_c.jpg.part'):
+        (tmp_path / name).touch()
+    assert files.page_names(tmp_path) == ['000_a.jpg', '001_b.jpg']
+
+    manifest.write(tmp_path, {'000_a.jpg': 'url'})
+    assert files.page_names(tmp_path) == ['000_a.jpg']
+
+
+def test_partial_path():
+    assert files.partial_path('/a/b/001_c.jpg') == '/a/b/.001_c.jpg.part'
+    assert files.partial_path('001_c.jpg') == '.001_c.jpg.part'
+    assert files.is_partial('.001_c.jpg.part')
+    assert not files.is_partial('001_c.jpg')
+    assert not files.is_partial('.koneko')
+    assert files.without_partial(['.koneko', '.a.part', 'a']) == ['.koneko', 'a']
+
+
+def test_partial_size(tmp_path):
+    assert files.partial_size(tmp_path / 'missing') == 0
+    (tmp_path / 'part').write_bytes(b'abc')
+    assert files.partial_size(tmp_path / 'part') == 3
+
+
+def test_atomic_write(tmp_path):
+    files.atomic_write(tmp_path / 'a.json', '{}')
+    files.atomic_write(tmp_path / 'b.png', b'\x89PNG')
+    assert (tmp_path / 'a.json').read_text() == '{}'
+    assert (tmp_path / 'b.png').read_bytes() == b'\x89PNG'
+
+    files.atomic_write(tmp_path / 'a.json', '[]')
+    assert (tmp_path / 'a.json').read_text() == '[]'
+    assert sorted(os.listdir(tmp_path)) == ['a.json', 'b.png']
+
+
+def test_atomic_write_failure_keeps_old_file(tmp_path, monkeypatch):
+    (tmp_path / 'a.json').write_text('{}')
+    monkeypatch.setattr('os.replace', Mock(side_effect=OSError))
+
+    with pytest.raises(OSError):
+        files.atomic_write(tmp_path / 'a.json', '[]')
+    assert (tmp_path / 'a.json').read_text() == '{}'
+    assert os.listdir(tmp_path) == ['a.json']
+
+
+def test_remove_stale_files(tmp_path):
+    for name in ('001_a.jpg', '.002_b.jpg.part', 'old.jpg', '.old.jpg.part', '.koneko'):
+        (tmp_path / name).touch()
+    (tmp_path / 'olddir').mkdir()
+
+    files.remove_stale_files(tmp_path, ['001_a.jpg', '002_b.jpg'])
+
+    assert sorted(os.listdir(tmp_path)) == ['.002_b.jpg.part', '001_a.jpg']
+    files.remove_stale_files(tmp_path / 'missing', ['001_a.jpg'])
+
 
-def test_filter_dir_1(monkeypatch, tmp_path):
-    monkeypatch.setattr('koneko.files.KONEKODIR', tmp_path)
+def test_filter_dir_1(tmp_path, use_tmp_catalog):
+    use_tmp_catalog.root = tmp_path
     (tmp_path / '1234').touch()
     (tmp_path / 'testgallery').touch()
     (tmp_path / 'notanumber').touch()
@@ -87,8 +170,8 @@ def test_filter_dir_1(monkeypatch, tmp_path):
     assert set(files.filter_dir(['1'])) == {'testgallery', '1234'}
 
 
-def test_filter_dir_2(monkeypatch, tmp_path):
-    monkeypatch.setattr('koneko.files.KONEKODIR', tmp_path)
+def test_filter_dir_2(tmp_path, use_tmp_catalog):
+    use_tmp_catalog.root = tmp_path
     (tmp_path / '1234').mkdir()
     (tmp_path / '1234' / 'individual').touch()
     (tmp_path / '5678').mkdir()
@@ -98,8 +181,8 @@ def test_filter_dir_2(monkeypatch, tmp_path):
     assert files.filter_dir(['2']) == ['1234']
 
 
-def test_filter_dir_3(monkeypatch, tmp_path):
-    monkeypatch.setattr('koneko.files.KONEKODIR', tmp_path)
+def test_filter_dir_3(tmp_path, use_tmp_catalog):
+    use_tmp_catalog.root = tmp_path
     (tmp_path / '1234').touch()
     (tmp_path / 'testuser').touch()
     (tmp_path / 'following').touch()
@@ -107,16 +190,16 @@ def test_filter_dir_3(monkeypatch, tmp_path):
     assert set(files.filter_dir(['3'])) == {'following', 'testuser'}
 
 
-def test_filter_dir_4(monkeypatch, tmp_path):
-    monkeypatch.setattr('koneko.files.KONEKODIR', tmp_path)
+def test_filter_dir_4(tmp_path, use_tmp_catalog):
+    use_tmp_catalog.root = tmp_path
     (tmp_path / '1234').touch()
     (tmp_path / 'search').touch()
     (tmp_path / 'notanumber').touch()
 
     assert files.filter_dir(['4']) == ['search']
 
-def test_filter_dir_5(monkeypatch, tmp_path):
-    monkeypatch.setattr('koneko.files.KONEKODIR', tmp_path)
+def test_filter_dir_5(tmp_path, use_tmp_catalog):
+    use_tmp_catalog.root = tmp_path
     (tmp_path / '1234').touch()
     (tmp_path / 'illustfollow').touch()
     (tmp_path / 'notanumber').touch()
@@ -0,0 +1,37 @@
+import sys
+import json
+import subprocess
+
+import pytest
+
+from testing.importtime import ENTRY_POINTS, total
+
+
+# Only imported once a mode (or a display) needs them
+HEAVY_MODULES = (
+    'blessed', 'pixcat', 'PIL.Image', 'requests', 'pixivpy3', 'asyncio',
+    'koneko.api', 'koneko.ui', 'koneko.main', 'multiprocessing.shared_memory',
+)
+
+# Milliseconds; it was more than 300 when everything was imported eagerly
+IMPORT_BUDGET = 200
+
+
+def imported_modules(module: str) -> 'list[str]':
+    code = f'import sys, json, {module}; print(json.dumps(list(sys.modules)))'
+    result = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize('module', ENTRY_POINTS)
+def test_startup_defers_heavy_modules(module):
+    imported = imported_modules(module)
+    assert [heavy for heavy in HEAVY_MODULES if heavy in imported] == []
+
+
+@pytest.mark.parametrize('module', ENTRY_POINTS)
+def test_import_time_budget(module):
+    # Best of three, so that a busy machine doesn't fail the test
+    assert min(total(module) for _ in range(3)) / 1000 < IMPORT_BUDGET
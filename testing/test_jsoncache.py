@@ -0,0 +1,106 @@
+import os
+import time
+
+import pytest
+
+from koneko import jsoncache
+
+
+@pytest.fixture(autouse=True)
+def use_tmp_jsondir(monkeypatch, tmp_path):
+    monkeypatch.setattr('koneko.jsoncache.JSONDIR', tmp_path / 'json')
+
+
+def test_key():
+    assert jsoncache.key('user_illusts', (123,), {'offset': 0}) == jsoncache.key(
+        'user_illusts', (123,), {'offset': 0}
+    )
+    assert jsoncache.key('user_illusts', (123,), {'offset': 0}) != jsoncache.key(
+        'user_illusts', (123,), {'offset': 30}
+    )
+    assert jsoncache.key('user_illusts', (123,), {}) != jsoncache.key(
+        'illust_detail', (123,), {}
+    )
+    # The ui passes some ids and offsets as ints, others as strs
+    assert jsoncache.key('user_illusts', (123,), {'offset': 30}) == jsoncache.key(
+        'user_illusts', ('123',), {'offset': '30'}
+    )
+
+
+def test_group():
+    assert jsoncache.group('user_illusts', (123,), {'offset': 0}) == jsoncache.group(
+        'user_illusts', ('123',), {'offset': '30'}
+    )
+    assert jsoncache.group('user_following', (1,), {'restrict': 'public'}) != jsoncache.group(
+        'user_following', (1,), {'restrict': 'private'}
+    )
+
+
+def test_read_missing():
+    assert jsoncache.read('user_illusts', (123,), {'offset': 0}) is None
+
+
+def test_write_then_read():
+    raw = {'illusts': [{'id': 1}], 'next_url': None}
+    assert jsoncache.write('user_illusts', (123,), {'offset': 0}, raw)
+
+    entry = jsoncache.read('user_illusts', (123,), {'offset': 0})
+    assert entry.fresh
+    assert entry.json == raw
+    # Restored as a JsonDict, so attribute access works like a fresh response
+    assert entry.json.illusts[0].id == 1
+
+
+def test_write_unchanged_only_revalidates():
+    raw = {'illusts': []}
+    jsoncache.write('illust_follow', (), {'offset': 0}, raw)
+    path = jsoncache._path('illust_follow', (), {'offset': 0})
+    old = time.time() - 60 * 60
+    os.utime(path, (old, old))
+    assert not jsoncache.read('illust_follow', (), {'offset': 0}).fresh
+
+    assert not jsoncache.write('illust_follow', (), {'offset': 0}, raw)
+    assert jsoncache.read('illust_follow', (), {'offset': 0}).fresh
+
+    assert jsoncache.write('illust_follow', (), {'offset': 0}, {'illusts': [1]})
+    assert jsoncache.read('illust_follow', (), {'offset': 0}).json == {'illusts': [1]}
+
+
+def test_unknown_method_is_never_fresh():
+    jsoncache.write('something_else', (), {}, {'a': 1})
+    assert not jsoncache.read('something_else', (), {}).fresh
+
+
+def test_read_expired(monkeypatch):
+    jsoncache.write('illust_follow', (), {'offset': 0}, {'illusts': []})
+    assert not jsoncache.read('illust_follow', (), {'offset': 0}).expired
+
+    monkeypatch.setattr('koneko.jsoncache.MAX_STALE', {'illust_follow': 0})
+    entry = jsoncache.read('illust_follow', (), {'offset': 0})
+    assert entry.expired
+    assert entry.json == {'illusts': []}
+
+
+def test_cacheable():
+    assert jsoncache.cacheable({'illusts': []})
+    assert not jsoncache.cacheable({'error': {'message': 'Rate Limit'}})
+    assert not jsoncache.cacheable(None)
+
+
+def test_clear():
+    jsoncache.write('user_illusts', (123,), {}, {'a': 1})
+    jsoncache.clear()
+    assert not jsoncache.JSONDIR.exists()
+    jsoncache.clear()
+
+
+def test_forget():
+    jsoncache.write('user_illusts', (123,), {'offset': 0}, {'a': 1})
+    jsoncache.write('user_illusts', (123,), {'offset': 30}, {'a': 2})
+    jsoncache.write('user_illusts', (456,), {'offset': 0}, {'a': 3})
+
+    jsoncache.forget('user_illusts', ('123',), {'offset': '30'})
+
+    assert jsoncache.read('user_illusts', (123,), {'offset': 0}) is None
+    assert jsoncache.read('user_illusts', (123,), {'offset': 30}) is None
+    assert jsoncache.read('user_illusts', (456,), {'offset': 0}).json == {'a': 3}
@@ -1,12 +1,15 @@
 import os
+import time
+import base64
 import random
+import threading
 from pathlib import Path
 from unittest.mock import Mock, call
 from collections import namedtuple
 
 import pytest
 
-from koneko import lscat, pure, WELCOME_IMAGE
+from koneko import lscat, pure, printer, WELCOME_IMAGE
 
 
 FakeData = namedtuple('data', ('download_path',))
@@ -48,6 +51,157 @@ def test_pixcat_show(monkeypatch, tmp_path, use_pixcat_api):
         call().thumbnail().show(align='left', x=2, y=3)
     ]
 
+def test_pixcat_show_cached_thumbnail(monkeypatch, tmp_path, use_pixcat_api):
+    thumbnail = tmp_path / '.thumbnails' / 'a.jpg.100.png'
+    monkeypatch.setattr('koneko.thumbnails.make', lambda *a: thumbnail)
+    mocked_pixcat = Mock()
+    monkeypatch.setattr('koneko.lscat.Image', mocked_pixcat)
+    lscat.api.show(tmp_path / 'a.jpg', 2, 3, 100)
+
+    assert mocked_pixcat.mock_calls[0] == call(thumbnail)
+
+@pytest.fixture
+def kitty_thumbnail(monkeypatch, tmp_path):
+    thumbnail = tmp_path / 'a.jpg.100.png'
+    thumbnail.touch()
+    monkeypatch.setattr('koneko.thumbnails.make', lambda *a: thumbnail)
+    return thumbnail
+
+
+def test_kitty_show_uploads_once(capsys, kitty_thumbnail):
+    kitty = lscat.Kitty()
+    first = kitty.show('a.jpg', 2, 3, 100)
+    kitty.hide(first)
+    second = kitty.show('a.jpg', 2, 3, 100)
+
+    assert first.image_id == second.image_id
+    assert first.placement_id != second.placement_id
+    out = capsys.readouterr().out
+    assert out.count('a=t,t=f,f=100') == 1
+    assert out.count(f'a=p,i={first.image_id},') == 2
+    assert f'a=d,d=i,i={first.image_id},p={first.placement_id},q=2' in out
+
+
+def test_kitty_show_uploads_changed_thumbnail(capsys, kitty_thumbnail):
+    kitty = lscat.Kitty()
+    first = kitty.show('a.jpg', 2, 3, 100)
+    os.utime(kitty_thumbnail, ns=(0, 0))
+    second = kitty.show('a.jpg', 2, 3, 100)
+
+    assert first.image_id != second.image_id
+    assert capsys.readouterr().out.count('a=t,t=f,f=100') == 2
+
+
+def test_kitty_evicts_least_recently_shown(capsys, monkeypatch, tmp_path):
+    kitty = lscat.Kitty()
+    kitty.MAX_UPLOADED = 2
+    paths = [tmp_path / f'{i}.png' for i in range(3)]
+    for path in paths:
+        path.touch()
+    monkeypatch.setattr('koneko.thumbnails.make', lambda path, size: path)
+
+    placements = [kitty.show(path, 0, 0, 100) for path in paths[:2]]
+    kitty.show(paths[0], 0, 0, 100)  # Most recently shown
+    kitty.show(paths[2], 0, 0, 100)
+
+    out = capsys.readouterr().out
+    assert f'a=d,d=I,i={placements[1].image_id},q=2' in out
+    assert f'a=d,d=I,i={placements[0].image_id},' not in out
+
+
+def test_kitty_falls_back_to_pixcat(monkeypatch, tmp_path):
+    monkeypatch.setattr('koneko.thumbnails.make', lambda *a: None)
+    mocked_pixcat = Mock()
+    monkeypatch.setattr('koneko.lscat.Image', mocked_pixcat)
+    kitty = lscat.Kitty()
+    image = kitty.show(tmp_path, 2, 3, 100)
+    kitty.hide(image)
+
+    assert mocked_pixcat.mock_calls == [
+        call(tmp_path),
+        call().thumbnail(100),
+        call().thumbnail().show(align='left', x=2, y=3),
+        call().thumbnail().show().hide(),
+    ]
+
+
+def test_kitty_transmits_by_shared_memory(capsys, kitty_thumbnail):
+    from multiprocessing import shared_memory
+    kitty_thumbnail.write_bytes(b'png data')
+    lscat.Kitty('shm').show('a.jpg', 2, 3, 100)
+
+    transmit = capsys.readouterr().out.split('\033\\')[0]
+    controls, payload = transmit.split(';')
+    assert 'a=t,t=s,f=100,S=8,' in controls
+    shm = shared_memory.SharedMemory(base64.b64decode(payload).decode())
+    try:
+        assert bytes(shm.buf[:8]) == b'png data'
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_kitty_unlinks_unread_shared_memory(capsys, kitty_thumbnail):
+    from multiprocessing import shared_memory
+    kitty_thumbnail.write_bytes(b'png data')
+    lscat.Kitty('shm').show('a.jpg', 2, 3, 100)
+    payload = capsys.readouterr().out.split('\033\\')[0].split(';')[1]
+
+    lscat._unlink_shm_segments()  # On exit
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(base64.b64decode(payload).decode())
+    assert lscat._shm_segments == []
+
+
+def test_kitty_uploads_again_after_clear(capsys, monkeypatch, kitty_thumbnail):
+    """Clearing the screen frees the hidden images in kitty, so their IDs are stale"""
+    monkeypatch.setattr('koneko.printer.TERM', Mock(does_styling=True, clear=''))
+    kitty = lscat.Kitty()
+    first = kitty.show('a.jpg', 2, 3, 100)
+    kitty.hide(first)
+    printer.clear_screen()
+    second = kitty.show('a.jpg', 2, 3, 100)
+    kitty.hide(second)
+    third = kitty.show('a.jpg', 2, 3, 100)
+
+    out = capsys.readouterr().out
+    assert out.count('a=t,t=f,f=100') == 2
+    assert f'i={second.image_id},q=2' in out.split('a=p')[1]
+    assert third.image_id == second.image_id
+
+
+def test_kitty_transmits_directly_in_chunks(capsys, kitty_thumbnail):
+    kitty_thumbnail.write_bytes(bytes(4000))
+    lscat.Kitty('direct').show('a.jpg', 2, 3, 100)
+
+    out = capsys.readouterr().out
+    chunks = [code for code in out.split('\033\\') if ';' in code][:2]
+    assert 'a=t,t=d,f=100,' in chunks[0] and ',m=1;' in chunks[0]
+    assert chunks[1].startswith('\033_Gm=0;')
+    payload = ''.join(chunk.split(';')[1] for chunk in chunks)
+    assert base64.b64decode(payload) == bytes(4000)
+
+
+@pytest.mark.parametrize('renderer, transmission, expected', (
+    ('kitty', 'shm', 'shm'),
+    ('kitty', 'auto', 'file'),
+    ('pixcat', 'auto', None),
+))
+def test_new_display(monkeypatch, renderer, transmission, expected):
+    monkeypatch.delenv('SSH_CONNECTION', raising=False)
+    monkeypatch.delenv('SSH_CLIENT', raising=False)
+    monkeypatch.delenv('SSH_TTY', raising=False)
+    monkeypatch.setattr('koneko.config.api.use_ueberzug', lambda: False)
+    monkeypatch.setattr('koneko.config.api.renderer', lambda: renderer)
+    monkeypatch.setattr('koneko.config.api.kitty_transmission', lambda: transmission)
+    display = lscat._new_display()
+
+    if expected is None:
+        assert type(display) is lscat.Pixcat
+    else:
+        assert display.medium == expected
+
+
 def test_pixcat_show_center(monkeypatch, tmp_path, use_pixcat_api):
     mocked_pixcat = Mock()
     monkeypatch.setattr('koneko.lscat.Image', mocked_pixcat)
@@ -226,6 +380,40 @@ def test_show_single_y(monkeypatch, use_pixcat_api):
     ]
 
 
+@pytest.mark.parametrize('display', (lscat.Pixcat, lscat.Kitty))
+def test_pixcat_draw_in_frame(monkeypatch, tmp_path, display):
+    """pixcat waits for kitty's answer, so its command must reach the terminal first.
+    Kitty falls back to pixcat for images outside KONEKODIR
+    """
+    writes = []
+    monkeypatch.setattr('sys.stdout', Mock(write=writes.append))
+
+    class AnsweringImage:
+        def __init__(self, path):
+            pass
+
+        def thumbnail(self, size):
+            return self
+
+        def show(self, **kwargs):
+            print('transmit', end='', flush=True)
+            assert ''.join(writes).endswith('transmit'), 'kitty never got the command'
+            return self
+
+        def hide(self):
+            print('delete', end='', flush=True)
+            assert ''.join(writes).endswith('delete'), 'kitty never got the command'
+
+    monkeypatch.setattr('koneko.lscat.Image', AnsweringImage)
+    with printer.frame():
+        print('clear', end='')
+        image = display().show(tmp_path / 'a.jpg', 0, 0, 100)
+        display().hide(image)
+        print('next', end='')
+
+    assert ''.join(writes) == 'cleartransmitdeletenext'
+
+
 def test_show_instant(monkeypatch):
     showed = []
 
@@ -233,6 +421,9 @@ def test_show_instant(monkeypatch):
         def __init__(self, data):
             pass
 
+        def skip_missing(self, names):
+            pass
+
         def update(self, new):
             showed.append(new)
 
@@ -249,6 +440,43 @@ def test_show_instant(monkeypatch):
     }
 
 
+def test_handle_scroll_one_frame(monkeypatch, tmp_path):
+    """The screen is cleared in the same write as the images, so it never flashes"""
+    writes = []
+    monkeypatch.setattr('sys.stdout', Mock(write=writes.append))
+    for name in ('000_a.jpg', '001_b.jpg', '002_c.jpg'):
+        (tmp_path / name).touch()
+
+    class FakeTracker:
+        def __init__(self, data):
+            print('clear', end='')
+            self.orders = [0, 1, 2]
+            self.images = []
+
+        def skip_missing(self, names):
+            pass
+
+        def update(self, new):
+            if int(new[:3]) in self.orders:
+                print(new, end='')
+                self.images.append(new)
+
+    assert lscat.handle_scroll(FakeTracker, FakeData(tmp_path), slice(1, 3)) == [
+        '001_b.jpg', '002_c.jpg'
+    ]
+    assert writes == ['clear001_b.jpg002_c.jpg']
+
+
+@pytest.mark.parametrize('tracker', (lscat.TrackDownloads, lscat.TrackDownloadsUsers))
+def test_show_instant_spawns_no_process(monkeypatch, tmp_path, no_subprocess, tracker):
+    for name in ('000_a.jpg', '001_b.jpg'):
+        (tmp_path / name).touch()
+    monkeypatch.setattr('koneko.lscat.api', Mock())
+    monkeypatch.setattr('koneko.config.api.use_ueberzug', lambda: False)
+    lscat.show_instant(tracker, Mock(download_path=tmp_path, splitpoint=1))
+    assert lscat.api.show.call_count == 2
+
+
 def test_TrackDownloads():
     mocked_data = Mock()
     mocked_generator = Mock()
@@ -315,6 +543,80 @@ def test_TrackDownloadsUser():
     ]
 
 
+def test_tracker_large_page_in_reverse():
+    """No recursion, so the page size is not limited by the recursion limit"""
+    mocked_generator = Mock()
+    tracker = lscat.TrackDownloads(Mock())
+    tracker.generator = mocked_generator
+    tracker.orders = list(range(999))
+
+    for idx in reversed(range(999)):
+        tracker.update(f"{str(idx).rjust(3, '0')}_test")
+
+    assert mocked_generator.mock_calls[::2] == [
+        call.send(f"{str(idx).rjust(3, '0')}_test") for idx in range(999)
+    ]
+
+
+def test_tracker_sliced_orders():
+    """Like lscat.handle_scroll(), only the images of one terminal page are displayed"""
+    mocked_generator = Mock()
+    tracker = lscat.TrackDownloads(Mock())
+    tracker.generator = mocked_generator
+    tracker.orders = tracker.orders[10:20]
+
+    for idx in random.sample(range(30), 30):
+        tracker.update(f"{str(idx).rjust(3, '0')}_test")
+
+    assert mocked_generator.mock_calls[::2] == [
+        call.send(f"{str(idx).rjust(3, '0')}_test") for idx in range(10, 20)
+    ]
+
+
+def test_tracker_skip_missing(monkeypatch):
+    """A page that was partly downloaded, shown offline"""
+    monkeypatch.setattr('koneko.config.api.use_ueberzug', lambda: False)
+    mocked_generator = Mock()
+    tracker = lscat.TrackDownloads(Mock())
+    tracker.generator = mocked_generator
+    names = ['000_test', '001_test', '005_test']
+    tracker.skip_missing(names)
+
+    for name in names:
+        tracker.update(name)
+
+    assert mocked_generator.mock_calls[::2] == [call.send(name) for name in names]
+
+
+def test_tracker_concurrent_updates():
+    showed = []
+
+    def slow_generator():
+        while True:
+            pic = yield
+            time.sleep(0.001)  # Displaying takes a while
+            showed.append(pic)
+            yield pic
+
+    tracker = lscat.TrackDownloadsUsers(Mock(splitpoint=30))
+    tracker.generator = slow_generator()
+    tracker.generator.send(None)
+
+    pics = [f"{str(idx).rjust(3, '0')}_test" for idx in random.sample(range(120), 120)]
+    threads = [
+        threading.Thread(target=lambda chunk: [tracker.update(pic) for pic in chunk],
+                         args=(pics[i::8],))
+        for i in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert showed == [f"{str(idx).rjust(3, '0')}_test" for idx in tracker.orders]
+    assert tracker.images == showed
+
+
 def test_TrackDownloadsUser_with_koneko_file(tmp_path, use_test_cfg_path):
     """Test with .koneko file"""
     data = FakeData(Path('testing/files/user'))
@@ -44,6 +44,14 @@ def image_setup(monkeypatch, tmp_path):
 
 
 
+def test_image_loop_ignores_hidden_files(tmp_path):
+    for image in range(2):
+        (tmp_path / str(image)).touch()
+    (tmp_path / '.manifest.json').touch()
+    (tmp_path / '.2.part').touch()
+    assert lscat_prompt.ImageLoop(tmp_path).all_images == ['0', '1']
+
+
 def test_scroll_prompt(monkeypatch, patch_cbreak):
     class FakeInKeyNew(FakeInKey):
         def __call__(self):
@@ -81,14 +89,13 @@ def test_gallery_user_loop_init_for_user(monkeypatch, patch_cbreak):
 
 
 @pytest.mark.parametrize('letter', ('n', 'p'))
-def test_gallery_user_loop_keys(monkeypatch, patch_cbreak, letter):
+def test_gallery_user_loop_keys(monkeypatch, patch_cbreak, no_subprocess, letter):
     class FakeInKeyNew(FakeInKey):
         def __call__(self):
             return Keystroke(ucs=letter, code=1, name=letter)
 
     fake_inkey = FakeInKeyNew()
     monkeypatch.setattr('koneko.lscat_prompt.TERM.inkey', fake_inkey)
-    monkeypatch.setattr('koneko.lscat_prompt.os.system', lambda x: True)
 
     _, p = gallery_setup(monkeypatch)
     p.show_func = Mock()
@@ -100,14 +107,13 @@ def test_gallery_user_loop_keys(monkeypatch, patch_cbreak, letter):
         p.start()
 
 
-def test_gallery_user_loop_key_down(monkeypatch, patch_cbreak):
+def test_gallery_user_loop_key_down(monkeypatch, patch_cbreak, no_subprocess):
     class FakeInKeyNew(FakeInKey):
         def __call__(self):
             return Keystroke(ucs='', code=1, name='KEY_DOWN')
 
     fake_inkey = FakeInKeyNew()
     monkeypatch.setattr('koneko.lscat_prompt.TERM.inkey', fake_inkey)
-    monkeypatch.setattr('koneko.lscat_prompt.os.system', lambda x: True)
 
     _, p = gallery_setup(monkeypatch)
     p.show_func = Mock()
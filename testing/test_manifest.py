@@ -0,0 +1,43 @@
+import json
+
+from koneko import manifest
+
+
+def test_write_and_read(tmp_path):
+    (tmp_path / '000_a.jpg').write_bytes(b'abc')
+    (tmp_path / '001_b.png').write_bytes(b'defg')
+
+    records = manifest.write(tmp_path, {
+        '001_b.png': 'https://i.pximg.net/b.png',
+        '000_a.jpg': 'https://i.pximg.net/a.jpg',
+    })
+
+    assert manifest.read(tmp_path) == records
+    assert manifest.names(tmp_path) == ['000_a.jpg', '001_b.png']
+    assert records['000_a.jpg']['size'] == 3
+    assert records['000_a.jpg']['sha1'] == 'a9993e364706816aba3e25717850c26c9cd0d89d'
+    assert records['001_b.png']['url'] == 'https://i.pximg.net/b.png'
+    assert records['001_b.png']['fetched'] == (tmp_path / '001_b.png').stat().st_mtime
+    # Only the manifest itself is left behind, and it is hidden
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        '.manifest.json', '000_a.jpg', '001_b.png'
+    ]
+
+
+def test_write_skips_failed_downloads(tmp_path):
+    (tmp_path / '000_a.jpg').write_bytes(b'abc')
+    manifest.write(tmp_path, {'000_a.jpg': 'a', '001_b.png': 'b'})
+    assert manifest.names(tmp_path) == ['000_a.jpg']
+
+
+def test_read_missing(tmp_path):
+    assert manifest.read(tmp_path) is None
+    assert manifest.names(tmp_path / 'nonexistent') is None
+
+
+def test_read_invalid(tmp_path):
+    manifest.path(tmp_path).write_text('{')
+    assert manifest.read(tmp_path) is None
+
+    manifest.path(tmp_path).write_text(json.dumps({'version': 0, 'files': {}}))
+    assert manifest.read(tmp_path) is None
@@ -0,0 +1,150 @@
+from unittest.mock import Mock, call
+
+import pytest
+import requests
+
+from koneko import api, mirror, jsoncache
+
+
+@pytest.fixture(autouse=True)
+def use_tmp_dirs(monkeypatch, tmp_path):
+    monkeypatch.setattr('koneko.mirror.KONEKODIR', tmp_path / 'cache')
+    monkeypatch.setattr('koneko.mirror.STATEDIR', tmp_path / 'mirror')
+    monkeypatch.setattr('koneko.mirror.ORIGINALS_DIR', tmp_path / 'originals')
+
+
+def gallery_json(offset, number_of_pages):
+    offset = int(offset)
+    next_offset = offset + 2
+    return {
+        'illusts': [
+            {
+                'title': f'post{i}',
+                'page_count': 1,
+                'image_urls': {
+                    'square_medium': f'https://i.pximg.net/c/360x360_70/img-master/{i}_p0_square1200.jpg',
+                    'large': f'https://i.pximg.net/c/600x1200_90_webp/img-master/{i}_p0_master1200.jpg',
+                },
+            }
+            for i in range(offset, next_offset)
+        ],
+        'next_url': f'https://app-api.pixiv.net/v1/user/illusts?user_id=1&offset={next_offset}'
+        if next_offset < number_of_pages * 2 else None,
+    }
+
+
+def touch_images(data, tracker):
+    data.download_path.mkdir(parents=True, exist_ok=True)
+    for name in data.newnames_with_ext:
+        (data.download_path / name).touch()
+
+
+@pytest.fixture
+def fake_pixiv(monkeypatch):
+    """A gallery of three pages with two posts each. Downloads just create the files"""
+    requested = []
+
+    def artist_gallery(artist_user_id, offset):
+        requested.append(offset)
+        return gallery_json(offset, 3)
+
+    monkeypatch.setattr('koneko.api.myapi.artist_gallery', artist_gallery)
+    monkeypatch.setattr('koneko.download.init_download', touch_images)
+    return requested
+
+
+def test_state(tmp_path):
+    assert mirror.read_state('1') == (1, 0)
+    mirror.write_state('1', 3, '60')
+    assert mirror.read_state('1') == (3, '60')
+    mirror.clear_state('1')
+    assert mirror.read_state('1') == (1, 0)
+
+
+def test_mirror(fake_pixiv, tmp_path, capsys):
+    summary = mirror.mirror(1)
+
+    assert fake_pixiv == [0, '2', '4']
+    assert sorted(p.name for p in (tmp_path / 'cache' / '1').iterdir()) == ['1', '2', '3']
+    assert sorted(p.name for p in (tmp_path / 'cache' / '1' / '3').iterdir()) == [
+        '000_post4.jpg', '001_post5.jpg'
+    ]
+    assert (summary.pages, summary.posts, summary.downloaded) == (3, 6, 6)
+    assert summary.failed == []
+    # Finished, so the next run starts from the first page again
+    assert mirror.read_state('1') == (1, 0)
+    assert capsys.readouterr().out.splitlines()[-1].startswith('Mirrored 3 pages, 6 posts (6 new')
+
+
+def test_mirror_resumes(fake_pixiv, tmp_path):
+    mirror.write_state('1', 2, '2')
+    summary = mirror.mirror(1)
+
+    assert fake_pixiv == ['2', '4']
+    assert summary.pages == 2
+    assert not (tmp_path / 'cache' / '1' / '1').exists()
+
+
+def test_mirror_interrupted_keeps_state(fake_pixiv, monkeypatch):
+    def artist_gallery(artist_user_id, offset):
+        if offset == '4':
+            raise requests.ConnectionError
+        return gallery_json(offset, 3)
+    monkeypatch.setattr('koneko.api.myapi.artist_gallery', artist_gallery)
+
+    with pytest.raises(requests.ConnectionError):
+        mirror.mirror(1)
+    assert mirror.read_state('1') == (3, '4')
+
+
+def test_mirror_then_browse_offline(monkeypatch, tmp_path):
+    """Mirror fills the json cache under the same keys as the ui requests, and
+    fetches every page again instead of using an outdated cached response
+    """
+    monkeypatch.setattr('koneko.jsoncache.JSONDIR', tmp_path / 'json')
+    monkeypatch.setattr('koneko.config.api.use_asyncio', lambda: False)
+    monkeypatch.setattr('koneko.ratelimit.app_api.acquire', lambda: True)
+    monkeypatch.setattr('koneko.download.init_download', touch_images)
+    user_illusts = Mock(side_effect=lambda user_id, offset: gallery_json(offset, 3))
+    monkeypatch.setattr('koneko.api.myapi._api', Mock(user_illusts=user_illusts))
+    jsoncache.write('user_illusts', ('1',), {'offset': 0}, gallery_json(0, 1))
+
+    mirror.mirror(1)
+    assert user_illusts.call_args_list == [
+        call('1', offset=0), call('1', offset='2'), call('1', offset='4')
+    ]
+
+    monkeypatch.setattr('koneko.api.myapi.offline', True)
+    for offset in (0, '2', '4'):
+        assert api.myapi.artist_gallery('1', offset) == gallery_json(offset, 3)
+        assert api.myapi.artist_gallery(1, str(offset)) == gallery_json(offset, 3)
+
+
+def test_mirror_full(fake_pixiv, monkeypatch, tmp_path):
+    downloaded = []
+    monkeypatch.setattr(
+        'koneko.api.myapi.protected_download',
+        lambda url, path, name: downloaded.append(url) or True
+    )
+
+    summary = mirror.mirror(1, full=True)
+
+    assert sorted(downloaded) == [
+        f'https://i.pximg.net/img-original/{i}_p0.jpg' for i in range(6)
+    ]
+    assert summary.originals == 6
+
+
+def test_download_original_png(monkeypatch, tmp_path):
+    protected_download = Mock(side_effect=[requests.HTTPError(404), True])
+    monkeypatch.setattr('koneko.api.myapi.protected_download', protected_download)
+    url = 'https://i.pximg.net/c/600x1200_90_webp/img-master/1_p0_master1200.jpg'
+
+    assert mirror.download_original(url, tmp_path)
+    assert protected_download.call_args_list == [
+        call('https://i.pximg.net/img-original/1_p0.jpg', tmp_path, None),
+        call('https://i.pximg.net/img-original/1_p0.png', tmp_path, None),
+    ]
+
+    (tmp_path / '1_p0.png').touch()
+    assert mirror.download_original(url, tmp_path) is False
@@ -1,4 +1,7 @@
+import sys
 import json
+import threading
+from types import SimpleNamespace
 
 import pytest
 
@@ -28,6 +31,75 @@ def test_write(capsys):
     assert captured.out == 'hi'
 
 
+def test_clear_screen(monkeypatch, capsys):
+    monkeypatch.setattr(
+        'koneko.printer.TERM', SimpleNamespace(does_styling=True, clear='\033[H\033[2J')
+    )
+    printer.clear_screen()
+    assert capsys.readouterr().out == '\033[H\033[2J\033[3J'
+
+
+def test_clear_screen_not_a_terminal(monkeypatch, capsys):
+    monkeypatch.setattr('koneko.printer.TERM', SimpleNamespace(does_styling=False))
+    printer.clear_screen()
+    assert capsys.readouterr().out == ''
+
+
+class RecordingStdout:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_frame_writes_once(monkeypatch):
+    stdout = RecordingStdout()
+    monkeypatch.setattr('sys.stdout', stdout)
+    with printer.frame():
+        printer.write('a')
+        print('b')
+        with printer.frame():
+            print('c', end='', flush=True)
+        assert stdout.writes == []
+
+    assert stdout.writes == ['ab\nc']
+    assert sys.stdout is stdout
+
+
+def test_frame_unbuffered(monkeypatch):
+    stdout = RecordingStdout()
+    monkeypatch.setattr('sys.stdout', stdout)
+    with printer.frame():
+        print('a', end='')
+        with printer.unbuffered():
+            print('waits for an answer', end='', flush=True)
+            assert ''.join(stdout.writes) == 'awaits for an answer'
+        print('b', end='')
+        assert ''.join(stdout.writes) == 'awaits for an answer'
+
+    assert ''.join(stdout.writes) == 'awaits for an answerb'
+    with printer.unbuffered():
+        print('no frame', end='')
+    assert ''.join(stdout.writes).endswith('bno frame')
+
+
+def test_frame_only_collects_its_thread(monkeypatch):
+    stdout = RecordingStdout()
+    monkeypatch.setattr('sys.stdout', stdout)
+    with printer.frame():
+        print('in frame', end='')
+        thread = threading.Thread(target=lambda: print('other thread', end=''))
+        thread.start()
+        thread.join()
+        assert ''.join(stdout.writes) == 'other thread'
+
+    assert stdout.writes[-1] == 'in frame'
+
+
 def test_cursor_move_up(capsys):
     printer.move_cursor_up(1)
     captured = capsys.readouterr()
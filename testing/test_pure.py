@@ -107,5 +107,64 @@ def test_generate_orders():
     assert pure.generate_orders(120, 30) == [0, 30, 31, 32, 1, 33, 34, 35, 2, 36, 37, 38, 3, 39, 40, 41, 4, 42, 43, 44, 5, 45, 46, 47, 6, 48, 49, 50, 7, 51, 52, 53, 8, 54, 55, 56, 9, 57, 58, 59, 10, 60, 61, 62, 11, 63, 64, 65, 12, 66, 67, 68, 13, 69, 70, 71, 14, 72, 73, 74, 15, 75, 76, 77, 16, 78, 79, 80, 17, 81, 82, 83, 18, 84, 85, 86, 19, 87, 88, 89, 20, 90, 91, 92, 21, 93, 94, 95, 22, 96, 97, 98, 23, 99, 100, 101, 24, 102, 103, 104, 25, 105, 106, 107, 26, 108, 109, 110, 27, 111, 112, 113, 28, 114, 115, 116, 29, 117, 118, 119]
 
 
+def test_display_ranks():
+    assert pure.display_ranks([0, 2, 1], 4) == [0, 2, 1, 6]
+    assert pure.display_ranks(pure.generate_orders(8, 2), 8) == [0, 4, 1, 2, 3, 5, 6, 7]
+
+
+def test_range_headers():
+    assert pure.range_headers(0) == {}
+    assert pure.range_headers(100) == {'Range': 'bytes=100-'}
+
+
+def test_expected_size():
+    assert pure.expected_size(0, {'Content-Length': '10'}) == 10
+    assert pure.expected_size(5, {'Content-Length': '10'}) == 15
+    assert pure.expected_size(5, {}) is None
+    assert pure.expected_size(0, {'Content-Length': 'x'}) is None
+
+
 def test_line_width():
     assert pure.line_width(range(3), 5) == 8
+
+
+def test_human_size():
+    assert pure.human_size(0) == '0B'
+    assert pure.human_size(1023) == '1023B'
+    assert pure.human_size(1536) == '1.5K'
+    assert pure.human_size(5 * 1024 ** 3) == '5.0G'
+    assert pure.human_size(3 * 1024 ** 4) == '3.0T'
+
+
+def test_kitty_code():
+    assert pure.kitty_code(a='p', i=3, q=2) == '\033_Ga=p,i=3,q=2;\033\\'
+    assert pure.kitty_code('cGF0aA==', a='t', t='f') == '\033_Ga=t,t=f;cGF0aA==\033\\'
+
+
+def test_kitty_chunked_codes():
+    assert pure.kitty_chunked_codes('abcdefghij', chunk_size=4, a='t', i=1) == [
+        '\033_Ga=t,i=1,m=1;abcd\033\\',
+        '\033_Gm=1;efgh\033\\',
+        '\033_Gm=0;ij\033\\',
+    ]
+    assert pure.kitty_chunked_codes('ab', a='t') == ['\033_Ga=t,m=0;ab\033\\']
+
+
+def test_kitty_medium():
+    assert pure.kitty_medium('auto', {}) == 'file'
+    assert pure.kitty_medium('auto', {'SSH_CONNECTION': '1.2.3.4 5 6.7.8.9 22'}) == 'direct'
+    assert pure.kitty_medium('auto', {'SSH_TTY': '/dev/pts/1'}) == 'direct'
+    assert pure.kitty_medium('shm', {'SSH_TTY': '/dev/pts/1'}) == 'shm'
+    assert pure.kitty_medium('direct', {}) == 'direct'
+
+
+def test_token_lifetime():
+    assert pure.token_lifetime({'response': {'expires_in': 3600}}) == 3600
+    assert pure.token_lifetime({'response': {'expires_in': 0}}) == 3600
+    assert pure.token_lifetime({'response': {}}, default=10) == 10
+    assert pure.token_lifetime(None) == 3600
+
+
+def test_describe_request():
+    assert pure.describe_request('user_illusts', (123,), {'offset': 30}) == 'user_illusts(123, offset=30)'
+    assert pure.describe_request('search_user', ('gomzi',), {}) == "search_user('gomzi')"
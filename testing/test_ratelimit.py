@@ -0,0 +1,70 @@
+from unittest.mock import Mock
+
+import pytest
+
+from koneko import ratelimit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Mock(now=100.0)
+    monkeypatch.setattr('koneko.ratelimit.time.monotonic', lambda: clock.now)
+    return clock
+
+
+def test_bucket_allows_burst_then_throttles(clock):
+    bucket = ratelimit.TokenBucket(rate=2, capacity=3)
+
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    # Every waiting request holds its place in line
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+
+    clock.now += 1.0
+    assert bucket.reserve() == 0.5
+    assert bucket.as_dict() == {
+        'acquired': 6, 'throttled': 3, 'waited': 2.0, 'backoffs': 0
+    }
+
+
+def test_bucket_refill_is_capped(clock):
+    bucket = ratelimit.TokenBucket(rate=2, capacity=3)
+    clock.now += 1000
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == 0.5
+
+
+def test_bucket_backoff(clock, monkeypatch):
+    monkeypatch.setattr('koneko.ratelimit.random.uniform', lambda a, b: b)
+    bucket = ratelimit.TokenBucket(rate=100, capacity=100)
+
+    assert bucket.backoff() == 1
+    assert bucket.backoff() == 2
+    assert bucket.backoff() == 4
+    assert bucket.reserve() == 4
+    bucket.success()
+    assert bucket.backoff() == 1
+    assert bucket.backoffs == 4
+
+
+def test_bucket_observe(clock):
+    bucket = ratelimit.TokenBucket(rate=100, capacity=100)
+    assert not bucket.observe(200, {})
+    assert not bucket.observe(404, {})
+    assert bucket.observe(503, {'Retry-After': '10'})
+    assert bucket.reserve() == 10
+    assert bucket.observe(429, {})
+    assert bucket.backoffs == 2
+
+
+@pytest.mark.parametrize('failures,low,high', ((1, 0.5, 1), (3, 2, 4), (100, 30, 60)))
+def test_backoff_delay_jitter(failures, low, high):
+    for _ in range(20):
+        assert low <= ratelimit.backoff_delay(failures) <= high
+
+
+def test_parse_retry_after():
+    assert ratelimit.parse_retry_after('5') == 5
+    assert ratelimit.parse_retry_after('1000') == ratelimit.BACKOFF_MAX
+    assert ratelimit.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') is None
+    assert ratelimit.parse_retry_after(None) is None
@@ -0,0 +1,68 @@
+import os
+import shutil
+
+from PIL import Image
+
+from koneko import thumbnails
+
+
+def copy_image(tmp_path, monkeypatch) -> 'Path':
+    monkeypatch.setattr('koneko.thumbnails.KONEKODIR', tmp_path)
+    (tmp_path / '123' / '1').mkdir(parents=True)
+    image_path = tmp_path / '123' / '1' / '004_祝！！！.jpg'
+    shutil.copy('testing/files/004_祝！！！.jpg', image_path)
+    return image_path
+
+
+def test_thumbnail_path():
+    assert (
+        thumbnails.thumbnail_path('/cache/123/1/000_a.jpg', 310)
+        == thumbnails.Path('/cache/123/1/.thumbnails/000_a.jpg.310.png')
+    )
+
+
+def test_make_and_get(tmp_path, monkeypatch):
+    image_path = copy_image(tmp_path, monkeypatch)
+    assert thumbnails.get(image_path, 100) is None
+
+    thumbnail = thumbnails.make(image_path, 100)
+    assert thumbnail == thumbnails.thumbnail_path(image_path, 100)
+    assert thumbnails.get(image_path, 100) == thumbnail
+    with Image.open(thumbnail) as image:
+        assert max(image.size) == 100
+    # Other sizes are cached separately
+    assert thumbnails.get(image_path, 200) is None
+
+
+def test_stale_thumbnail(tmp_path, monkeypatch):
+    image_path = copy_image(tmp_path, monkeypatch)
+    thumbnail = thumbnails.make(image_path, 100)
+
+    # The image was downloaded again after the thumbnail was made
+    older = image_path.stat().st_mtime - 10
+    os.utime(thumbnail, (older, older))
+    assert thumbnails.get(image_path, 100) is None
+    assert thumbnails.make(image_path, 100) == thumbnail
+    assert thumbnails.get(image_path, 100) == thumbnail
+
+
+def test_remove(tmp_path, monkeypatch):
+    image_path = copy_image(tmp_path, monkeypatch)
+    small = thumbnails.make(image_path, 100)
+    large = thumbnails.make(image_path, 200)
+    other = thumbnails.thumbnail_path(image_path.with_name('005_a.jpg'), 100)
+    other.write_bytes(b'png')
+
+    thumbnails.remove(image_path)
+    assert not small.exists()
+    assert not large.exists()
+    assert other.exists()
+    # Removing again is harmless
+    thumbnails.remove(image_path)
+
+
+def test_not_cached_outside_konekodir(tmp_path):
+    image_path = tmp_path / '004_祝！！！.jpg'
+    shutil.copy('testing/files/004_祝！！！.jpg', image_path)
+    assert thumbnails.make(image_path, 100) is None
+    assert os.listdir(tmp_path) == ['004_祝！！！.jpg']
@@ -2,12 +2,14 @@
 Code that does work has already been tested
 """
 
+import threading
 from pathlib import Path
 from unittest.mock import Mock
 
 import pytest
 
-from koneko import ui
+from koneko import ui, api, utils, download, manifest
+from koneko import data as data_module
 
 
 class FakeData:
@@ -150,3 +152,240 @@ def test_prefetch_next_image(monkeypatch):
     monkeypatch.setattr('koneko.download.async_download_spinner', lambda *a: True)
     data.next_img_url = 'fake'
     ui.Image._prefetch_next_image(data)
+
+
+class FakePrefetchUI(ui.AbstractUI):
+    """Only has the state needed to prefetch; pages are requested by offset"""
+    def __init__(self, number_of_pages):
+        self.number_of_pages = number_of_pages
+        self._prefetch_lock = threading.Condition()
+        self._prefetching = True
+        self._prefetched_pages = {1}
+        self._token = utils.CancelToken()
+        self._data = data_module.GalleryData(Path('fake'))
+        self._data.update(self._page_json(0))
+        self.requested = []
+
+    def _page_json(self, offset):
+        next_offset = offset + 30
+        return {
+            'illusts': [],
+            'next_url': f'https://app-api.pixiv.net/v1/user/illusts?offset={next_offset}'
+            if next_offset < self.number_of_pages * 30 else None
+        }
+
+    def _pixivrequest(self):
+        self.requested.append(int(self._data.offset))
+        return self._page_json(int(self._data.offset))
+
+    def _print_page_info(self):
+        pass
+
+
+@pytest.fixture
+def prefetch_ui(monkeypatch):
+    downloads = []
+    monkeypatch.setattr('koneko.config.api.prefetch_depth', lambda: 2)
+    monkeypatch.setattr('koneko.files.free_space', lambda path: ui.PREFETCH_MIN_FREE)
+    monkeypatch.setattr(
+        'koneko.download.init_download',
+        lambda data, tracker, priority, token: downloads.append((data.page_num, priority))
+    )
+
+    def make(number_of_pages):
+        fake = FakePrefetchUI(number_of_pages)
+        fake.downloads = downloads
+        return fake
+    return make
+
+
+def test_prefetch_next_pages(prefetch_ui):
+    fake = prefetch_ui(10)
+    fake._prefetch_next_pages(fake._token)
+
+    assert fake.requested == [30, 60]
+    assert fake.downloads == [(2, download.Priority.PREFETCH), (3, download.Priority.PREFETCH)]
+    assert fake._prefetched_pages == {1, 2, 3}
+    assert not fake._prefetching
+
+
+def test_prefetch_next_pages_window_follows_current_page(prefetch_ui):
+    fake = prefetch_ui(10)
+    fake._prefetch_next_pages(fake._token)
+    # The user is waiting for page 4 after skipping through 3 quickly
+    fake._data.page_num = 4
+    fake._prefetching = True
+    fake._prefetch_next_pages(fake._token)
+
+    assert fake.requested == [30, 60, 90, 120, 150]
+    assert fake.downloads[2:] == [
+        (4, download.Priority.VISIBLE),
+        (5, download.Priority.PREFETCH),
+        (6, download.Priority.PREFETCH),
+    ]
+
+    # Going back: everything in the window of page 3 is already there
+    fake._data.page_num = 3
+    fake._prefetching = True
+    fake._prefetch_next_pages(fake._token)
+    assert len(fake.requested) == 5
+
+
+def test_prefetch_next_pages_stops_at_last_page(prefetch_ui):
+    fake = prefetch_ui(2)
+    fake._prefetch_next_pages(fake._token)
+
+    assert fake.requested == [30]
+    assert fake._prefetched_pages == {1, 2}
+    assert not fake._prefetching
+    # next_page() doesn't wait forever for a page that doesn't exist
+    fake._wait_for_page(3)
+
+
+def test_next_page_promotes_prefetch(prefetch_ui, monkeypatch):
+    fake = prefetch_ui(10)
+    mocked_promote = Mock()
+    monkeypatch.setattr('koneko.download.pool.promote', mocked_promote)
+    fake._prefetch = Mock()
+    fake._wait_for_page = Mock()
+    fake._show_page = Mock()
+
+    fake.next_page()
+    # Its downloads might still be queued as a prefetch
+    mocked_promote.assert_called_once_with(Path('fake') / '2', download.Priority.VISIBLE)
+    fake._wait_for_page.assert_called_once_with(2)
+
+def test_prefetch_next_pages_disk_budget(prefetch_ui, monkeypatch):
+    monkeypatch.setattr('koneko.files.free_space', lambda path: ui.PREFETCH_MIN_FREE - 1)
+    fake = prefetch_ui(10)
+    fake._prefetch_next_pages(fake._token)
+
+    assert fake.requested == []
+    assert not fake._prefetching
+
+
+def test_prefetch_does_not_start_twice(monkeypatch):
+    fake = FakePrefetchUI.__new__(FakePrefetchUI)
+    fake._prefetch_lock = threading.Condition()
+    fake._prefetching = True
+    monkeypatch.setattr('threading.Thread', Mock(side_effect=AssertionError))
+    fake._prefetch()
+
+
+def test_prefetch_cancelled(prefetch_ui, monkeypatch):
+    fake = prefetch_ui(10)
+    old_token = fake._token
+
+    def leave_during_download(data, tracker, priority, token):
+        fake._cancel_background_work()
+        token.check()
+    monkeypatch.setattr('koneko.download.init_download', leave_during_download)
+    fake._prefetch_next_pages(old_token)
+
+    assert fake.requested == [30]
+    assert fake._prefetched_pages == {1}
+    assert old_token.is_set()
+    assert fake._token is not old_token
+    # The cancelled thread doesn't count as running anymore
+    assert not fake._prefetching
+
+
+def test_prefetch_next_pages_offline(prefetch_ui, monkeypatch):
+    monkeypatch.setattr('koneko.api.myapi.offline', True)
+    fake = prefetch_ui(10)
+    request = fake._pixivrequest
+
+    def only_page_two_cached():
+        if int(fake._data.offset) > 30:
+            raise api.Offline('not cached')
+        return request()
+    fake._pixivrequest = only_page_two_cached
+    fake._prefetch_next_pages(fake._token)
+
+    assert fake.requested == [30]
+    assert fake.downloads == []
+    assert fake._prefetched_pages == {1, 2}
+    assert not fake._prefetching
+
+
+def test_show_page_offline(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr('koneko.api.myapi.offline', True)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'fake' / '1').mkdir(parents=True)
+    fake = FakePrefetchUI(10)
+    fake.use_ueberzug = False
+    shown = []
+    fake.scroll_or_show = lambda: shown.append(fake._data.page_num)
+
+    fake._data.page_num = 2
+    assert fake._show_page() is False
+    assert fake._data.page_num == 1
+    assert capsys.readouterr().out == 'This page is not cached!\n'
+    fake._show_page()
+    assert shown == [1]
+
+
+def test_show_page_redownloads_missing_page(prefetch_ui, monkeypatch, tmp_path, capsys):
+    monkeypatch.chdir(tmp_path)
+    fake = prefetch_ui(2)
+    fake.use_ueberzug = False
+    downloaded = []
+    fake._download_save_images = lambda: downloaded.append(fake._data.page_num)
+    fake._prefetch_next_pages(fake._token)
+
+    # Page 2 was prefetched, but its dir is gone
+    fake._data.page_num = 2
+    fake._show_page()
+    assert downloaded == [2]
+
+    fake._data.page_num = 3
+    assert fake._show_page() is False
+    assert fake._data.page_num == 2
+    assert capsys.readouterr().out == 'This is the last page!\n'
+    assert downloaded == [2]
+
+
+def test_report_missing(tmp_path, capsys):
+    (tmp_path / '000_a.jpg').touch()
+    fake = FakePrefetchUI(1)
+    fake.use_ueberzug = False
+    fake._data = Mock(download_path=tmp_path, newnames_with_ext=['000_a.jpg', '001_b.jpg'])
+
+    fake._report_missing()
+
+    assert capsys.readouterr().out == 'Offline: 1 of 2 images of this page are not cached\n'
+
+
+def test_cancel_background_work_waits(prefetch_ui, monkeypatch):
+    fake = prefetch_ui(10)
+    started, finished = threading.Event(), []
+
+    def slow_download(data, tracker, priority, token):
+        started.set()
+        token.wait(5)
+        finished.append(data.page_num)
+    monkeypatch.setattr('koneko.download.init_download', slow_download)
+    fake._prefetching = False
+    fake._prefetch()
+    started.wait(5)
+
+    fake._cancel_background_work(wait=True)
+
+    assert not fake._prefetch_thread.is_alive()
+    assert finished == [2]
+
+
+def test_view_image_preview_ignores_hidden_files(monkeypatch, tmp_path):
+    for name in ('000_a.jpg', '001_b.jpg'):
+        (tmp_path / name).touch()
+    manifest.write(tmp_path, {'000_a.jpg': 'a', '001_b.jpg': 'b'})
+    (tmp_path / '.thumbnails').mkdir()
+    monkeypatch.setattr('koneko.printer.clear_screen', lambda: True)
+    monkeypatch.setattr('koneko.lscat.api', Mock())
+
+    view = ui.ViewImage.__new__(ui.ViewImage)
+    view._gdata = Mock(download_path=tmp_path)
+    for num, name in enumerate(('000_a.jpg', '001_b.jpg')):
+        view._selected_image_num = num
+        view.maybe_show_preview()
+        ui.lscat.api.show_center.assert_called_with(tmp_path / name)
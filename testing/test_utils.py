@@ -31,26 +31,26 @@ def test_spinner_with_exception(capsys):
 
 
 def test_catch_ctrl_c(monkeypatch):
-    mocked_system = Mock()
-    monkeypatch.setattr('koneko.utils.os.system', mocked_system)
+    mocked_clear = Mock()
+    monkeypatch.setattr('koneko.utils.printer.clear_screen', mocked_clear)
 
     def function_that_sends_ctrl_c():
         raise KeyboardInterrupt
 
     utils.catch_ctrl_c(function_that_sends_ctrl_c)()
-    assert mocked_system.call_args_list == [call('clear')]
+    assert mocked_clear.call_args_list == [call()]
 
 
 def test_max_terminal_scrolls_gallery(monkeypatch):
     monkeypatch.setattr('koneko.config.ncols_config', lambda: 6)
     monkeypatch.setattr('koneko.config.nrows_config', lambda: 5)
-    monkeypatch.setattr('koneko.utils.os.listdir', lambda *a: [0] * 10)
+    monkeypatch.setattr('koneko.utils.os.listdir', lambda *a: ['a.jpg'] * 10 + ['.b.jpg.part'])
     assert utils.max_terminal_scrolls(Mock(), True) == 10 // (6 * 5) + 1
 
 
 def test_max_terminal_scrolls_user(monkeypatch):
     monkeypatch.setattr('koneko.config.nrows_config', lambda: 5)
-    monkeypatch.setattr('koneko.utils.os.listdir', lambda *a: [0] * 10)
+    monkeypatch.setattr('koneko.utils.os.listdir', lambda *a: ['a.jpg'] * 10 + ['.b.jpg.part'])
     assert utils.max_terminal_scrolls(Mock(), False) == 10 // (4 * 5)
 
 
@@ -130,31 +130,27 @@ def test_handle_missing_pics_missing(monkeypatch, capsys):
         def exists(self):
             return False
 
-    mocked_system = Mock()
+    mocked_urlretrieve = Mock()
+    mocked_clear = Mock()
     mocked_path = FakePath()
     monkeypatch.setattr('koneko.utils.Path', mocked_path)
-    monkeypatch.setattr('koneko.utils.os.system', mocked_system)
+    monkeypatch.setattr('koneko.utils.urlretrieve', mocked_urlretrieve)
+    monkeypatch.setattr('koneko.utils.printer.clear_screen', mocked_clear)
 
     utils.handle_missing_pics()
     assert mocked_path.mock_calls == [call('~/.local/share/koneko/pics'), call().mkdir(parents=True)]
 
     assert capsys.readouterr().out == 'Please wait, downloading welcome image (this will only occur once)...\n'
 
-    # mocked_path doesn't play well with assert
-    #assert mocked_system.call_args_list == [
-    #    call(f'curl -s {baseurl}{pics[0]} -o {mocked_path}/{pics[0]}'),
-    #    call(f'curl -s {baseurl}{pics[1]} -o {mocked_path}/{pics[1]}'),
-    #    call('clear')
-    #]
-    assert mocked_system.call_args_list[2] == call('clear')
+    baseurl = 'https://raw.githubusercontent.com/twenty5151/koneko/master/pics/'
+    assert [args[0][0] for args in mocked_urlretrieve.call_args_list] == [
+        f'{baseurl}71471144_p0.png', f'{baseurl}79494300_p0.png'
+    ]
+    assert mocked_clear.call_args_list == [call()]
 
-    assert str(mocked_system.call_args_list[0]).split(' <FakePath')[0] == 'call("curl -s https://raw.githubusercontent.com/twenty5151/koneko/master/pics/71471144_p0.png -o'  # No ending quote and bracket
-
-    assert str(mocked_system.call_args_list[0]).split('/')[-1] == '71471144_p0.png")'
-
-    assert str(mocked_system.call_args_list[1]).split(' <FakePath')[0] == 'call("curl -s https://raw.githubusercontent.com/twenty5151/koneko/master/pics/79494300_p0.png -o'
-
-    assert str(mocked_system.call_args_list[1]).split('/')[-1] == '79494300_p0.png")'
+    assert [args[0][1].split('/')[-1] for args in mocked_urlretrieve.call_args_list] == [
+        '71471144_p0.png', '79494300_p0.png'
+    ]
 
 
 def test_max_images(monkeypatch):